@@ -6,7 +6,6 @@ import matplotlib.ticker as mticker
 import scipy.stats as st
 
 from cycler import cycler
-from pyextremes import get_extremes
 
 from .. import stats
 from .. import tables
@@ -42,8 +41,8 @@ def plot_return_levels(data, var, rl, output_file):
     if method == 'pot':
         r = rl.attrs['r']
         threshold = rl.attrs['threshold']
-        extremes = get_extremes(data[var], method="POT", 
-                                threshold=threshold, r=r)
+        extremes = stats.get_pot_extremes(data[var], 
+                                          threshold=threshold, r=r)
         it_selected_max = extremes.index.values
 
     elif method == 'AM':
@@ -291,6 +290,10 @@ def plot_multi_diagnostic_return_levels_uncertainty(data, var,
                                         threshold=None,
                                         yaxis='prob',
                                         uncertainty=None,
+                                        n_boot=1000,
+                                        seed=None,
+                                        n_jobs=1,
+                                        ci_method='bootstrap',
                                         output_file=None):
     """
     Plots empirical value plot along fitted distributions.
@@ -304,6 +307,11 @@ def plot_multi_diagnostic_return_levels_uncertainty(data, var,
     yaxis (str): Either 'prob' (default) or 'rp', displays probability of
     non-exceedance or return period on yaxis respectively.
     uncertainty (float): confidence interval between 0 and 1 (recommended 0.95)
+    n_boot (int): number of bootstrap replicates for the confidence interval
+    seed (int): seed of the bootstrap random generator, for reproducible intervals
+    n_jobs (int): number of processes used to fit the bootstrap replicates
+    ci_method (str): 'bootstrap' (default) or 'profile' for profile likelihood
+    confidence intervals
     output_file (str): path of the output file to save the plot, else None.
 
     return: plots the return value plot
@@ -359,12 +367,18 @@ def plot_multi_diagnostic_return_levels_uncertainty(data, var,
                                                 dist=dist,
                                                 threshold=threshold,
                                                 periods=periods,
-                                                uncertainty=uncertainty)
+                                                uncertainty=uncertainty,
+                                                n_boot=n_boot, seed=seed,
+                                                n_jobs=n_jobs,
+                                                ci_method=ci_method)
         elif dist in ['GEV','GUM']:
             df_model_rl_tmp = stats.return_levels_annual_max_uncertainty(data, var,
                                                        dist=dist,
                                                        periods=periods,
-                                                       uncertainty=uncertainty)
+                                                       uncertainty=uncertainty,
+                                                       n_boot=n_boot, seed=seed,
+                                                       n_jobs=n_jobs,
+                                                       ci_method=ci_method)
         elif dist in ['Weibull_3P']:
             df_model_rl_tmp = stats.return_levels_idm(data, var, 
                                                dist=dist, 
@@ -498,7 +512,7 @@ def plot_RVE_ALL(dataframe,var='hs',periods=np.array([1,10,100,1000]),distributi
         if threshold == 'default' :
             annual_maxima = df.resample('Y').max() 
             threshold=annual_maxima.min()
-        data = get_extremes(df, method="POT", threshold=threshold, r="48H")
+        data = stats.get_pot_extremes(df, threshold=threshold, r="48H")
     else:
         print ('Please check the method of filtering data')
     
@@ -873,15 +887,13 @@ def plot_bounds(file='NORA10_6036N_0336E.1958-01-01.2022-12-31.txt'):
     
     # Bootstrap to estimate confidence bounds
     num_bootstrap_samples = 1000
-    bootstrap_return_values = []
-    for _ in range(num_bootstrap_samples):
-        # Resample data with replacement
-        bootstrap_sample = np.random.choice(data, size=1000, replace=True)
-        
-        # Fit Weibull distribution to resampled data
-        shape_b, loc_b, scale_b = aux_funcs.Weibull_method_of_moment(bootstrap_sample)
-        # Calculate return values for resampled distribution
-        bootstrap_return_values.append(st.weibull_min.ppf(1 - 1 / return_periods, shape_b, loc_b, scale_b))
+    # Resample data with replacement, one bootstrap sample per row
+    bootstrap_samples = np.random.choice(data, size=(num_bootstrap_samples, 1000), replace=True)
+    # Fit Weibull distribution to all resampled data at once (one sample per column)
+    shape_b, loc_b, scale_b = aux_funcs.Weibull_method_of_moment(bootstrap_samples.T)
+    # Calculate return values for resampled distributions
+    bootstrap_return_values = st.weibull_min.ppf(1 - 1 / return_periods[np.newaxis, :], shape_b[:, np.newaxis], 
+                                                 loc_b[:, np.newaxis], scale_b[:, np.newaxis])
     
     # Calculate confidence bounds
     lower_bounds = np.percentile(bootstrap_return_values, 2.5, axis=0)
@@ -1090,8 +1102,8 @@ def plot_hs_for_given_wind(data: pd.DataFrame, var_hs: str, var_wind: str,output
 
     return fig
 
-def plot_profile_return_values(data,var=['W10','W50','W80','W100','W150'], z=[10, 50, 80, 100, 150], periods=[1, 10, 100, 10000],reverse_yaxis=False,title='Return Periods over z',units = 'm/s',distribution='Weibull3P',method='default',threshold='default', output_file='RVE_wind_profile.png'):
-    df = tables.table_profile_return_values(data,var=var, z=z, periods=periods,units = units ,distribution=distribution,method=method,threshold=threshold, output_file=None)
+def plot_profile_return_values(data,var=['W10','W50','W80','W100','W150'], z=[10, 50, 80, 100, 150], periods=[1, 10, 100, 10000],reverse_yaxis=False,title='Return Periods over z',units = 'm/s',distribution='Weibull3P',method='default',threshold='default', output_file='RVE_wind_profile.png', n_jobs=1):
+    df = tables.table_profile_return_values(data,var=var, z=z, periods=periods,units = units ,distribution=distribution,method=method,threshold=threshold, output_file=None, n_jobs=n_jobs)
     fig, ax = plt.subplots()
     df.columns = [col.replace('Return period ', '') for col in df.columns] # for legends
     plt.yticks(z)  # Set yticks to be the values in z
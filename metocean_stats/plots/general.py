@@ -3,6 +3,7 @@ import pandas as pd
 import seaborn as sns
 import scipy.stats as st
 import matplotlib.pyplot as plt
+from numpy.lib.stride_tricks import sliding_window_view
 
 import matplotlib as mpl
 from matplotlib.dates import MonthLocator, DateFormatter
@@ -575,7 +576,7 @@ def plot_monthly_weather_window(data: pd.DataFrame, var: str, threshold=5, windo
 
 
 def plot_monthly_weather_window_MultipleVariables(data: pd.DataFrame, var: str, threshold=[5], window_size=12, timestep=3, add_table=True, output_file: str = 'monthly_weather_window_plot.png'):
-    # var is a list of variables (max 3) as well as thresholds (one for each variable)
+    # var is a list of variables as well as thresholds (one for each variable)
     # adjusted by clio-met
     results_df = tables.table_monthly_weather_window(data=data, var=var, threshold=threshold, window_size=window_size, timestep=timestep)
     # Plot the results
@@ -803,25 +804,31 @@ def _weather_window_simulator(
             columns.append(c)
     limits.columns = columns
 
+    compare = {("upper","inclusive"): np.less_equal,
+               ("upper","exclusive"): np.less,
+               ("lower","inclusive"): np.greater_equal,
+               ("lower","exclusive"): np.greater}
+
     within_limits = {}
     for var,edge,inex in limits.columns:
-        lim = np.squeeze(limits[(var,edge,inex)].values)
-        shift = list(np.arange(0,-len(lim),-1,dtype=int))
-        table = data[var].shift(shift)
-
-        print(table.shape)
-        print(lim.shape)
-
-        if edge == "upper" and inex == "inclusive":
-            table = table <= lim
-        if edge == "upper" and inex == "exclusive":
-            table = table < lim
-        if edge == "lower" and inex == "inclusive":
-            table = table >= lim
-        if edge == "lower" and inex == "exclusive":
-            table = table > lim
-
-        within_limits[(var,edge,inex)] = table.all(axis=1)
+        lim = np.atleast_1d(np.squeeze(limits[(var,edge,inex)].values))
+        values = data[var].to_numpy(dtype=float)
+        n_start = len(values) - len(lim) + 1
+        # Operations which would end after the last timestamp are never within limits
+        table = np.zeros(len(values), dtype=bool)
+        if n_start > 0 and np.all(lim == lim[0]):
+            # Constant limit: count the steps within limits over the window with a cumulative sum
+            count = np.concatenate(([0], np.cumsum(compare[(edge,inex)](values, lim[0]))))
+            table[:n_start] = (count[len(lim):] - count[:n_start]) == len(lim)
+        elif n_start > 0:
+            # Limit varying during the operation: windows are views on the data, 
+            # compared in chunks to keep the memory use bounded
+            windows = sliding_window_view(values, len(lim))
+            chunk = max(1, 2**22 // len(lim))
+            for i in range(0, n_start, chunk):
+                rows = slice(i, min(i+chunk, n_start))
+                table[rows] = compare[(edge,inex)](windows[rows], lim).all(axis=1)
+        within_limits[(var,edge,inex)] = pd.Series(table, index=data.index)
     
     within_limits = pd.DataFrame(within_limits)
 
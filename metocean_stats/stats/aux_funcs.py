@@ -55,36 +55,166 @@ def wind_correction_nora10(df,var='W10'):
     
     return df 
 
+def _weibull_skewness(c):
+    """
+    Skewness of the Weibull distribution as a function of the shape c.
+    """
+    g1 = gamma(1+1/c)
+    g2 = gamma(1+2/c)
+    g3 = gamma(1+3/c)
+    return (g3-3*g1*g2+2*g1**3)/(g2-g1**2)**1.5
+
+
+# Lookup table of the Weibull skewness on its positive branch, i.e. for shapes
+# up to the root of the skewness (c~3.6), where the skewness is monotonically decreasing
+_WEIBULL_SHAPE_TABLE = np.geomspace(0.05, 3.6, 2000)
+_WEIBULL_SKEW_TABLE = _weibull_skewness(_WEIBULL_SHAPE_TABLE)
+
+
 def Weibull_method_of_moment(X):
+    """
+    Fits a 3-parameter Weibull distribution with the method of moments.
+    The shape is found from the absolute value of the skewness by interpolation
+    in a precomputed table refined with Newton steps, then the scale and the
+    location follow analytically from the variance and the mean.
+
+    Parameters
+    ----------
+    X: 1D or 2D array-like
+        Data to fit. A 2D array is fitted column by column (NaNs are ignored,
+        so columns of different lengths can be padded with NaNs), 
+        e.g. several months or several levels in one call.
+
+    Returns
+    -------
+    cHat, aHat, bHat: float or 1D ndarray
+        Shape, location and scale. Arrays with one value per column if X is 2D.
+    """
+    X = np.asarray(X, dtype=float)
+    m1 = np.nanmean(X, axis=0)
+    cm2 = np.nanmean((X-m1)**2, axis=0)
+    cm3 = np.nanmean((X-m1)**3, axis=0)
+    # The data are shifted by 0.0001, which only affects the mean
+    m1 = m1 + 0.0001
+
+    with np.errstate(all='ignore'):
+        skew = np.abs(cm3)/cm2**1.5
+        # The skewness decreases with the shape, reverse the table for the interpolation
+        cHat = np.interp(skew, _WEIBULL_SKEW_TABLE[::-1], _WEIBULL_SHAPE_TABLE[::-1])
+        for _ in range(3):
+            dc = 1e-6*cHat
+            slope = (_weibull_skewness(cHat+dc)-_weibull_skewness(cHat-dc))/(2*dc)
+            step = np.where(slope != 0, (_weibull_skewness(cHat)-skew)/slope, 0)
+            cHat = np.clip(cHat-step, _WEIBULL_SHAPE_TABLE[0], _WEIBULL_SHAPE_TABLE[-1])
+        g1 = gamma(1+1/cHat)
+        bHat = np.sqrt(cm2/(gamma(1+2/cHat)-g1**2)) # scale
+        aHat = m1-bHat*g1 # location
 
-    X=X+0.0001
-    #n=len(X);
-    m1 = np.mean(X)
-    #cm1=np.mean((X-np.mean(X))**1)
-    #m2 = np.var(X)
-    cm2=np.mean((X-np.mean(X))**2)
-    #m3 = stats.skew(X)
-    cm3 = np.mean((X-np.mean(X))**3)
-   
-    def m1fun(a,b,c):
-        return a+b*gamma(1+1/c)
-    def cm2fun(b,c):
-        return b**2*(gamma(1+2/c)-gamma(1+1/c)**2)
-    def cm3fun(b,c):
-        return b**3*(gamma(1+3/c)-3*gamma(1+1/c)*gamma(1+2/c)+2*gamma(1+1/c)**3)
-    def cfun(c):
-        return abs(np.sqrt(cm3fun(1,c)**2/cm2fun(1,c)**3)-np.sqrt(cm3**2/cm2**3))
-   
-    cHat = fminbound(cfun, -2, 5) # shape
-    def bfun(b):
-        return abs(cm2fun(b,cHat)-cm2)
-    bHat = fminbound(bfun,-5,30) # scale
-    def afun(a):
-        return abs(m1fun(a,bHat,cHat)-m1)
-    aHat = fminbound(afun,-5,30) # location
-  
     return cHat, aHat, bHat # shape, location, scale
 
+def sample_lmoments(X, axis=0):
+    """
+    Sample L-moments computed from the unbiased probability weighted moments
+    in one sorted pass (Hosking, 1990).
+
+    Parameters
+    ----------
+    X: 1D or 2D array-like
+        Data. NaNs are dropped from 1D data.
+    axis: int
+        Axis along which the L-moments are computed for 2D data, default is 0
+
+    Returns
+    -------
+    l1, l2, t3: float or 1D ndarray
+        Mean, L-scale and L-skewness
+    """
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[~np.isnan(X)]
+    X = np.moveaxis(np.sort(X, axis=axis), axis, -1)
+    n = X.shape[-1]
+    i = np.arange(n)
+    b0 = X.mean(axis=-1)
+    b1 = (X*i).sum(axis=-1)/(n*(n-1))
+    b2 = (X*i*(i-1)).sum(axis=-1)/(n*(n-1)*(n-2))
+    l1 = b0
+    l2 = 2*b1-b0
+    l3 = 6*b2-6*b1+b0
+    return l1, l2, l3/l2
+
+
+def lmoments_fit(X, dist, axis=0):
+    """
+    Fits a distribution with the method of L-moments, using the closed-form
+    or rational approximations of Hosking (1990) and Hosking & Wallis (1997).
+    The parameters follow the scipy.stats conventions.
+
+    Parameters
+    ----------
+    X: 1D or 2D array-like
+        Data to fit, 2D arrays are fitted along axis
+    dist: string
+        'GEV', 'GUM', 'GUM_L', 'EXP', 'GP', 'Weibull_2P' (or 'Weibull2P', 
+        location fixed to 0) or 'Weibull_3P' (or 'Weibull3P')
+    axis: int
+        Axis along which to fit for 2D data, default is 0
+
+    Returns
+    -------
+    shape, loc, scale: float or 1D ndarray
+        Parameters of the distribution, shape is nan for 2-parameter distributions
+    """
+    l1, l2, t3 = sample_lmoments(X, axis=axis)
+    shape = np.nan*l1
+    euler = 0.5772156649
+    with np.errstate(all='ignore'):
+        if dist in ['GEV', 'Weibull_3P', 'Weibull3P']:
+            if dist != 'GEV':
+                # -X follows a GEV distribution with shape 1/c
+                l1, t3 = -l1, -t3
+            z = 2/(3+t3)-np.log(2)/np.log(3)
+            k = 7.8590*z+2.9554*z**2
+            # Newton steps on the exact L-skewness relation, as the 
+            # approximation above is only accurate for -0.5 < k < 0.5
+            for _ in range(3):
+                f = 2*(1-3**(-k))/(1-2**(-k))-3-t3
+                dk = 1e-6*np.where(np.abs(k) > 1e-3, np.abs(k), 1e-3)
+                slope = (2*(1-3**(-k-dk))/(1-2**(-k-dk))-2*(1-3**(-k+dk))/(1-2**(-k+dk)))/(2*dk)
+                k = np.where(np.isfinite(f/slope), k-f/slope, k)
+            small = np.abs(k) < 1e-6
+            k_ = np.where(small, 1, k)
+            g = gamma(1+k_)
+            scale = np.where(small, l2/np.log(2), l2*k_/((1-2**(-k_))*g))
+            loc = np.where(small, l1-euler*scale, l1-scale*(1-g)/k_)
+            if dist == 'GEV':
+                # scipy's genextreme shape has the same sign as Hosking's
+                shape = k
+            else:
+                shape = 1/k
+                loc = -(loc+scale/k)
+                scale = scale/k
+        elif dist in ['GUM', 'GUM_L']:
+            scale = l2/np.log(2)
+            loc = l1-euler*scale if dist == 'GUM' else l1+euler*scale
+        elif dist == 'EXP':
+            scale = 2*l2
+            loc = l1-scale
+        elif dist == 'GP':
+            k = (1-3*t3)/(1+t3)
+            scale = (1+k)*(2+k)*l2
+            loc = l1-(2+k)*l2
+            # scipy's genpareto shape has the opposite sign of Hosking's
+            shape = -k
+        elif dist in ['Weibull_2P', 'Weibull2P']:
+            shape = -np.log(2)/np.log(1-l2/l1)
+            loc = 0*l1
+            scale = l1/gamma(1+1/shape)
+        else:
+            raise ValueError('please check distribution, L-moments fitting is available for: '
+                             'GEV, GUM, GUM_L, EXP, GP, Weibull_2P and Weibull_3P')
+    return shape, loc, scale
+
 def add_direction_sector(data,var_dir,num=12):
     """
     Add a column "direction_sector" to a dataframe, which gives the directional sector.
@@ -118,62 +248,96 @@ def consecutive_indices(lst):
     return result
 
 
-def Hs_Tp_curve(data,pdf_Hs,pdf_Hs_Tp,f_Hs_Tp,h,t,interval,X=100):
+def Hs_Tp_curves(data,pdf_Hs,pdf_Hs_Tp,f_Hs_Tp,h,t,interval,periods=[100]):
+    """
+    Hs-Tp contours of the LoNoWe model for several return periods.
+    The Weibull marginal of Hs is fitted once. For each period, the two Tp 
+    crossings of the iso-density level are found for all Hs of the grid at
+    once from the sign changes of f_Hs_Tp - f3_, and linearly interpolated
+    between the grid points. Only Hs with exactly two crossings, and at 
+    least two Tp grid points between them, are kept.
+
+    Parameters
+    ----------
+    data: 1D array
+        Hs time series
+    pdf_Hs: 1D array
+        Marginal pdf of Hs on the grid h
+    pdf_Hs_Tp, f_Hs_Tp: 2D arrays
+        Joint pdf and conditional pdf of Tp given Hs on the grid (h, t)
+    h, t: 1D arrays
+        Hs and Tp grids
+    interval: float
+        Time step of the data in hours
+    periods: list
+        Return periods in years
 
+    Returns
+    -------
+    List of (t3, h3, X, df) for each period, as returned by Hs_Tp_curve
+    """
     # RVE of X years 
     shape, loc, scale = Weibull_method_of_moment(data) # shape, loc, scale
-    
-    if X == 1 : 
-        period=1.5873*365.2422*24/interval
-    else :
-        period=X*365.2422*24/interval
-    rve_X = st.weibull_min.isf(1/period, shape, loc, scale)
-    
-    # Find index of Hs=value
-    epsilon = abs(h - rve_X)
-    param, prov = find_peaks(1/epsilon) # to find the index of bottom
-    if len(param) == 0:
-        param = [np.argmax(1/epsilon)] 
-    index = param[0]     # the  index of Hs=value
-    
-    # Find peak of pdf at Hs=RVE of X year 
-    pdf_Hs_Tp_X = pdf_Hs_Tp[index,:] # Find pdf at RVE of X year 
-    param, prov = find_peaks(pdf_Hs_Tp_X) # find the peak
-    if len(param) == 0:
-        param = [np.argmax(pdf_Hs_Tp_X)] 
-    index = param[0]
-    f_Hs_Tp_100=pdf_Hs_Tp_X[index]
+    curves = []
+    for X in periods:
+        if X == 1 : 
+            period=1.5873*365.2422*24/interval
+        else :
+            period=X*365.2422*24/interval
+        rve_X = st.weibull_min.isf(1/period, shape, loc, scale)
+    
+        # Find index of Hs=value
+        index = np.argmin(abs(h - rve_X))  # the  index of Hs=value
+    
+        # Find peak of pdf at Hs=RVE of X year 
+        pdf_Hs_Tp_X = pdf_Hs_Tp[index,:] # Find pdf at RVE of X year 
+        param, prov = find_peaks(pdf_Hs_Tp_X) # find the peak
+        if len(param) == 0:
+            param = [np.argmax(pdf_Hs_Tp_X)] 
+        index = param[0]
+        f_Hs_Tp_100=pdf_Hs_Tp_X[index]
+
+        # Difference to the iso-density level for the whole grid, 
+        # crossings are where it changes sign between two Tp grid points
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f3_ = f_Hs_Tp_100/pdf_Hs
+            diff = f_Hs_Tp - f3_[:, np.newaxis]
+        above = diff > 0
+        crossing = above[:, 1:] != above[:, :-1]
+        rows = np.flatnonzero(crossing.sum(axis=1) == 2)
+        j = np.nonzero(crossing[rows])[1].reshape(-1, 2)
+        # Rows with a single Tp grid point inside the contour (at its top or 
+        # bottom) give a degenerate segment of nearly zero width and are dropped
+        wide = j[:, 1] - j[:, 0] >= 2
+        rows, j = rows[wide], j[wide]
+        d0 = diff[rows[:, np.newaxis], j]
+        d1 = diff[rows[:, np.newaxis], j+1]
+        tc = t[j] + (t[j+1]-t[j])*d0/(d0-d1)
+
+        h1=h[rows]
+        t1=tc[:, 0]
+        t2=tc[:, 1]
+        t3 = np.concatenate((t1, t2[::-1])) # to get correct circle order 
+        h3 = np.concatenate((h1, h1[::-1])) # to get correct circle order 
+        t3 = np.concatenate((t3, t1[0:1])) # connect the last to the first point  
+        h3 = np.concatenate((h3, h1[0:1])) # connect the last to the first point  
+
+        df = pd.DataFrame()
+        df['hs']=h1
+        df['t1']=t1
+        df['t2']=t2
+        curves.append((t3,h3,X,df))
+    
+    return curves
 
-    
-    h1=[]
-    t1=[]
-    t2=[]
-    for i in range(len(h)):
-        f3_ = f_Hs_Tp_100/pdf_Hs[i]
-        f3 = f_Hs_Tp[i,:]
-        epsilon = abs(f3-f3_) # the difference 
-        para = find_peaks(1/epsilon) # to find the bottom
-        index = para[0]
-        if t[index].shape[0] == 2 :
-            h1.append(h[i])
-            t1.append(t[index][0])
-            t2.append(t[index][1])
-    
-    h1=np.asarray(h1)
-    t1=np.asarray(t1)
-    t2=np.asarray(t2)
-    t3 = np.concatenate((t1, t2[::-1])) # to get correct circle order 
-    h3 = np.concatenate((h1, h1[::-1])) # to get correct circle order 
-    t3 = np.concatenate((t3, t1[0:1])) # connect the last to the first point  
-    h3 = np.concatenate((h3, h1[0:1])) # connect the last to the first point  
 
-    df = pd.DataFrame()
-    df['hs']=h1
-    df['t1']=t1
-    df['t2']=t2
-    
-    return t3,h3,X,df
-    
+def Hs_Tp_curve(data,pdf_Hs,pdf_Hs_Tp,f_Hs_Tp,h,t,interval,X=100):
+    """
+    Hs-Tp contour of the LoNoWe model for a return period of X years,
+    see Hs_Tp_curves.
+    """
+    return Hs_Tp_curves(data,pdf_Hs,pdf_Hs_Tp,f_Hs_Tp,h,t,interval,periods=[X])[0]
+
 
 
 def Gauss3(x, a1, a2):
@@ -275,14 +439,13 @@ def find_percentile(data,pdf_Hs_Tp,h,t,p,periods,interval):
 def calculate_Us_Tu(H_s, T_p, depth, ref_depth,spectrum='JONSWAP'):
     df = 0.01
     f=np.arange(0,1,df)
-    S_u = np.zeros((len(H_s),len(f)))
-    for i in range(len(H_s)):
-        if spectrum=='JONSWAP':
-            E = spec_funcs.jonswap(f=f,hs=H_s[i],tp=T_p[i])
-        elif spectrum=='TORSEHAUGEN':
-            E = spec_funcs.torsethaugen(f=f,hs=H_s[i],tp=T_p[i]) 
+    # Spectra of all sea states at once, shape (number of sea states, frequencies)
+    if spectrum=='JONSWAP':
+        E = spec_funcs.jonswap(f=f,hs=np.asarray(H_s),tp=np.asarray(T_p))
+    elif spectrum=='TORSEHAUGEN':
+        E = spec_funcs.torsethaugen(f=f,hs=np.asarray(H_s),tp=np.asarray(T_p)) 
 
-        S_u[i,:] = spec_funcs.velocity_spectrum(f, E, depth=depth, ref_depth=ref_depth)
+    S_u = spec_funcs.velocity_spectrum(f, E, depth=depth, ref_depth=ref_depth)
     
     M0 = np.trapezoid(S_u*df,axis=1)
     M2 = np.trapezoid((f**2)*S_u*df,axis=1)
@@ -290,7 +453,6 @@ def calculate_Us_Tu(H_s, T_p, depth, ref_depth,spectrum='JONSWAP'):
     Tu = np.sqrt(M0/M2)
     return Us, Tu
 
-# Define the function H(U)
 def Hs_as_function_of_U(U, a, b, c, d):
     return a + b * U**(c + d * U)
 
@@ -517,14 +679,16 @@ def depth_of_wave_influence(Hs, Tp, ref_depth,spectrum='JONSWAP', theshold=0.01)
     Find the depth at which wave-induced current (Us) is zero.
     
     Parameters:
-    - Hs: float-type, value of significant wave height.
-    - Tp: float-type, value of peak wave period.
+    - Hs: float-type or array, value(s) of significant wave height.
+    - Tp: float-type or array, value(s) of peak wave period.
     - ref_depth: float, reference depth.
     - spectrum: type of spectrum, 'JONSWAP' or 'TORSEHAUGEN'
     - theshold: minimum value in m/s for the wave-induced current to considered important default (0.01 m/s) 
     
     Returns:
-    - depth: float, total depth of wave influence
+    - depth: float, total depth of wave influence (None if Us never exceeds theshold),
+      or an array with one depth per sea state (nan if Us never exceeds theshold)
+      when Hs and Tp are arrays
     """
     df = 0.01
     f=np.arange(0,1,df)
@@ -533,15 +697,30 @@ def depth_of_wave_influence(Hs, Tp, ref_depth,spectrum='JONSWAP', theshold=0.01)
     elif spectrum=='TORSEHAUGEN':
         E = spec_funcs.torsethaugen(f=f,hs=Hs,tp=Tp) 
 
+    # Depth-attenuation matrix of the velocity spectrum on the 0.5 m depth grid,
+    # multiplied by the trapezoidal weights, shape (depths, frequencies)
     depth_list = np.arange(0,ref_depth+0.5,0.5)
-    for depth in depth_list[::-1]:
-        S_u = spec_funcs.velocity_spectrum(f, E, depth=depth, ref_depth=ref_depth)
-        M0 = np.trapz(S_u, x = f)
-        Us = 2 * np.sqrt(M0)
-        if Us>theshold:
-            return depth
-        
-
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        G2 = spec_funcs.velocity_spectrum(f, np.ones_like(f), depth=depth_list[:,None], ref_depth=ref_depth)
+    w = np.zeros_like(f)
+    w[:-1] += np.diff(f)/2
+    w[1:] += np.diff(f)/2
+    G2w = (G2*w).T
+
+    # Us for all sea states and depths, the deepest depth with Us>theshold is kept
+    E2 = E.reshape(-1, f.size)
+    depth = np.full(E2.shape[0], np.nan)
+    chunk = 10000
+    for i in range(0, E2.shape[0], chunk):
+        with np.errstate(invalid='ignore', over='ignore'):
+            Us = 2 * np.sqrt(E2[i:i+chunk] @ G2w)
+        above = Us > theshold
+        last = depth_list.size - 1 - np.argmax(above[:, ::-1], axis=1)
+        depth[i:i+chunk] = np.where(above.any(axis=1), depth_list[last], np.nan)
+
+    if E.ndim == 1:
+        return None if np.isnan(depth[0]) else depth[0]
+    return depth.reshape(E.shape[:-1])
 
 def estimate_wind_speed(height1, wind_speed1, time1, height2, time2):
     """
@@ -1,3 +1,7 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,12 +11,12 @@ from scipy.signal import find_peaks
 from scipy.optimize import curve_fit, minimize
 
 from . import aux_funcs
+from . import spec_funcs
 
-from pyextremes import get_extremes, get_return_periods
 
 def return_levels_pot(data, var, dist='Weibull_2P', 
                       periods=[50, 100, 1000], 
-                      threshold=None, r="48h"):
+                      threshold=None, r="48h", fit_method='mle'):
     """
     Calulates return value estimates for different periods, fitting a 
     given distribution to threshold excess values of the data.  
@@ -25,6 +29,8 @@ def return_levels_pot(data, var, dist='Weibull_2P',
                                 value estimates
     threshold (float): Threshold used to define the extremes
     r (str): Minimum period of time between two peaks. Default 48h.
+    fit_method (str): 'mle' (default) for maximum likelihood or 'lmom' 
+                      for L-moments
     
     return (pandas DataFrame): return levels estimates and corresponding
                                probability of non-exceedance indexed by 
@@ -36,36 +42,17 @@ def return_levels_pot(data, var, dist='Weibull_2P',
     Function written by dung-manh-nguyen and KonstantinChri.
     """
 
+    if dist not in ['Weibull_2P', 'EXP', 'GP']:
+        print ('please check method/distribution, must be one of: EXP, \
+                GP or Weibull_2P')
+
     if threshold is None:
         threshold = get_threshold_os(data=data, var=var)
     
-    extremes = get_extremes(data[var], method="POT", threshold=threshold, r=r)
-    
-    years = data.index.year
-    yr_num = years[-1]-years[0]+1
-    length_data = extremes.shape[0]
-    # in hours 
-    time_step = yr_num*365.2422*24/length_data
-    # years is converted to K-th
-    return_periods = np.array(periods)*24*365.2422/time_step
-    
-    if dist == 'Weibull_2P':
-        shape, loc, scale = st.weibull_min.fit(extremes-threshold, floc=0)
-        return_levels = st.weibull_min.isf(1/return_periods, 
-                                              shape, loc, scale)\
-                                              + threshold
-    elif dist == 'EXP':
-        loc, scale = st.expon.fit(extremes-threshold)
-        return_levels = st.expon.isf(1/return_periods, loc, scale)\
-                                        + threshold
-    elif dist == 'GP':
-        shape, loc, scale = st.genpareto.fit(extremes-threshold)
-        return_levels = st.genpareto.isf(1/return_periods, 
-                                            shape, loc, scale)\
-                                            + threshold
-    else:
-        print ('please check method/distribution, must be one of: EXP, \
-                GP or Weibull_2P')
+    # The fit is shared with previous calls on the same data and options
+    model = fit_extreme_model(data, var, method='POT', dist=dist, threshold=threshold,
+                              r=r, fit_method=fit_method)
+    return_levels = model.return_levels(periods)
                            
     df = pd.DataFrame({'return_levels':return_levels,
                        'periods': periods})
@@ -82,7 +69,7 @@ def return_levels_pot(data, var, dist='Weibull_2P',
 
 
 def return_levels_annual_max(data, var='hs', dist='GEV', 
-                             periods=[50, 100, 1000]): 
+                             periods=[50, 100, 1000], fit_method='mle'): 
     """
     Calulates return value estimates for different periods, fitting a 
     Generalized Extreme Value ('GEV') or a Gumbel ('GUM') distribution to given 
@@ -94,6 +81,8 @@ def return_levels_annual_max(data, var='hs', dist='GEV',
                                 value estimates
     method (str): Distribution to fit to the data. Either 'GEV' for Generalized
     Extreme Value or 'GUM' for Gumbel.
+    fit_method (str): 'mle' (default) for maximum likelihood or 'lmom' 
+                      for L-moments
     
     return (pandas DataFrame): return levels estimates and corresponding
                                probability of non-exceedance indexed by 
@@ -103,28 +92,19 @@ def return_levels_annual_max(data, var='hs', dist='GEV',
     
     Function written by dung-manh-nguyen and KonstantinChri.   
     """
-    it_selected_max = data.groupby(data.index.year)[var].idxmax().values
-    # get annual maximum with actual dates that maximum occured
-    data_am = data[var].loc[it_selected_max] 
     periods = np.array(periods, dtype=float)
     for i in range(len(periods)) :
         if periods[i] == 1 : 
             periods[i] = 1.6
 
-    if dist == 'GEV':
-        # fit data
-        shape, loc, scale = st.genextreme.fit(data_am) 
-        # Compute the return levels for several return periods       
-        return_levels = st.genextreme.isf(1/periods, shape, loc, scale)
-
-    elif dist == 'GUM': 
-        loc, scale = st.gumbel_r.fit(data_am) # fit data
-        # Compute the return levels for several return periods.
-        return_levels = st.gumbel_r.isf(1/periods, loc, scale)
-
-    else:
+    if dist not in ['GEV', 'GUM']:
         print ('please check method/distribution, must be either GEV or GUM')
 
+    # The fit is shared with previous calls on the same data and options
+    model = fit_extreme_model(data, var, method='AM', dist=dist, fit_method=fit_method)
+    # Compute the return levels for several return periods
+    return_levels = model.return_levels(periods)
+
     df = pd.DataFrame({'return_levels':return_levels,
                        'periods': periods})
     df = df.set_index('periods')
@@ -137,6 +117,101 @@ def return_levels_annual_max(data, var='hs', dist='GEV',
     return df
 
 
+def get_annual_maxima(data, var='hs', previous=None):
+    """
+    Annual maxima of a time series, indexed by the dates at which they occured.
+
+    data (pd.DataFrame): dataframe containing the time series
+    var (str): name of the variable
+    previous (pd.Series): annual maxima from an earlier call. If given, data 
+                          only needs to contain the new part of the time series 
+                          (e.g. newly arrived hindcast years), the maxima of the 
+                          years present in both are merged and the others are 
+                          kept as they are.
+
+    return (pd.Series): annual maxima sorted by date
+    """
+    it_selected_max = data.groupby(data.index.year)[var].idxmax().values
+    maxima = data[var].loc[it_selected_max]
+    if previous is not None:
+        combined = pd.concat([previous, maxima])
+        # keep the largest value of each year, positions avoid duplicated dates
+        pos = pd.Series(combined.to_numpy()).groupby(combined.index.year.to_numpy()).idxmax().to_numpy()
+        maxima = combined.iloc[pos]
+    return maxima.sort_index()
+
+
+def rolling_return_levels(data, var='hs', dist='GEV', periods=[50, 100, 1000],
+                          window=30, step=1, expanding=False, warm_start=True,
+                          fit_method='mle', maxima=None):
+    """
+    Return levels from annual maxima fits on sliding (or expanding) windows of 
+    years, to follow how design values drift as new years arrive. The annual 
+    maxima are extracted once and each window is a slice of them, and each fit 
+    starts from the parameters of the previous window.
+
+    data (pd.DataFrame): dataframe containing the time series, not used if 
+                         maxima is given
+    var (str): name of the variable
+    dist (str): 'GEV' or 'GUM'
+    periods (1D-array or list): return periods in years
+    window (int): number of years (annual maxima) in each window, or in the 
+                  first window if expanding
+    step (int): number of years between the ends of two windows
+    expanding (bool): if True, all windows start at the first year
+    warm_start (bool): if True (default), each fit starts from the parameters 
+                       of the previous window, which needs fewer iterations
+                       but may differ slightly from independent fits
+    fit_method (str): 'mle' (default) for maximum likelihood or 'lmom' for 
+                      L-moments, which fits all sliding windows at once
+    maxima (pd.Series): annual maxima, e.g. from get_annual_maxima with the 
+                        previous argument to add new data incrementally
+
+    return (pandas DataFrame): return levels indexed by the last year of each 
+                               window, with one column per period. 
+                               Also contains attrs for the method, 
+                               the distribution and the window.
+    """
+    periods = np.array(periods, dtype=float)
+    periods[periods == 1] = 1.6
+
+    if dist not in ['GEV', 'GUM']:
+        print ('please check method/distribution, must be either GEV or GUM')
+
+    if maxima is None:
+        maxima = get_annual_maxima(data, var)
+    years = maxima.index.year.to_numpy()
+    values = maxima.to_numpy(dtype=float)
+    if window > len(values):
+        raise ValueError(f'window ({window} years) is longer than the {len(values)} years of data')
+
+    ends = np.arange(window, len(values)+1, step)
+    starts = np.zeros_like(ends) if expanding else ends - window
+    if fit_method == 'lmom' and not expanding:
+        # all windows have the same length, L-moments fit them at once
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)[starts]
+        params = _fit_params_chunk(windows, dist, fit_method=fit_method)
+    else:
+        params = np.empty((len(ends), 3))
+        guess = None
+        for i, (i0, i1) in enumerate(zip(starts, ends)):
+            params[i] = _fit_params(values[i0:i1], dist, guess=guess, fit_method=fit_method)
+            if warm_start:
+                guess = params[i]
+
+    return_levels = _isf_params(dist, 1/periods[None, :], params[:, 0, None], 
+                                params[:, 1, None], params[:, 2, None])
+    df = pd.DataFrame(return_levels, columns=periods,
+                      index=pd.Index(years[ends-1], name='window_end'))
+    df.attrs['method'] = 'AM'
+    df.attrs['dist'] = dist
+    df.attrs['var'] = var
+    df.attrs['window'] = window
+    df.attrs['expanding'] = expanding
+
+    return df
+
+
 def return_levels_idm(data, var, dist='Weibull_3P', 
                       periods=[50, 100, 1000]):
     """
@@ -214,6 +289,330 @@ def get_threshold_os(data, var):
     return min_ym
 
 
+def _decluster_pot(times, values, r="48h"):
+    """
+    Cluster maxima of exceedances given as time ordered arrays of times 
+    (datetime64) and values. Clusters are separated by gaps larger than r.
+    """
+    if len(values) == 0:
+        return times, values
+    # A new cluster starts at the first exceedance and after every gap larger than r
+    gaps = np.diff(times) > pd.to_timedelta(r).to_timedelta64()
+    starts = np.concatenate(([0], np.flatnonzero(gaps) + 1))
+    cluster = np.cumsum(np.concatenate(([True], gaps))) - 1
+    cluster_max = np.maximum.reduceat(values, starts)
+    # First position of the maximum within each cluster
+    is_max = np.flatnonzero(values == cluster_max[cluster])
+    first = is_max[np.concatenate(([True], np.diff(cluster[is_max]) > 0))]
+    return times[first], values[first]
+
+
+def get_pot_extremes(ts, threshold, r="48h"):
+    """
+    Peaks over threshold: finds the exceedances of a time series above
+    a threshold, groups them into clusters separated by gaps larger than r, 
+    and returns the maximum of each cluster (first occurrence in case of ties).
+    Works directly on the underlying arrays and returns the same series as
+    pyextremes.get_extremes(ts, method="POT", threshold=threshold, r=r).
+    
+    Parameters
+    ----------
+    ts: pd.Series
+        Time series with a DatetimeIndex
+    threshold: float
+        Threshold used to define the exceedances
+    r: string or pd.Timedelta
+        Minimum period of time between two clusters. Default is '48h'.
+    
+    Returns
+    ------- 
+    extremes: pd.Series
+        Cluster maxima indexed by the time at which they occurred
+    """
+    values = ts.to_numpy(dtype=float)
+    times = ts.index.to_numpy()
+    above = values > threshold
+    extremes_times, extremes_values = _decluster_pot(times[above], values[above], r)
+
+    return pd.Series(data=extremes_values,
+                     index=pd.Index(data=extremes_times, name=ts.index.name or "date-time"),
+                     dtype=np.float64,
+                     name=ts.name or "extreme values")
+
+
+def _block_maxima(ts, block_size="365.2425D"):
+    """
+    Block maxima of a time series, with blocks of block_size starting at the 
+    first time step (first occurrence of the maximum in each block). 
+    Same series as pyextremes.get_extremes(ts, method="BM", block_size=block_size).
+    """
+    block_size = pd.to_timedelta(block_size)
+    n_blocks = int((ts.index.max() - ts.index.min()) / block_size) + 1
+    blocks = ((ts.index - ts.index[0]) // block_size).to_numpy()
+    if len(np.unique(blocks)) < n_blocks:
+        raise ValueError(f'{n_blocks - len(np.unique(blocks))} blocks contain no data, '
+                         'fill gaps in the data')
+    pos = pd.Series(ts.to_numpy(dtype=float)).groupby(blocks).idxmax().to_numpy()
+    return pd.Series(data=ts.to_numpy(dtype=float)[pos],
+                     index=pd.Index(data=ts.index[pos], name=ts.index.name or "date-time"),
+                     dtype=np.float64,
+                     name=ts.name or "extreme values")
+
+
+# (alpha, beta) of the plotting positions p = (rank - alpha)/(n + 1 - alpha - beta)
+_PLOTTING_POSITIONS = {'weibull': (0, 0), 'hazen': (0.5, 0.5), 'gringorten': (0.44, 0.44)}
+
+
+def _empirical_return_periods(extremes, rate, plotting_position='weibull'):
+    """
+    Exceedance probabilities and return periods of extremes from their ranks 
+    (largest first, average rank for ties), with rate extremes per return period.
+    """
+    try:
+        alpha, beta = _PLOTTING_POSITIONS[plotting_position.lower()]
+    except KeyError:
+        raise ValueError(f'Unknown plotting position {plotting_position}, must be one of: '
+                         f'{", ".join(_PLOTTING_POSITIONS)}')
+    values = np.asarray(extremes, dtype=float)
+    n = len(values)
+    # One sort, ties share the average of their ranks
+    order = np.argsort(-values, kind='stable')
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1])))
+    counts = np.diff(np.append(starts, n))
+    ranks = np.empty(n)
+    ranks[order] = np.repeat(starts + (counts + 1)/2, counts)
+    exceedance_probability = (ranks - alpha) / (n + 1 - alpha - beta)
+    return exceedance_probability, 1/exceedance_probability/rate
+
+
+def _block_rate(extremes, return_period_size):
+    """
+    Number of block maxima per return period, with the block length taken as 
+    the median time between the maxima (as in pyextremes.get_return_periods).
+    """
+    block = pd.to_timedelta(np.quantile(np.diff(extremes.index), 0.5))
+    return pd.to_timedelta(return_period_size)/block
+
+
+def _empirical_frame(extremes, rate, plotting_position):
+    """DataFrame of return levels, return periods and exceedance probabilities."""
+    prob, rp = _empirical_return_periods(extremes, rate, plotting_position)
+    return pd.DataFrame({'return_levels': extremes.to_numpy(dtype=float),
+                         'return_periods': rp,
+                         'exceedance_probability': prob},
+                        index=extremes.index, dtype=np.float64)
+
+
+def _as_frame(chunk, variables):
+    """Columns of a chunk (pd.DataFrame, or xarray.Dataset with a time dimension)."""
+    if not isinstance(chunk, pd.DataFrame):
+        chunk = chunk[variables].to_dataframe()
+    return chunk[variables]
+
+
+class AnnualMaximaStream:
+    """
+    Running annual maxima of one or several variables over time ordered chunks 
+    of a time series that does not fit in memory. Only the maximum and its 
+    time are kept for each year and variable, so a year can span several chunks.
+    result() gives the same maxima as data.groupby(data.index.year)[var].idxmax()
+    on the whole series (first occurrence in case of ties).
+
+    Parameters
+    ----------
+    var: string or list of strings
+        Name(s) of the variable(s)
+
+    Example
+    -------
+    >>> stream = AnnualMaximaStream(['HS', 'W10'])
+    >>> for chunk in pd.read_csv(file, index_col=0, parse_dates=True, chunksize=100000):
+    ...     stream.update(chunk)
+    >>> maxima = stream.result()
+    """
+
+    def __init__(self, var):
+        self.var = var
+        self.variables = [var] if isinstance(var, str) else list(var)
+        self._max = pd.DataFrame(columns=self.variables, dtype=float)
+        self._time = pd.DataFrame(columns=self.variables, dtype='datetime64[ns]')
+        self.index_name = None
+
+    def update(self, chunk):
+        chunk = _as_frame(chunk, self.variables)
+        if chunk.shape[0] == 0:
+            return self
+        self.index_name = chunk.index.name
+        groups = chunk.groupby(chunk.index.year)
+        new_max = groups.max()
+        new_time = groups.idxmax()
+        years = self._max.index.union(new_max.index)
+        old_max = self._max.reindex(years)
+        old_time = self._time.reindex(years)
+        new_max = new_max.reindex(years)
+        # a later chunk only replaces a strictly larger maximum
+        replace = (new_max > old_max) | (old_max.isna() & new_max.notna())
+        self._max = old_max.mask(replace, new_max)
+        self._time = old_time.mask(replace, new_time.reindex(years))
+        return self
+
+    def result(self):
+        """
+        Annual maxima indexed by the time at which they occurred, a pd.Series 
+        if var is a string or a dict of pd.Series for a list of variables.
+        """
+        out = {}
+        for v in self.variables:
+            ok = self._max[v].notna()
+            out[v] = pd.Series(self._max.loc[ok, v].to_numpy(dtype=float),
+                               index=pd.DatetimeIndex(self._time.loc[ok, v], name=self.index_name),
+                               name=v)
+        return out[self.var] if isinstance(self.var, str) else out
+
+    def threshold_os(self):
+        """
+        Minimum of the annual maxima (see get_threshold_os), a float or a 
+        dict of floats for a list of variables.
+        """
+        thr = self._max.min()
+        return float(thr[self.var]) if isinstance(self.var, str) else thr.to_dict()
+
+
+class POTStream:
+    """
+    Peaks over threshold of one or several variables over time ordered chunks 
+    of a time series that does not fit in memory. The cluster still open at 
+    the end of a chunk (its maximum and the time of its last exceedance) is 
+    carried over to the next chunk, so that result() gives exactly the
+    extremes of get_pot_extremes on the whole series.
+
+    Parameters
+    ----------
+    var: string or list of strings
+        Name(s) of the variable(s)
+    threshold: float or dict
+        Threshold, or a dict of thresholds per variable
+    r: string or pd.Timedelta
+        Minimum period of time between two clusters. Default is '48h'.
+    """
+
+    def __init__(self, var, threshold, r="48h"):
+        self.var = var
+        self.variables = [var] if isinstance(var, str) else list(var)
+        self.threshold = {v: threshold[v] if isinstance(threshold, dict) else threshold 
+                          for v in self.variables}
+        self.r = r
+        self._r = pd.to_timedelta(r).to_timedelta64()
+        self._times = {v: [] for v in self.variables}
+        self._values = {v: [] for v in self.variables}
+        # open cluster per variable: (time of maximum, maximum, time of last exceedance)
+        self._pending = {v: None for v in self.variables}
+        self.first_time = None
+        self.last_time = None
+        self.index_name = None
+
+    def update(self, chunk):
+        chunk = _as_frame(chunk, self.variables)
+        if chunk.shape[0] == 0:
+            return self
+        times = chunk.index.to_numpy()
+        if self.first_time is None:
+            self.first_time = chunk.index[0]
+        self.last_time = chunk.index[-1]
+        self.index_name = chunk.index.name
+        for v in self.variables:
+            values = chunk[v].to_numpy(dtype=float)
+            above = values > self.threshold[v]
+            t, x = times[above], values[above]
+            if len(t) == 0:
+                continue
+            pending = self._pending[v]
+            if pending is not None and t[0] - pending[2] > self._r:
+                self._emit(v, [pending[0]], [pending[1]])
+                pending = None
+            cluster_t, cluster_x = _decluster_pot(t, x, self.r)
+            if pending is not None and pending[1] >= cluster_x[0]:
+                # the first cluster of the chunk continues the open cluster
+                cluster_t[0], cluster_x[0] = pending[0], pending[1]
+            self._emit(v, cluster_t[:-1], cluster_x[:-1])
+            self._pending[v] = (cluster_t[-1], cluster_x[-1], t[-1])
+        return self
+
+    def _emit(self, v, t, x):
+        if len(t):
+            self._times[v].append(np.asarray(t))
+            self._values[v].append(np.asarray(x, dtype=float))
+
+    def result(self):
+        """
+        Cluster maxima indexed by the time at which they occurred, a pd.Series 
+        if var is a string or a dict of pd.Series for a list of variables.
+        attrs['years'] is the number of years spanned by the data, to get
+        the number of peaks per year.
+        """
+        out = {}
+        for v in self.variables:
+            t, x = list(self._times[v]), list(self._values[v])
+            if self._pending[v] is not None:
+                t.append(np.asarray([self._pending[v][0]]))
+                x.append(np.asarray([self._pending[v][1]]))
+            t = np.concatenate(t) if t else np.array([], dtype='datetime64[ns]')
+            x = np.concatenate(x) if x else np.array([], dtype=float)
+            out[v] = pd.Series(data=x,
+                               index=pd.Index(data=t, name=self.index_name or "date-time"),
+                               dtype=np.float64,
+                               name=v or "extreme values")
+            if self.first_time is not None:
+                out[v].attrs['years'] = self.last_time.year - self.first_time.year + 1
+        return out[self.var] if isinstance(self.var, str) else out
+
+
+def stream_extremes(chunks, var, method='AM', threshold=None, r="48h"):
+    """
+    Annual maxima or peaks over threshold of a time series given as an 
+    iterator of time ordered chunks (pd.DataFrame, e.g. from pd.read_csv with 
+    chunksize, or xarray.Dataset pieces), with memory bounded by the chunk 
+    size. The extremes are the same as those of the in-memory functions and 
+    can be fitted with any of the distributions.
+
+    Parameters
+    ----------
+    chunks: iterable or function
+        Time ordered chunks. For POT without threshold, the threshold of 
+        Outten and Sobolowski (2021) needs a first pass over the data, and 
+        chunks must be a function returning a new iterator at each call.
+    var: string or list of strings
+        Name(s) of the variable(s)
+    method: string
+        'AM' for annual maxima (default) or 'POT' for peaks over threshold
+    threshold: float or dict
+        Threshold for POT, default is None (minimum of the annual maxima)
+    r: string
+        Minimum period of time between two peaks for POT. Default is '48h'.
+
+    Returns
+    -------
+    extremes: pd.Series, or dict of pd.Series for a list of variables
+    """
+    if method == 'AM':
+        stream = AnnualMaximaStream(var)
+    elif method == 'POT':
+        if threshold is None:
+            if not callable(chunks):
+                raise ValueError('POT without threshold needs two passes over the data, '
+                                 'chunks must be a function returning a new iterator')
+            am = AnnualMaximaStream(var)
+            for chunk in chunks():
+                am.update(chunk)
+            threshold = am.threshold_os()
+        stream = POTStream(var, threshold, r=r)
+    else:
+        raise ValueError('please check method, must be either POT or AM')
+    for chunk in (chunks() if callable(chunks) else chunks):
+        stream.update(chunk)
+    return stream.result()
+
 
 def probplot(data, sparams):    
     st.probplot(data, sparams=sparams, 
@@ -228,7 +627,7 @@ def probplot(data, sparams):
 
 def get_empirical_return_levels(data, var, method="POT",
                                 block_size="365.2425D",
-                                threshold=None):
+                                threshold=None, plotting_position='weibull'):
     """
     Returns an estimation of observed return periods and return levels.
     
@@ -239,6 +638,7 @@ def get_empirical_return_levels(data, var, method="POT",
     block_size (str): Size of the block for block maxima
     threshold (float): Threshold to be used for peak-over-threshold, default
                        None.
+    plotting_position (str): 'weibull' (default), 'gringorten' or 'hazen'
     
     return (pandas DataFrame): df, dataframe containing empirical return levels
                                and return periods. df.attrs contains meta-data
@@ -247,19 +647,8 @@ def get_empirical_return_levels(data, var, method="POT",
     """
     
     if method == 'BM':
-        extremes = get_extremes(ts=data[var],
-                                method=method,
-                                block_size=block_size)
-        rp = get_return_periods(ts=data[var],
-                                extremes=extremes,
-                                extremes_method=method,
-                                extremes_type="high",
-                                return_period_size=block_size)
-                                
-        df = pd.DataFrame(rp).rename(columns = {
-                                 'return period':'return_periods',
-                                 var: 'return_levels'
-                                 })\
+        extremes = _block_maxima(data[var], block_size=block_size)
+        df = _empirical_frame(extremes, _block_rate(extremes, block_size), plotting_position)\
                              .loc[:,['return_levels', 'return_periods']]
         df.attrs['method'] = 'BM'
         df.attrs['block_size'] = block_size
@@ -270,18 +659,11 @@ def get_empirical_return_levels(data, var, method="POT",
         if threshold is None:
              threshold = get_threshold_os(data=data, var=var)   
              
-        extremes = get_extremes(ts=data[var],
-                                method=method,
-                                threshold=threshold)
-        rp = get_return_periods(ts=data[var],
-                                extremes=extremes,
-                                extremes_method=method,
-                                extremes_type="high")
-                                
-        df = pd.DataFrame(rp).rename(columns = {
-                                 'return period':'return_periods',
-                                 var: 'return_levels'
-                                 })\
+        extremes = get_pot_extremes(ts=data[var],
+                                    threshold=threshold,
+                                    r="24h")
+        n_years = (data.index.max() - data.index.min())/pd.to_timedelta("365.2425D")
+        df = _empirical_frame(extremes, len(extremes)/n_years, plotting_position)\
                              .loc[:,['return_levels', 'return_periods']]
                              
         df.loc[df['return_periods'] >= 1, 'prob_non_exceedance'] = \
@@ -295,12 +677,17 @@ def get_empirical_return_levels(data, var, method="POT",
 
 def threshold_sensitivity(data, var, thresholds, 
                            dist_list=['GP','EXP','Weibull_2P'], 
-                           period=100):
+                           period=100, r="48h", warm_start=False,
+                           fit_method='mle'):
     """
     Returns theoretical return level for given return period and distribution,
     as a function of the threshold. Plots the return levels in function of the 
     thresholds, for each method and saves the result into the given output_file
     if output_file is not None.
+    The exceedances of the lowest threshold are extracted once, the extremes of
+    each higher threshold are declustered from that subset only, and the 
+    annual maxima fits (GEV, GUM), which do not depend on the threshold, are 
+    computed once.
 
     data (pd.DataFrame): dataframe containing the time series
     var (str): name of the variable
@@ -308,7 +695,13 @@ def threshold_sensitivity(data, var, thresholds,
     dist_list (list of str): list of the names of the models to fit the
                                 data and display
     period (int or float): Return period
-    output_file (str): path of the output file to save the plot, else None.
+    r (str): Minimum period of time between two peaks. Default 48h.
+    warm_start (bool): If True, the fit at each threshold starts from the 
+                       parameters found at the previous (lower) threshold. 
+                       Faster, but results may differ slightly from 
+                       independent fits. Default False.
+    fit_method (str): 'mle' (default) for maximum likelihood or 'lmom' 
+                      for L-moments
     
     return: 
         dict_rl (dict of list of floats): Contains the return levels 
@@ -317,27 +710,43 @@ def threshold_sensitivity(data, var, thresholds,
                                           and each threshold
         thresholds (float): Range of thresholds used for POT methods
     """
-    # Initialize the dictionnary with one key for each distribution
-    dict_rl = {dist:[] for dist in dist_list}
-
-    # For each threshold, and each method get the return value corresponding to 
-    # the input period and add it to the corresponding list in the dictionnary
-    for thresh in thresholds:
-        for dist in dist_list:
-            if dist in ['GP', 'Weibull_2P','EXP']:
-                dict_rl[dist].append(return_levels_pot(data, 
-                                                   var,
-                                                   dist=dist,
-                                                   threshold=thresh,
-                                                   periods=[period])\
-                                                   .iloc[0,0])
-
-            elif dist in ['GEV','GUM']:
-                dict_rl[dist].append(return_levels_annual_max(data, 
-                                                          var,
-                                                          dist=dist,
-                                                          periods=[period])\
-                                                          .iloc[0,0])
+    thresholds_arr = np.asarray(thresholds, dtype=float)
+    dict_rl = {dist:np.full(len(thresholds_arr), np.nan) for dist in dist_list}
+
+    # Block maxima fits do not depend on the threshold
+    for dist in dist_list:
+        if dist in ['GEV','GUM']:
+            dict_rl[dist][:] = return_levels_annual_max(data, 
+                                                        var,
+                                                        dist=dist,
+                                                        periods=[period],
+                                                        fit_method=fit_method)\
+                                                        .iloc[0,0]
+
+    pot_dists = [dist for dist in dist_list if dist in ['GP', 'Weibull_2P','EXP']]
+    if pot_dists and len(thresholds_arr) > 0:
+        values = data[var].to_numpy(dtype=float)
+        times = data.index.to_numpy()
+        # Exceedances of the lowest threshold contain those of all other thresholds
+        above = values > thresholds_arr.min()
+        exc_times, exc_values = times[above], values[above]
+        years = data.index.year
+        yr_num = years[-1]-years[0]+1
+        guess = {dist:None for dist in pot_dists}
+        for i in np.argsort(thresholds_arr, kind='stable'):
+            thresh = thresholds_arr[i]
+            keep = exc_values > thresh
+            _, extremes = _decluster_pot(exc_times[keep], exc_values[keep], r)
+            # in hours 
+            time_step = yr_num*365.2422*24/extremes.shape[0]
+            # years is converted to K-th
+            return_periods = np.array([period])*24*365.2422/time_step
+            for dist in pot_dists:
+                params = _fit_params(extremes-thresh, dist, guess=guess[dist],
+                                     fit_method=fit_method)
+                if warm_start:
+                    guess[dist] = params
+                dict_rl[dist][i] = _isf_params(dist, 1/return_periods, *params)[0] + thresh
 
     df = pd.DataFrame(dict_rl)
     df['Thresholds'] = thresholds
@@ -349,8 +758,6 @@ def threshold_sensitivity(data, var, thresholds,
     return df
 
 
-
-    
 def return_levels_weibull_2p(data, var,
                              periods=[50, 100, 1000], 
                              threshold=None, r="48h"):
@@ -377,7 +784,7 @@ def return_levels_weibull_2p(data, var,
     if threshold is None:
         threshold = get_threshold_os(data=data, var=var)
 
-    extremes = get_extremes(data[var], method="POT", threshold=threshold, r=r)
+    extremes = get_pot_extremes(data[var], threshold=threshold, r=r)
 
     # Fit a 2-parameter Weibull distribution to the data
     shape, loc, scale = st.weibull_min.fit(extremes, floc=0)
@@ -435,7 +842,7 @@ def return_levels_exp(data, var='hs', periods=[50, 100, 1000],
     if threshold is None:
         threshold = get_threshold_os(data=data, var=var)
 
-    extremes = get_extremes(data[var], method="POT", threshold=threshold, r=r)
+    extremes = get_pot_extremes(data[var], threshold=threshold, r=r)
     loc, scale = st.expon.fit(extremes)
     #print (loc,scale)
 
@@ -505,7 +912,7 @@ def old_return_levels_GP(data, var, threshold=None,
 
     return rl
 
-def RVE_ALL(dataframe,var='hs',periods=[1,10,100,1000],distribution='Weibull3P',method='default',threshold='default'):
+def RVE_ALL(dataframe,var='hs',periods=[1,10,100,1000],distribution='Weibull3P',method='default',threshold='default',fit_method='mle'):
     """
     This function returns the distribution parameters from the fitting to the data and the return level(s)
 
@@ -521,32 +928,21 @@ def RVE_ALL(dataframe,var='hs',periods=[1,10,100,1000],distribution='Weibull3P',
         Can be 'default' (all data), 'AM' or 'POT'
     threshold: string 'default' or float 
         'default' means the mininimum of the anual maxima
+    fit_method: string
+        'mle' (default) for maximum likelihood, or 'lmom' for L-moments 
+        (EXP, GEV, GUM, GUM_L, Weibull2P and Weibull3P, LoNo is always 
+        fitted by maximum likelihood)
 
     Returns
     -------
     The shape, location, and scale parameters of the distribution,
     and the return levels for every return period given
     """
-    shape, loc, scale = [], [], []
     periods = np.array(periods)
     #it_selected_max = dataframe.groupby(dataframe.index.year)[var].idxmax().values
     df = dataframe[var]
     
     period = periods
-    # get data for fitting 
-    if method == 'default' : # all data 
-        data = df.values
-    elif method == 'AM' : # annual maxima
-        annual_maxima = df.resample('Y').max() # get annual maximum 
-        data = annual_maxima
-    elif method == 'POT' : # Peak over threshold 
-        if threshold == 'default' :
-            annual_maxima = df.resample('Y').max() 
-            threshold=annual_maxima.min()
-        data = get_extremes(df, method="POT", threshold=threshold, r="48h")
-    else:
-        print ('Please check the method of filtering data')
-    
     # Return periods in K-th element 
     try:
         for i in range(len(period)) :
@@ -560,43 +956,63 @@ def RVE_ALL(dataframe,var='hs',periods=[1,10,100,1000],distribution='Weibull3P',
     # length_data = data.shape[0]
     #interval = duration*24/length_data # in hours 
     interval = ((df.index[-1]-df.index[0]).days + 1)*24/df.shape[0] # in hours 
-    period = period*365.2422*24/interval # years is converted to K-th
-    
-    # Fit a distribution to the data
-    if distribution == 'EXP' : 
-        loc, scale = st.expon.fit(data)
-        value = st.expon.isf(1/period, loc, scale)
-        #value = st.expon.ppf(1 - 1 / period, loc, scale)
-    elif distribution == 'GEV' :
-        shape, loc, scale = st.genextreme.fit(data) # fit data   
-        value = st.genextreme.isf(1/period, shape, loc, scale)
-        #value = st.genextreme.ppf(1 - 1 / period, shape, loc, scale)
-    elif distribution == 'GUM' :
-        loc, scale = st.gumbel_r.fit(data) # fit data
-        value = st.gumbel_r.isf(1/period, loc, scale)
-        #value = st.gumbel_r.ppf(1 - 1 / period, loc, scale)
-    elif distribution == 'GUM_L' : # Gumbel Left-skewed (for minimum order statistic) Distribution
-        loc, scale = st.gumbel_l.fit(data) # fit data
-        value = st.gumbel_l.ppf(1/period, loc, scale)
-        #value = st.gumbel_l.ppf(1 - 1 / period, loc, scale)
-    elif distribution == 'LoNo' :
-        shape, loc, scale = st.lognorm.fit(data)
-        value = st.lognorm.isf(1/period, shape, loc, scale)
-        #value = st.lognorm.ppf(1 - 1 / period, shape, loc, scale)
-    elif distribution == 'Weibull2P' :
-        shape, loc, scale = st.weibull_min.fit(data, floc=0) # (ML)
-        value = st.weibull_min.isf(1/period, shape, loc, scale)
-        #value = st.weibull_min.ppf(1 - 1 / period, shape, loc, scale)
-    elif distribution == 'Weibull3P' : 
-        shape, loc, scale = st.weibull_min.fit(data) # (ML)
-        value = st.weibull_min.isf(1/period, shape, loc, scale)
-        #value = st.weibull_min.ppf(1 - 1 / period, shape, loc, scale)
-    elif distribution == 'Weibull3P_MOM' : 
-        shape, loc, scale = aux_funcs.Weibull_method_of_moment(data)
-        value = st.weibull_min.isf(1/period, shape, loc, scale)
-        #value = st.weibull_min.ppf(1 - 1 / period, shape, loc, scale)
-    else:
-        print ('Please check the distribution')    
+
+    def fit_model():
+        shape, loc, scale = None, None, None
+        extremes = None
+        # get data for fitting 
+        if method == 'default' : # all data 
+            data = df.values
+        elif method == 'AM' : # annual maxima
+            annual_maxima = df.resample('Y').max() # get annual maximum 
+            data = extremes = annual_maxima
+        elif method == 'POT' : # Peak over threshold 
+            thresh = threshold
+            if thresh == 'default' :
+                annual_maxima = df.resample('Y').max() 
+                thresh=annual_maxima.min()
+            data = extremes = get_pot_extremes(df, threshold=thresh, r="48h")
+        else:
+            print ('Please check the method of filtering data')
+
+        def fit(dist, **kwds):
+            # Maximum likelihood fit, or L-moments fit with the same parameters
+            # (LoNo has no L-moments fit and falls back to maximum likelihood)
+            if fit_method == 'lmom' and distribution != 'LoNo':
+                params = aux_funcs.lmoments_fit(data, distribution)
+                return params if dist.shapes else params[1:]
+            return dist.fit(data, **kwds)
+
+        # Fit a distribution to the data
+        if distribution == 'EXP' : 
+            loc, scale = fit(st.expon)
+        elif distribution == 'GEV' :
+            shape, loc, scale = fit(st.genextreme) # fit data   
+        elif distribution == 'GUM' :
+            loc, scale = fit(st.gumbel_r) # fit data
+        elif distribution == 'GUM_L' : # Gumbel Left-skewed (for minimum order statistic) Distribution
+            loc, scale = fit(st.gumbel_l) # fit data
+        elif distribution == 'LoNo' :
+            shape, loc, scale = fit(st.lognorm)
+        elif distribution == 'Weibull2P' :
+            shape, loc, scale = fit(st.weibull_min, floc=0) # (ML)
+        elif distribution == 'Weibull3P' : 
+            shape, loc, scale = fit(st.weibull_min) # (ML)
+        elif distribution == 'Weibull3P_MOM' : 
+            shape, loc, scale = aux_funcs.Weibull_method_of_moment(data)
+        else:
+            print ('Please check the distribution')    
+
+        # The return periods are converted to K-th element of the original time series
+        return FittedExtremeModel(distribution, shape, loc, scale, 
+                                  rate=365.2422*24/interval, var=var, method=method, 
+                                  r="48h", fit_method=fit_method, extremes=extremes)
+
+    model = _cached_model(('RVE_ALL', _data_fingerprint(df), var, method, 
+                           distribution, threshold, fit_method), fit_model)
+    shape = [] if model.shape is None else model.shape
+    loc, scale = model.loc, model.scale
+    value = model.return_levels(period)
         
     #if method == 'default' :  
     # 	output_file= distribution + '.png'
@@ -607,7 +1023,46 @@ def RVE_ALL(dataframe,var='hs',periods=[1,10,100,1000],distribution='Weibull3P',
     return shape, loc, scale, value
 
 
-def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,10000], adjustment=None):  
+def RVE_many(data,vars,periods=[1,10,100,1000],distribution='Weibull3P',method='default',threshold='default',fit_method='mle',n_jobs=1):
+    """
+    Return levels of several variables (e.g. the levels of a wind or current profile) 
+    with the same options as RVE_ALL, fitting each variable exactly once for all periods.
+
+    Parameters
+    ----------
+    data: dataframe,
+        Contains daily or hourly time series
+    vars: list of strings
+        Names of the variables
+    periods: float or list
+        List of the return periods
+    distribution, method, threshold, fit_method: 
+        See RVE_ALL
+    n_jobs: int
+        Number of processes used for the fits, default 1 (-1 or None for all CPUs)
+
+    Returns
+    -------
+    pd.DataFrame with one row per variable and period and the columns 
+    'var', 'period', 'return_value', 'shape', 'loc' and 'scale'
+    (shape is nan for 2-parameter distributions)
+    """
+    periods = np.atleast_1d(np.array(periods, dtype=float))
+    tasks = [(data[[var]], var, periods.copy(), distribution, method, threshold, fit_method) for var in vars]
+    rows = []
+    for var, (shape, loc, scale, value) in zip(vars, _run_RVE_ALL(tasks, n_jobs=n_jobs)):
+        shape = np.nan if np.size(shape) == 0 else shape
+        for period, rv in zip(periods, np.atleast_1d(value)):
+            rows.append({'var': var, 'period': period, 'return_value': rv,
+                         'shape': shape, 'loc': loc, 'scale': scale})
+    df = pd.DataFrame(rows, columns=['var', 'period', 'return_value', 'shape', 'loc', 'scale'])
+    df.attrs['distribution'] = distribution
+    df.attrs['method'] = method
+    df.attrs['threshold'] = threshold
+    return df
+
+
+def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,10000], adjustment=None, dtype=np.float64):  
     
     """
     This fuction will plot Hs-Tp joint distribution using LogNoWe model (the Lognormal + Weibull distribution) 
@@ -615,6 +1070,7 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
     var1 : Hs: significant wave height,
     var2 : Tp: Peak period 
     file_out: Hs-Tp joint distribution, optional
+    dtype : dtype of the 1500x2000 Hs-Tp density grids, np.float32 halves their memory 
     """
     if adjustment == 'NORSOK':
         periods_adj = np.array([x * 6 for x in periods])
@@ -651,12 +1107,10 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
     
     
     # Find the index where two PDF cut, between P60 and P99 
-    for i in range(len(h)):
-        if abs(h[i]-np.percentile(df.hs.values,60)) < 0.1:
-            i1=i
-            
-        if abs(h[i]-np.percentile(df.hs.values,99)) < 0.1:
-            i2=i
+    # (last grid points within 0.1 of the percentiles)
+    p60, p99 = np.percentile(df.hs.values,[60,99])
+    i1 = np.flatnonzero(abs(h-p60) < 0.1)[-1]
+    i2 = np.flatnonzero(abs(h-p99) < 0.1)[-1]
             
     epsilon=abs(pdf_Hs1[i1:i2]-pdf_Hs2[i1:i2])
     param = find_peaks(1/epsilon)
@@ -671,16 +1125,12 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
         
     # Merge two functions and do smoothing around the cut 
     eta = h[index]
-    pdf_Hs = h*0
-    for i in range(len(h)):
-        if h[i] < eta : 
-            pdf_Hs[i] = pdf_Hs1[i]
-        else:
-            pdf_Hs[i] = pdf_Hs2[i]
+    pdf_Hs = np.where(h < eta, pdf_Hs1, pdf_Hs2)
             
-    for i in range(len(h)):
-        if eta-0.5 < h[i] < eta+0.5 : 
-            pdf_Hs[i] = np.mean(pdf_Hs[i-10:i+10])
+    # The smoothing is sequential (each point uses the already smoothed 
+    # points before it), but only loops over the points around the cut
+    for i in np.flatnonzero((eta-0.5 < h) & (h < eta+0.5)):
+        pdf_Hs[i] = np.mean(pdf_Hs[i-10:i+10])
     
             
     #####################################################
@@ -700,20 +1150,21 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
     else : 
         intx=1.0
     
-    mean_hs = []
-    variance_lnTp = []
-    mean_lnTp = []
     hs_bin = np.arange(0,maxHs+2*intx,intx)
-    for i in range(len(hs_bin)-1):
-        idxs = np.where((hs_bin[i]<=Hs) & (Hs<hs_bin[i+1]))
-        if Hs[idxs].shape[0] > 15 : 
-            mean_hs.append(np.mean(Hs[idxs]))
-            mean_lnTp.append(np.mean(np.log(Tp[idxs])))
-            variance_lnTp.append(np.var(np.log(Tp[idxs])))
-    
-    mean_hs = np.asarray(mean_hs)
-    mean_lnTp = np.asarray(mean_lnTp)
-    variance_lnTp = np.asarray(variance_lnTp)
+    # Bin index i such that hs_bin[i] <= Hs < hs_bin[i+1], then grouped statistics
+    nbins = len(hs_bin)-1
+    ibin = np.searchsorted(hs_bin, Hs, side='right')-1
+    valid = (ibin >= 0) & (ibin < nbins)
+    ibin, Hs_valid, lnTp = ibin[valid], Hs[valid], np.log(Tp[valid])
+    count = np.bincount(ibin, minlength=nbins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_hs = np.bincount(ibin, weights=Hs_valid, minlength=nbins)/count
+        mean_lnTp = np.bincount(ibin, weights=lnTp, minlength=nbins)/count
+        variance_lnTp = np.bincount(ibin, weights=(lnTp-mean_lnTp[ibin])**2, minlength=nbins)/count
+    enough = count > 15
+    mean_hs = mean_hs[enough]
+    mean_lnTp = mean_lnTp[enough]
+    variance_lnTp = variance_lnTp[enough]
 
     # calcualte a1, a2, a3 
     parameters, covariance = curve_fit(aux_funcs.Gauss3, mean_hs, mean_lnTp)
@@ -734,16 +1185,14 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
     # calculate pdf Hs, Tp 
     t = np.linspace(start=0.01, stop=40, num=2000)
     
-    f_Hs_Tp = np.zeros((len(h), len(t)))
-    pdf_Hs_Tp=f_Hs_Tp*0
-    
-    for i in range(len(h)):
-        mu = a1 + a2*h[i]**a3
-        std2 = b1 + b2*np.exp(-b3*h[i])
-        std = np.sqrt(std2)
-        
-        f_Hs_Tp[i,:] = 1/(np.sqrt(2*np.pi)*std*t)*np.exp(-(np.log(t)-mu)**2/(2*std2))
-        pdf_Hs_Tp[i,:] = pdf_Hs[i]*f_Hs_Tp[i,:]
+    # Conditional lognormal pdf of Tp for every Hs of the grid, by broadcasting
+    # (rows: h, columns: t)
+    mu = (a1 + a2*h**a3)[:, np.newaxis].astype(dtype)
+    std2 = (b1 + b2*np.exp(-b3*h))[:, np.newaxis].astype(dtype)
+    std = np.sqrt(std2)
+    t_ = t.astype(dtype)
+    f_Hs_Tp = 1/(dtype(np.sqrt(2*np.pi))*std*t_)*np.exp(-(np.log(t_)-mu)**2/(2*std2))
+    pdf_Hs_Tp = pdf_Hs[:, np.newaxis].astype(dtype)*f_Hs_Tp
     
     interval = ((df.index[-1]-df.index[0]).days + 1)*24/df.shape[0] # in hours 
     t3 = []
@@ -751,9 +1200,10 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
     X = []
     hs_tpl_tph = pd.DataFrame()
 
-    # Assuming Hs_Tp_curve() returns four values, otherwise adjust accordingly
+    # All contours from one call (one marginal fit)
+    curves = aux_funcs.Hs_Tp_curves(df.hs.values, pdf_Hs, pdf_Hs_Tp, f_Hs_Tp, h, t, interval, periods=periods_adj)
     for i in range(len(periods)):
-        t3_val, h3_val, X_val, hs_tpl_tph_val = aux_funcs.Hs_Tp_curve(df.hs.values, pdf_Hs, pdf_Hs_Tp, f_Hs_Tp, h, t, interval, X=periods_adj[i])
+        t3_val, h3_val, X_val, hs_tpl_tph_val = curves[i]
         t3.append(t3_val)
         h3.append(h3_val)
         X.append(X_val)
@@ -767,164 +1217,205 @@ def joint_distribution_Hs_Tp(data,var_hs='hs',var_tp='tp',periods=[1,10,100,1000
 
 
 
-def monthly_extremes(data, var='hs', periods=[1, 10, 100, 10000], distribution='Weibull3P_MOM', method='default', threshold='default'):
+def _split_groups(data, keys, groups):
+    """
+    Splits data into groups with one stable sort on keys, so that each group 
+    is a contiguous slice of the sorted data, still in time order.
+    Returns a list with the slice of each value in groups (empty if missing).
+    """
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sorted_data = data.iloc[order]
+    start = np.searchsorted(sorted_keys, groups, side='left')
+    stop = np.searchsorted(sorted_keys, groups, side='right')
+    return [sorted_data.iloc[a:b] for a, b in zip(start, stop)]
+
+
+def _group_threshold(group_data, var, threshold):
+    """
+    Threshold of a group and number of events per year above it, 
+    for percentile thresholds given as 'P<percentile>' (None otherwise).
+    """
+    if isinstance(threshold, str) and threshold.startswith('P'):
+        threshold_value = group_data[var].quantile(int(threshold.split('P')[1])/100)
+        # Calculate the number of events exceeding a threshold:
+        num_years = (group_data.index[-1]  - group_data.index[0] ).days / 365.25  # Using 365.25 to account for leap years
+        return threshold_value, (group_data[var] >= threshold_value).sum()/num_years
+    return threshold, None
+
+
+def _RVE_ALL_task(task):
+    """
+    Runs RVE_ALL on one (data, var, periods, distribution, method, threshold[, fit_method]) task.
+    Top-level so that it can be sent to worker processes.
+    """
+    data, var, periods, distribution, method, threshold = task[:6]
+    fit_method = task[6] if len(task) > 6 else 'mle'
+    return RVE_ALL(data, var=var, periods=periods, distribution=distribution,
+                   method=method, threshold=threshold, fit_method=fit_method)
+
+
+def _run_RVE_ALL(tasks, n_jobs=1):
+    """
+    Runs independent RVE_ALL tasks serially (n_jobs=1) or in a pool of processes
+    (n_jobs>1, -1 or None for all CPUs). Returns the results in the order of tasks.
+    """
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(tasks)))
+    if n_jobs == 1:
+        return [_RVE_ALL_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(_RVE_ALL_task, tasks))
+
+
+def monthly_extremes(data, var='hs', periods=[1, 10, 100, 10000], distribution='Weibull3P_MOM', method='default', threshold='default', n_jobs=1):
     # Calculate parameters for each month based on different method
-    params = []
+    # The data are sorted once by month and each month is a contiguous slice,
+    # the 13 fits (12 months and annual) are independent and can run in a pool (n_jobs)
     return_values = [] #np.zeros((13, len(periods)))
     num_events_per_year = []
     # time_step = ((data.index[-1]-data.index[0]).days + 1)*24/data.shape[0]
     # years is converted to K-th
     # periods1 = np.array(periods)*24*365.2422/time_step
     threshold_values = []
-    for month in range(1, 13):
-        month_data = data[data.index.month == month]
-        
-        if isinstance(threshold, str) and threshold.startswith('P'):
-            threshold_value = month_data[var].quantile(int(threshold.split('P')[1])/100)
+    tasks = []
+    months = range(1, 13)
+    for month_data in _split_groups(data[[var]], data.index.month, months):
+        threshold_value, num_events = _group_threshold(month_data, var, threshold)
+        if num_events is not None:
             threshold_values.append(threshold_value)
-            # Calculate the number of events exceeding a threshold:
-            num_years = (month_data.index[-1]  - month_data.index[0] ).days / 365.25  # Using 365.25 to account for leap years
-            num_events_per_year.append((month_data[var] >= threshold_value).sum()/num_years)
-        else:
-            threshold_value = threshold
+            num_events_per_year.append(num_events)
 
         if method == 'minimum': # used for negative temperature
-            shape, loc, scale, value = RVE_ALL(month_data.resample('ME').min().dropna(),var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+            tasks.append((month_data.resample('ME').min().dropna(),var,periods,distribution,'default',threshold_value))
         elif method == 'maximum': # used for positive temperature
-            shape, loc, scale, value = RVE_ALL(month_data.resample('ME').max().dropna(),var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+            tasks.append((month_data.resample('ME').max().dropna(),var,periods,distribution,'default',threshold_value))
         elif method == 'default':
-            shape, loc, scale, value = RVE_ALL(month_data,var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+            tasks.append((month_data,var,periods,distribution,'default',threshold_value))
         elif method == 'POT':
-            shape, loc, scale, value = RVE_ALL(month_data,var=var,periods=periods,distribution=distribution,method=method,threshold=threshold_value)
-        
-        params.append((shape, loc, scale))
-        return_values.append(value)
+            tasks.append((month_data,var,periods,distribution,method,threshold_value))
 
     # add annual
-    if isinstance(threshold, str) and threshold.startswith('P'):
-        threshold_value = data[var].quantile(int(threshold.split('P')[1])/100)
+    threshold_value, num_events = _group_threshold(data, var, threshold)
+    if num_events is not None:
         threshold_values.append(threshold_value)
-        # Calculate the number of events exceeding a threshold:
-        num_years = (data.index[-1]  - data.index[0] ).days / 365.25  # Using 365.25 to account for leap years
-        num_events_per_year.append((data[var] >= threshold_value).sum()/num_years)
-    else:
-        threshold_value = threshold
+        num_events_per_year.append(num_events)
 
     if method == 'minimum':
-        shape, loc, scale, value = RVE_ALL(data.resample('YE').min(),var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+        tasks.append((data.resample('YE').min(),var,periods,distribution,'default',threshold_value))
     elif method == 'maximum':
-        shape, loc, scale, value = RVE_ALL(data.resample('YE').max(),var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+        tasks.append((data.resample('YE').max(),var,periods,distribution,'default',threshold_value))
     elif method == 'default':
-        shape, loc, scale, value = RVE_ALL(data,var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+        tasks.append((data,var,periods,distribution,'default',threshold_value))
     elif method == 'POT':
-        shape, loc, scale, value = RVE_ALL(data,var=var,periods=periods,distribution=distribution,method=method,threshold=threshold_value)
-            
+        tasks.append((data,var,periods,distribution,method,threshold_value))
 
-    params.append((shape, loc, scale))       
-    return_values.append(value)
-    return_values = np.array(return_values)
+    results = _run_RVE_ALL(tasks, n_jobs=n_jobs)
+    params = [(shape, loc, scale) for shape, loc, scale, value in results]
+    return_values = np.array([value for shape, loc, scale, value in results])
 
     # Define the threshold values (annual values) for each column
     thresholds = return_values[-1]
 
     # Replace values in each column that exceed the thresholds
     if method != 'minimum':
-        for col in range(return_values.shape[1]):
-            return_values[:, col] = np.minimum(return_values[:, col], thresholds[col])
+        return_values = np.minimum(return_values, thresholds)
 
     return params, return_values, threshold_values, num_events_per_year
 
 
-def directional_extremes(data: pd.DataFrame, var: str, var_dir: str, periods=[1, 10, 100, 10000], distribution='Weibull3_MOM', adjustment='NORSOK', method='default', threshold='default'):
-    # Your implementation of monthly_extremes_weibull function
-    # Calculate Weibull parameters for each month
+def directional_extremes(data: pd.DataFrame, var: str, var_dir: str, periods=[1, 10, 100, 10000], distribution='Weibull3_MOM', adjustment='NORSOK', method='default', threshold='default', n_jobs=1):
+    # Calculate parameters for each sector
+    # The data are sorted once by sector and each sector is a contiguous slice,
+    # the 13 fits (12 sectors and omni) are independent and can run in a pool (n_jobs)
     sector_prob = []
-    params = []
     threshold_values = []
     num_events_per_year = []
-    return_values = []
+    tasks = []
     aux_funcs.add_direction_sector(data=data,var_dir=var_dir)
     # time step between each data, in hours
     # time_step = ((data.index[-1]-data.index[0]).days + 1)*24/data.shape[0]
-    
-    for dir in range(0,360,30):
-        sector_data = data[data['direction_sector']==dir]
+    periods_adj = [x * 6 for x in periods]#*24*365.2422/time_step
+    periods_noadj = periods#*24*365.2422/time_step
+    if adjustment == 'NORSOK':
+        pass
+    else:
+        periods_adj = periods_noadj
+
+    sectors = range(0,360,30)
+    for sector_data in _split_groups(data, data['direction_sector'].to_numpy(), sectors):
         if sector_data.empty:
             sp=0.0
             sector_prob.append(sp)
-            params.append((np.nan, np.nan, np.nan))
-            return_values.append(np.full((len(periods)), fill_value=np.nan))
             #sector_data = data.loc[:, data.select_dtypes(include=['number']).columns] * 0 # fill with zeros, this will give 0 extremes for empty sectors
+            tasks.append(None)
             continue
-        if isinstance(threshold, str) and threshold.startswith('P'):
-            threshold_value = sector_data[var].quantile(int(threshold.split('P')[1])/100)
+        threshold_value, num_events = _group_threshold(sector_data, var, threshold)
+        if num_events is not None:
             threshold_values.append(threshold_value)
-            # Calculate the number of events exceeding a threshold:
-            num_years = (sector_data.index[-1]  - sector_data.index[0] ).days / 365.25  # Using 365.25 to account for leap years
-            num_events_per_year.append((sector_data[var] >= threshold_value).sum()/num_years)
-        else:
-            threshold_value = threshold
-        periods_adj = [x * 6 for x in periods]#*24*365.2422/time_step
-        periods_noadj = periods#*24*365.2422/time_step
-        if adjustment == 'NORSOK':
-            pass
-        else:
-            periods_adj = periods_noadj
-        if (len(sector_data)>0):
-            if method == 'minimum': # used for negative temperature
-                shape, loc, scale, value = RVE_ALL(sector_data.min().dropna(),var=var,periods=periods_adj,distribution=distribution,method='default',threshold=threshold_value)
-            elif method == 'maximum': # used for positive temperature
-                shape, loc, scale, value = RVE_ALL(sector_data.max().dropna(),var=var,periods=periods_adj,distribution=distribution,method='default',threshold=threshold_value)
-            elif method == 'default':
-                shape, loc, scale, value = RVE_ALL(sector_data,var=var,periods=periods_adj,distribution=distribution,method=method,threshold=threshold_value)
-            elif method == 'POT':
-                shape, loc, scale, value = RVE_ALL(sector_data,var=var,periods=periods_adj,distribution=distribution,method=method,threshold=threshold_value)
+            num_events_per_year.append(num_events)
+        if method == 'minimum': # used for negative temperature
+            tasks.append((sector_data.min().dropna(),var,periods_adj,distribution,'default',threshold_value))
+        elif method == 'maximum': # used for positive temperature
+            tasks.append((sector_data.max().dropna(),var,periods_adj,distribution,'default',threshold_value))
+        elif method == 'default':
+            tasks.append((sector_data,var,periods_adj,distribution,method,threshold_value))
+        elif method == 'POT':
+            tasks.append((sector_data,var,periods_adj,distribution,method,threshold_value))
         sp = 100*len(sector_data)/len(data[var])
         sector_prob.append(sp)
-        params.append((shape, loc, scale))
-        return_values.append(value)
 
     # add annual
-    if isinstance(threshold, str) and threshold.startswith('P'):
-        threshold_value = data[var].quantile(int(threshold.split('P')[1])/100)
+    threshold_value, num_events = _group_threshold(data, var, threshold)
+    if num_events is not None:
         threshold_values.append(threshold_value)
-        # Calculate the number of events exceeding a threshold:
-        num_years = (data.index[-1]  - data.index[0] ).days / 365.25  # Using 365.25 to account for leap years
-        num_events_per_year.append((data[var] >= threshold_value).sum()/num_years)
-    else:
-        threshold_value = threshold
+        num_events_per_year.append(num_events)
     if method == 'minimum':
-        shape, loc, scale, value = RVE_ALL(data.resample('YE').min(),var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+        tasks.append((data.resample('YE').min(),var,periods,distribution,'default',threshold_value))
     elif method == 'maximum':
-        shape, loc, scale, value = RVE_ALL(data.resample('YE').max(),var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+        tasks.append((data.resample('YE').max(),var,periods,distribution,'default',threshold_value))
     elif method == 'default':
-        shape, loc, scale, value = RVE_ALL(data,var=var,periods=periods,distribution=distribution,method='default',threshold=threshold_value)
+        tasks.append((data,var,periods,distribution,'default',threshold_value))
     elif method == 'POT':
-        shape, loc, scale, value = RVE_ALL(data,var=var,periods=periods,distribution=distribution,method=method,threshold=threshold_value)
-    
-    params.append((shape, loc, scale))
-    return_values.append(value)
+        tasks.append((data,var,periods,distribution,method,threshold_value))
+
+    results = iter(_run_RVE_ALL([task for task in tasks if task is not None], n_jobs=n_jobs))
+    params = []
+    return_values = []
+    for task in tasks:
+        if task is None:
+            params.append((np.nan, np.nan, np.nan))
+            return_values.append(np.full((len(periods)), fill_value=np.nan))
+        else:
+            shape, loc, scale, value = next(results)
+            params.append((shape, loc, scale))
+            return_values.append(value)
     return_values = np.array(return_values)
     # Define the threshold values (annual values) for each column
     thresholds = return_values[-1]
     
     # Replace values in each column that exceed the thresholds
-    for col in range(return_values.shape[1]):
-        return_values[:, col] = np.minimum(return_values[:, col], thresholds[col])
+    return_values = np.minimum(return_values, thresholds)
 
     return params, return_values, sector_prob,  threshold_values, num_events_per_year
 
 def monthly_joint_distribution_Hs_Tp_weibull(data, var='hs', periods=[1, 10, 100, 10000]):
     # Your implementation of monthly_extremes_weibull function
     # Calculate Weibull parameters for each month
-    weibull_params = []
-    for month in range(1, 13):
-        month_data = data[data.index.month == month][var]
-        shape, loc, scale = aux_funcs.Weibull_method_of_moment(month_data)
-        weibull_params.append((shape, loc, scale))
-    # add annual
-    shape, loc, scale = aux_funcs.Weibull_method_of_moment(data[var])
-    weibull_params.append((shape, loc, scale))       
+    # One column per month and a last column with all the data (annual),
+    # padded with NaNs, so that the 13 fits are done in one call
+    values = data[var].to_numpy(dtype=float)
+    months = data.index.month.to_numpy()
+    counts = np.bincount(months, minlength=13)[1:]
+    order = np.argsort(months, kind='stable')
+    rows = np.arange(len(values)) - np.repeat(np.cumsum(counts) - counts, counts)
+    columns = np.full((max(counts.max(), len(values)), 13), np.nan)
+    columns[rows, months[order]-1] = values[order]
+    columns[:len(values), 12] = values
+    shape, loc, scale = aux_funcs.Weibull_method_of_moment(columns)
+    weibull_params = list(zip(shape, loc, scale))
     # time step between each data, in hours
     time_step = ((data.index[-1]-data.index[0]).days + 1)*24/data.shape[0]
     # years is converted to K-th
@@ -975,7 +1466,11 @@ def model_tp_given_hs(hs: float, a1, a2, a3, b1, b2, b3):
     return P5_model,Mean_model,P95_model
 
 def estimate_forristal_maxCrest(Hs, Tp, depth=50, twindow=3, sea_state = 'short-crested'):
-
+    """
+    Expected maximum crest height from the Forristall (2000) distribution.
+    Hs, Tp and depth can be scalars or arrays of sea states (broadcast together),
+    the crest height is returned with the broadcast shape.
+    """
     # Example usage
     #Hs = 3.0  # Significant wave height
     #Tp = 10.0  # Peak period
@@ -985,20 +1480,31 @@ def estimate_forristal_maxCrest(Hs, Tp, depth=50, twindow=3, sea_state = 'short-
     # Constants
     LAT = 0  # Lowest astronomical Tide
     SWL = 0  # Still Water Level
-    g = 9.81  # Gravity
 
     Tz = aux_funcs.estimate_Tz(Tp,gamma = 2.5)
+    alphaFC, betaFC = _forristall_parameters(Hs, Tp, depth=depth, sea_state=sea_state)
+
+    # Number of waves
+    N = (twindow * 3600) / Tz
+
+    #Cmax = (SWL - LAT) + alphaFC * Hs * (np.log(N)) ** (1 / betaFC)
+    p = 0.85
+    Cmax = (SWL - LAT) + alphaFC * Hs * (-np.log(1 - p ** (1 / N))) ** (1 / betaFC)
+    
+    return Cmax
+
+def _forristall_parameters(Hs, Tp, depth=50, sea_state='short-crested'):
+    """
+    Weibull parameters (alpha, beta) of the Forristall (2000) crest height distribution,
+    P(C > x) = exp(-(x/(alpha*Hs))**beta), for scalars or arrays of sea states.
+    """
+    g = 9.81  # Gravity
+
     Tm01 = aux_funcs.estimate_Tm01(Tp,gamma = 2.5)
     S1 = (2 * np.pi) / g * (Hs / Tm01 ** 2)
-    k1 = (2 * np.pi) ** 2 / (g * Tm01 ** 2)  # Deep water
 
-    # Function to find k for finite depth
-    def delta(delta):
-        return abs((g / (2 * np.pi)) * Tm01 ** 2 * np.tanh(2 * np.pi * (depth / delta)) - delta)
-
-    res = minimize(delta, 100)
-    dlt = res.x[0]
-    k1 = (2 * np.pi) / dlt
+    # Wave number for finite depth
+    k1 = spec_funcs.wavenumber(Tm01, depth, period=True, g=g)
 
     Urs = Hs / (k1 ** 2 * depth ** 3)
 
@@ -1011,16 +1517,12 @@ def estimate_forristal_maxCrest(Hs, Tp, depth=50, twindow=3, sea_state = 'short-
     else:
         print ('please check sea state')
 
-    # Number of waves
-    N = (twindow * 3600) / Tz
-
-    #Cmax = (SWL - LAT) + alphaFC * Hs * (np.log(N)) ** (1 / betaFC)
-    p = 0.85
-    Cmax = (SWL - LAT) + alphaFC * Hs * (-np.log(1 - p ** (1 / N))) ** (1 / betaFC)
-    
-    return Cmax
+    return alphaFC, betaFC
 
 def estimate_Hmax(Hs, Tp, twindow=3, k=0.9):
+    """
+    Expected largest wave height in twindow hours, Hs and Tp can be scalars or arrays.
+    """
     Tz = aux_funcs.estimate_Tz(Tp,gamma = 2.5)
     N = (twindow*3600)/ Tz
     Hmax =  Hs * ( np.sqrt(np.log(N)/2) + 0.2886/np.sqrt(2*np.log(N))  ) # Expected largest Hmax based on Max Wave Distribution
@@ -1029,9 +1531,583 @@ def estimate_Hmax(Hs, Tp, twindow=3, k=0.9):
 
 
 
+def long_term_crest_Hmax(data, var_hs='HS', var_tp='TP', depth=200, periods=[1, 10, 100, 10000], sea_state='short-crested', dtype=np.float32, chunk_size=20000):
+    """
+    Return values of the crest height and maximum wave height from the long-term
+    distribution of individual waves over all sea states of the time series.
+
+    For every sea state i (one time step), the short-term distribution of the 
+    crest heights is Forristall (2000), and of the wave heights Rayleigh, 
+    P(H > x) = exp(-2*(x/Hs)**2). With N_i waves in the sea state, the 
+    distribution of the largest crest/wave of the whole time series is 
+    sum_i N_i*log(F_i(x)) in log space, and the return value for a period 
+    T is the x where this sum equals -(number of years)/T.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Time series with Hs and Tp
+    var_hs, var_tp : str
+        Names of the Hs and Tp columns
+    depth : float
+        Water depth [m]
+    periods : list
+        Return periods [years]
+    sea_state : str
+        'short-crested' or 'long-crested', see estimate_forristal_maxCrest
+    dtype : numpy dtype, default np.float32
+        Precision of the (sea states x heights) CDF evaluations, the sums 
+        over sea states are accumulated in float64
+    chunk_size : int
+        Number of sea states evaluated at once
+
+    Returns
+    -------
+    crest, hmax : np.ndarray
+        Return values of the crest height and maximum wave height for each period
+    """
+    df = data[[var_hs, var_tp]].dropna()
+    df = df[(df[var_hs] > 0) & (df[var_tp] > 0)]
+    hs = df[var_hs].to_numpy(dtype=float)
+    tp = df[var_tp].to_numpy(dtype=float)
+    time_step = ((data.index[-1]-data.index[0]).days + 1)*24/data.shape[0]
+    years = data.shape[0]*time_step/(365.2422*24)
+
+    # Short-term parameters of each sea state, scale of the Weibull excess
+    # distribution of crests (Forristall) and wave heights (Rayleigh)
+    alpha, beta = _forristall_parameters(hs, tp, depth=depth, sea_state=sea_state)
+    n_waves = (time_step*3600)/aux_funcs.estimate_Tz(tp, gamma=2.5)
+    # Expected number of exceedances of the return value in the time series is years/T
+    targets = -years/np.asarray(periods, dtype=float)
+
+    def log_cdf(x, scale, shape):
+        # sum_i N_i*log(1-exp(-(x/scale_i)**shape_i)) for all x, chunked over sea states
+        out = np.zeros(len(x))
+        xx = x.astype(dtype)[None, :]
+        for i in range(0, len(hs), chunk_size):
+            sc = scale[i:i+chunk_size, None].astype(dtype)
+            sh = shape[i:i+chunk_size, None].astype(dtype)
+            with np.errstate(divide='ignore'):
+                term = np.log1p(-np.exp(-(xx/sc)**sh))
+            out += (n_waves[i:i+chunk_size, None]*term).sum(axis=0, dtype=np.float64)
+        return out
+
+    def return_values(scale, shape):
+        # Coarse grid to bracket the return values, then a fine grid within each bracket
+        x_max = 4*scale.max()
+        while log_cdf(np.array([x_max]), scale, shape)[0] < targets.max():
+            x_max = 1.5*x_max
+        x = np.linspace(0, x_max, 65)
+        S = log_cdf(x, scale, shape)
+        j = np.clip(np.searchsorted(S, targets), 1, len(x)-1)
+        x_fine = np.unique(np.concatenate([np.linspace(x[k-1], x[k], 33) for k in j]))
+        S_fine = log_cdf(x_fine, scale, shape)
+        # The log-CDF is increasing in x, interpolation in log(-S) is close to linear
+        with np.errstate(divide='ignore'):
+            y = -np.log(-S_fine)
+        ok = np.isfinite(y)
+        return np.interp(-np.log(-targets), y[ok], x_fine[ok])
+
+    crest = return_values(alpha*hs, beta)
+    hmax = return_values(hs/np.sqrt(2), np.full_like(hs, 2.0))
+    return crest, hmax
+
+
+def _fit_params(sample, dist, guess=None, fit_method='mle'):
+    """
+    Fit a distribution to one sample and return its parameters as 
+    (shape, loc, scale), with shape set to nan for 2-parameter distributions.
+    Excess distributions (Weibull_2P, EXP, GP) are fitted to the sample as given, 
+    i.e. the threshold must already be subtracted.
+    guess, optional (shape, loc, scale) from a previous fit, is used as 
+    starting point of the optimizer.
+    fit_method is 'mle' (scipy maximum likelihood) or 'lmom' (L-moments).
+    """
+    if fit_method == 'lmom':
+        return aux_funcs.lmoments_fit(sample, dist)
+    if dist == 'GEV':
+        if guess is None:
+            return st.genextreme.fit(sample)
+        return st.genextreme.fit(sample, guess[0], loc=guess[1], scale=guess[2])
+    elif dist == 'GUM':
+        if guess is None:
+            loc, scale = st.gumbel_r.fit(sample)
+        else:
+            loc, scale = st.gumbel_r.fit(sample, loc=guess[1], scale=guess[2])
+        return np.nan, loc, scale
+    elif dist == 'Weibull_2P':
+        if guess is None:
+            return st.weibull_min.fit(sample, floc=0)
+        return st.weibull_min.fit(sample, guess[0], floc=0, scale=guess[2])
+    elif dist == 'EXP':
+        loc, scale = st.expon.fit(sample)
+        return np.nan, loc, scale
+    elif dist == 'GP':
+        if guess is None:
+            return st.genpareto.fit(sample)
+        return st.genpareto.fit(sample, guess[0], loc=guess[1], scale=guess[2])
+    else:
+        raise ValueError('please check method/distribution, must be one of: '
+                         'GEV, GUM, EXP, GP or Weibull_2P')
+
+
+def _fit_params_chunk(samples, dist, fit_method='mle'):
+    """
+    Fit a distribution to every row of a 2D array of samples.
+    Top-level so that it can be sent to worker processes.
+    """
+    if fit_method == 'lmom':
+        # L-moments are computed for all rows at once
+        return np.column_stack(aux_funcs.lmoments_fit(samples, dist, axis=1))
+    return np.array([_fit_params(sample, dist, fit_method=fit_method) for sample in samples])
+
+
+def _isf_params(dist, prob, shape, loc, scale):
+    """
+    Vectorized inverse survival function for the parameters returned by _fit_params.
+    All arguments are broadcast against each other.
+    """
+    if dist == 'GEV':
+        return st.genextreme.isf(prob, shape, loc, scale)
+    elif dist == 'GUM':
+        return st.gumbel_r.isf(prob, loc, scale)
+    elif dist == 'Weibull_2P':
+        return st.weibull_min.isf(prob, shape, loc, scale)
+    elif dist == 'EXP':
+        return st.expon.isf(prob, loc, scale)
+    elif dist == 'GP':
+        return st.genpareto.isf(prob, shape, loc, scale)
+    else:
+        raise ValueError('please check method/distribution, must be one of: '
+                         'GEV, GUM, EXP, GP or Weibull_2P')
+
+
+# scipy distributions behind the distribution names used in this module
+_SCIPY_DISTS = {'GEV': st.genextreme, 'GUM': st.gumbel_r, 'GUM_L': st.gumbel_l,
+                'EXP': st.expon, 'GP': st.genpareto, 'LoNo': st.lognorm,
+                'Weibull_2P': st.weibull_min, 'Weibull2P': st.weibull_min,
+                'Weibull_3P': st.weibull_min, 'Weibull3P': st.weibull_min,
+                'Weibull3P_MOM': st.weibull_min}
+
+
+class FittedExtremeModel:
+    """
+    A fitted extreme value distribution, which can be evaluated for any 
+    return period without refitting.
+
+    Return levels are computed as isf(1/(rate*period)) + threshold, where
+    rate is the number of events per year (1 for annual maxima, the mean 
+    number of peaks per year for POT), and the distribution is fitted to the
+    excesses above threshold (0 if the distribution is fitted to the values).
+    For 'GUM_L' (minima), the return levels are given by the ppf instead.
+
+    Parameters
+    ----------
+    dist: string
+        Name of the distribution, e.g. 'GEV', 'GUM', 'GP', 'EXP', 'Weibull_2P'
+    shape, loc, scale: float
+        Parameters of the distribution (scipy conventions), 
+        shape is None for 2-parameter distributions
+    threshold: float
+        Threshold subtracted from the data before fitting, default is 0
+    rate: float
+        Number of events per year, default is 1
+    var, method, r, fit_method: 
+        Metadata describing how the model was fitted
+    extremes: pd.Series
+        The sample the model was fitted to (before subtracting the threshold)
+    """
+
+    def __init__(self, dist, shape, loc, scale, threshold=0, rate=1,
+                 var=None, method=None, r=None, fit_method='mle', extremes=None):
+        if dist not in _SCIPY_DISTS:
+            raise ValueError(f'Unknown distribution {dist}, must be one of: '
+                             f'{", ".join(_SCIPY_DISTS)}')
+        self.dist = dist
+        self.shape = shape
+        self.loc = loc
+        self.scale = scale
+        self.threshold = threshold
+        self.rate = rate
+        self.var = var
+        self.method = method
+        self.r = r
+        self.fit_method = fit_method
+        self.extremes = extremes
+
+    def __repr__(self):
+        return (f'FittedExtremeModel(dist={self.dist!r}, shape={self.shape}, '
+                f'loc={self.loc}, scale={self.scale}, threshold={self.threshold}, '
+                f'rate={self.rate}, var={self.var!r}, method={self.method!r})')
+
+    @property
+    def n_extremes(self):
+        return None if self.extremes is None else len(self.extremes)
+
+    @property
+    def frozen(self):
+        """scipy.stats frozen distribution of the excesses"""
+        scipy_dist = _SCIPY_DISTS[self.dist]
+        if self.shape is None:
+            return scipy_dist(loc=self.loc, scale=self.scale)
+        return scipy_dist(self.shape, loc=self.loc, scale=self.scale)
+
+    def isf(self, prob):
+        """Value exceeded with probability prob by one event"""
+        return self.frozen.isf(prob) + self.threshold
+
+    def cdf(self, x):
+        """Probability of non-exceedance of x for one event"""
+        return self.frozen.cdf(np.asarray(x) - self.threshold)
+
+    def return_levels(self, periods):
+        """Return levels for an array of return periods (in years)"""
+        prob = 1/(self.rate*np.asarray(periods, dtype=float))
+        if self.dist == 'GUM_L':
+            return self.frozen.ppf(prob) + self.threshold
+        return self.isf(prob)
+
+
+# Process-level LRU cache of fitted models
+_FIT_CACHE = OrderedDict()
+_FIT_CACHE_SIZE = 128
+
+
+def clear_fit_cache():
+    """
+    Empties the cache of fitted extreme value models.
+    """
+    _FIT_CACHE.clear()
+
+
+def _data_fingerprint(ts):
+    """
+    Cheap identifier of the content of a time series (values and index).
+    """
+    hashes = pd.util.hash_pandas_object(ts, index=True).to_numpy()
+    return len(hashes), int(hashes.sum()), int(np.bitwise_xor.reduce(hashes, initial=0))
+
+
+def _cached_model(key, fit):
+    """
+    Returns the model stored under key, or fits it with fit() and stores it.
+    """
+    if key in _FIT_CACHE:
+        _FIT_CACHE.move_to_end(key)
+        return _FIT_CACHE[key]
+    model = fit()
+    _FIT_CACHE[key] = model
+    if len(_FIT_CACHE) > _FIT_CACHE_SIZE:
+        _FIT_CACHE.popitem(last=False)
+    return model
+
+
+def fit_extreme_model(data, var, method='POT', dist='GP', threshold=None, 
+                      r="48h", fit_method='mle', cache=True):
+    """
+    Fits an extreme value distribution to the peaks over threshold or to the
+    annual maxima of a time series. Fits are memoized on the content of the 
+    series and the fitting options, so that repeated calls (e.g. from tables 
+    and plots) share one fit.
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        Contains the time series
+    var: string
+        Name of the variable
+    method: string
+        'POT' for peaks over threshold (default) or 'AM' for annual maxima
+    dist: string
+        'GP', 'EXP' or 'Weibull_2P' for POT, 'GEV' or 'GUM' for AM
+    threshold: float
+        Threshold for POT, default is None (minimum of the annual maxima)
+    r: string
+        Minimum period of time between two peaks for POT. Default is '48h'.
+    fit_method: string
+        'mle' (default) for maximum likelihood or 'lmom' for L-moments
+    cache: bool
+        Use and fill the cache of fitted models, default is True
+
+    Returns
+    -------
+    model: FittedExtremeModel
+    """
+    def fit():
+        if method == 'POT':
+            thresh = get_threshold_os(data=data, var=var) if threshold is None else threshold
+            extremes = get_pot_extremes(data[var], threshold=thresh, r=r)
+            years = data.index.year
+            rate = extremes.shape[0]/(years[-1]-years[0]+1)
+            shape, loc, scale = _fit_params(extremes-thresh, dist, fit_method=fit_method)
+        elif method == 'AM':
+            thresh, rate = 0, 1
+            it_selected_max = data.groupby(data.index.year)[var].idxmax().values
+            # get annual maximum with actual dates that maximum occured
+            extremes = data[var].loc[it_selected_max]
+            shape, loc, scale = _fit_params(extremes, dist, fit_method=fit_method)
+        else:
+            raise ValueError('please check method, must be either POT or AM')
+        if _SCIPY_DISTS[dist].shapes is None:
+            shape = None
+        return FittedExtremeModel(dist, shape, loc, scale, threshold=thresh, rate=rate,
+                                  var=var, method=method, r=r, fit_method=fit_method,
+                                  extremes=extremes)
+    if not cache:
+        return fit()
+    key = ('fit_extreme_model', _data_fingerprint(data[var]), var, method, 
+           dist, threshold, r, fit_method)
+    return _cached_model(key, fit)
+
+
+def bootstrap_return_levels(extremes, dist, prob, threshold=0, 
+                            n_boot=1000, seed=None, n_jobs=1, fit_method='mle',
+                            chunk_size=2**18):
+    """
+    Bootstrap return levels of a set of extremes. All replicates are drawn 
+    at once as a (n_boot, n_extremes) index matrix, the distribution is fitted 
+    to each replicate (optionally spread over a pool of processes), and the 
+    return levels of all replicates are evaluated vectorized, in blocks of 
+    probabilities.
+
+    Parameters
+    ----------
+    extremes: 1D ndarray or pd.Series
+        Extremes to resample (annual maxima, or threshold excesses for POT)
+    dist: string
+        Distribution to fit, one of 'GEV', 'GUM', 'Weibull_2P', 'EXP' or 'GP'
+    prob: 1D ndarray or list
+        Exceedance probabilities per event, e.g. 1/periods for annual maxima
+        or 1/(ns_yr*periods) for POT
+    threshold: float
+        Added to the return levels (POT excesses), default is 0
+    n_boot: int
+        Number of bootstrap replicates, default is 1000
+    seed: int or None
+        Seed of the random generator, set it for reproducible results
+    n_jobs: int
+        Number of processes used for the fits. Default is 1 (no pool), 
+        -1 or None uses all available CPUs.
+    fit_method: string
+        'mle' (default) for scipy maximum likelihood fits or 'lmom' for 
+        L-moments, which fits all replicates at once without a pool
+    chunk_size: int
+        Approximate number of return levels evaluated at once, bounds the 
+        memory used on top of the returned array
+
+    Returns
+    -------
+    rl: 2D ndarray
+        Return levels of shape (n_boot, len(prob))
+    """
+    values = np.asarray(extremes, dtype=float)
+    prob = np.asarray(prob, dtype=float)
+    rng = np.random.default_rng(seed)
+    samples = values[rng.integers(0, len(values), size=(n_boot, len(values)))]
+
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, n_boot))
+    if n_jobs == 1 or fit_method == 'lmom':
+        params = _fit_params_chunk(samples, dist, fit_method)
+    else:
+        chunks = np.array_split(samples, n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            params = np.concatenate(list(executor.map(_fit_params_chunk, chunks, 
+                                                      [dist]*len(chunks),
+                                                      [fit_method]*len(chunks))))
+
+    # The return levels are evaluated in blocks of probabilities, written 
+    # into the output, so the temporaries of the isf stay small
+    shape, loc, scale = params[:, [0]], params[:, [1]], params[:, [2]]
+    rl = np.empty((n_boot, len(prob)))
+    block = max(1, chunk_size // n_boot)
+    for i in range(0, len(prob), block):
+        with np.errstate(all='ignore'):
+            rl[:, i:i+block] = _isf_params(dist, prob[np.newaxis, i:i+block], shape, loc, scale)
+    rl += threshold
+    return rl
+
+
+def _profile_parametrization(dist, shape, loc, scale):
+    """
+    Free parameters used for the profile likelihood of dist, their values at
+    (shape, loc, scale), and the mapping from an (m, n_free) array of free 
+    parameters back to (shape, loc, scale). Scales (and the Weibull shape) 
+    are free in log, the location of the excess distributions (GP, EXP) 
+    and Weibull_2P is kept at its fitted value.
+    """
+    if dist == 'GEV':
+        free = [shape, loc, np.log(scale)]
+        to_params = lambda u: (u[:, 0], u[:, 1], np.exp(u[:, 2]))
+    elif dist == 'GP':
+        free = [shape, np.log(scale)]
+        to_params = lambda u: (u[:, 0], np.full(len(u), loc), np.exp(u[:, 1]))
+    elif dist == 'Weibull_2P':
+        free = [np.log(shape), np.log(scale)]
+        to_params = lambda u: (np.exp(u[:, 0]), np.full(len(u), loc), np.exp(u[:, 1]))
+    elif dist == 'GUM':
+        free = [loc, np.log(scale)]
+        to_params = lambda u: (np.full(len(u), np.nan), u[:, 0], np.exp(u[:, 1]))
+    elif dist == 'EXP':
+        free = [np.log(scale)]
+        to_params = lambda u: (np.full(len(u), np.nan), np.full(len(u), loc), np.exp(u[:, 0]))
+    else:
+        raise ValueError('please check method/distribution, must be one of: '
+                         'GEV, GUM, EXP, GP or Weibull_2P')
+    return np.array(free, dtype=float), to_params
+
+
+def _nll_params(dist, x, shape, loc, scale, chunk_size=20000):
+    """
+    Negative log-likelihood of the sample x for arrays of parameters 
+    (shape, loc, scale), evaluated in chunks of parameter sets.
+    """
+    scipy_dist = _SCIPY_DISTS[dist]
+    nll = np.empty(len(scale))
+    for i in range(0, len(scale), chunk_size):
+        c = slice(i, i+chunk_size)
+        args = (loc[c, None], scale[c, None])
+        if scipy_dist.shapes is not None:
+            args = (shape[c, None],) + args
+        with np.errstate(all='ignore'):
+            nll[i:i+chunk_size] = -scipy_dist.logpdf(x[None, :], *args).sum(axis=1)
+    nll[~np.isfinite(nll)] = np.inf
+    return nll
+
+
+def profile_likelihood_return_levels(extremes, dist, prob, params, threshold=0,
+                                     uncertainty=0.95, n_directions=None, 
+                                     chunk_size=2**18):
+    """
+    Profile likelihood confidence intervals of return levels. The confidence 
+    region of the parameters, 2*(nll - min(nll)) <= chi2(1).ppf(uncertainty), 
+    is bounded along rays from the maximum likelihood fit, in coordinates 
+    aligned with the principal axes of the curvature of the nll, by bisection 
+    for all rays at once. The interval of each return level is the range of 
+    return levels over the boundary of the region, which gives the profile 
+    likelihood bounds up to the spacing of the rays. The same boundary is used
+    for all return periods, and the result is deterministic.
+
+    Parameters
+    ----------
+    extremes: 1D ndarray or pd.Series
+        Extremes the distribution is fitted to (annual maxima, or threshold 
+        excesses for POT)
+    dist: string
+        'GEV', 'GP', 'Weibull_2P', 'GUM' or 'EXP'
+    prob: 1D ndarray or list
+        Exceedance probabilities per event, e.g. 1/periods for annual maxima
+        or 1/(ns_yr*periods) for POT
+    params: tuple
+        Fitted (shape, loc, scale), shape is ignored for 2-parameter distributions
+    threshold: float
+        Added to the return levels (POT excesses), default is 0
+    uncertainty: float
+        Confidence level between 0 and 1, default is 0.95
+    n_directions: int
+        Number of rays, default 2000 for 3 free parameters and 720 for 2
+    chunk_size: int
+        Approximate number of return levels evaluated at once, bounds the 
+        memory used for many return periods
+
+    Returns
+    -------
+    ci_lower, ci_upper: 1D ndarrays
+        Lower and upper bounds of the return levels for each probability
+    """
+    x = np.asarray(extremes, dtype=float)
+    x = x[np.isfinite(x)]
+    prob = np.asarray(prob, dtype=float)
+    shape, loc, scale = params
+    free0, to_params = _profile_parametrization(dist, shape, loc, scale)
+    k = len(free0)
+
+    def nll(u):
+        return _nll_params(dist, x, *to_params(np.atleast_2d(u)))
+
+    # The region is relative to the maximum of the likelihood, 
+    # the fitted parameters (e.g. from L-moments) are refined first
+    res = minimize(lambda u: nll(u)[0], free0, method='Nelder-Mead', 
+                   options={'xatol': 1e-8, 'fatol': 1e-10})
+    if res.fun < nll(free0)[0]:
+        free0 = res.x
+    nll0 = nll(free0)[0]
+    if not np.isfinite(nll0):
+        return np.full(len(prob), np.nan), np.full(len(prob), np.nan)
+
+    # Curvature of the nll at the fit by central differences, all points at once
+    h = 1e-3*np.maximum(1, np.abs(free0))
+    steps = [(i, j, si, sj) for i in range(k) for j in range(i, k) 
+             for si in (-1, 1) for sj in (-1, 1)]
+    points = np.array([free0 + si*h[i]*np.eye(k)[i] + sj*h[j]*np.eye(k)[j] 
+                       for i, j, si, sj in steps])
+    values = nll(points)
+    H = np.zeros((k, k))
+    for (i, j, si, sj), v in zip(steps, values):
+        if i == j:
+            # (f(x+2h) - 2f(x) + f(x-2h)) / (4h^2), the mixed terms (si != sj) give f(x)
+            H[i, i] += (v if si == sj else -v) / (4*h[i]**2)
+        else:
+            H[i, j] += si*sj*v / (4*h[i]*h[j])
+            H[j, i] = H[i, j]
+    eig, V = np.linalg.eigh(H)
+    # Flat or ill-defined directions get the smallest positive curvature
+    good = np.isfinite(eig) & (eig > 0)
+    eig = np.where(good, eig, eig[good].min() if good.any() else 1.0)
+    # Whitened coordinates t, where nll - nll0 ~ |t|^2/2
+    L = V / np.sqrt(eig)
+    crit = st.chi2.ppf(uncertainty, 1) / 2
+
+    # Unit directions: both signs for 1 free parameter, a circle for 2,
+    # a Fibonacci sphere for 3
+    if k == 1:
+        d = np.array([[-1.0], [1.0]])
+    elif k == 2:
+        n = n_directions or 720
+        a = 2*np.pi*np.arange(n)/n
+        d = np.column_stack((np.cos(a), np.sin(a)))
+    else:
+        n = n_directions or 2000
+        z = 1 - (2*np.arange(n) + 1)/n
+        a = np.pi*(3 - np.sqrt(5))*np.arange(n)
+        d = np.column_stack((np.sqrt(1 - z**2)*np.cos(a), np.sqrt(1 - z**2)*np.sin(a), z))
+    D = d @ L.T
+
+    # Outer radius of each ray, doubled as long as the ray is inside the region
+    # (rays of an unbounded region stop after 10 doublings)
+    r_in = np.zeros(len(d))
+    r_out = np.full(len(d), 2*np.sqrt(2*crit))
+    for _ in range(10):
+        inside = nll(free0 + r_out[:, None]*D) - nll0 <= crit
+        if not inside.any():
+            break
+        r_in[inside] = r_out[inside]
+        r_out[inside] = 2*r_out[inside]
+    for _ in range(25):
+        r = (r_in + r_out)/2
+        inside = nll(free0 + r[:, None]*D) - nll0 <= crit
+        r_in = np.where(inside, r, r_in)
+        r_out = np.where(inside, r_out, r)
+    boundary = np.vstack((free0, free0 + r_in[:, None]*D))
+    shape_b, loc_b, scale_b = (p[:, None] for p in to_params(boundary))
+
+    # Range of the return levels over the boundary, in blocks of probabilities
+    ci_lower, ci_upper = np.empty(len(prob)), np.empty(len(prob))
+    block = max(1, chunk_size // len(boundary))
+    for i in range(0, len(prob), block):
+        with np.errstate(all='ignore'):
+            rl = _isf_params(dist, prob[np.newaxis, i:i+block], shape_b, loc_b, scale_b)
+        ci_lower[i:i+block] = np.nanmin(rl, axis=0)
+        ci_upper[i:i+block] = np.nanmax(rl, axis=0)
+    return ci_lower + threshold, ci_upper + threshold
+
+
 def return_levels_annual_max_uncertainty(data, var='hs', dist='GEV', 
                              periods=[50, 100, 1000],
-                             uncertainty=None): 
+                             uncertainty=None, n_boot=1000,
+                             seed=None, n_jobs=1, fit_method='mle',
+                             ci_method='bootstrap'): 
     """
     This function calulates return value estimates for different periods, fitting 
     a Generalized Extreme Value ('GEV') or a Gumbel ('GUM') distribution to given 
@@ -1049,6 +2125,20 @@ def return_levels_annual_max_uncertainty(data, var='hs', dist='GEV',
         Distribution to fit to the data. Either 'GEV' for Generalize Extreme Value or 'GUM' for Gumbel.
     uncertainty: float 
         Confidence interval between 0 and 1 (recommended 0.95)
+    n_boot: int
+        Number of bootstrap replicates used for the confidence interval, default is 1000
+    seed: int or None
+        Seed of the bootstrap random generator, set it for reproducible intervals
+    n_jobs: int
+        Number of processes used to fit the bootstrap replicates, 
+        default is 1, -1 uses all CPUs
+    fit_method: string
+        'mle' (default) for maximum likelihood or 'lmom' for L-moments, 
+        used for the fit and the bootstrap replicates
+    ci_method: string
+        'bootstrap' (default) for bootstrap percentile intervals or 'profile' 
+        for profile likelihood intervals (no resampling, n_boot, seed and 
+        n_jobs are then ignored)
 
     Returns
     -------
@@ -1061,25 +2151,18 @@ def return_levels_annual_max_uncertainty(data, var='hs', dist='GEV',
     Function written by dung-manh-nguyen and KonstantinChri.
     Modified by clio-met 
     """
-    it_selected_max = data.groupby(data.index.year)[var].idxmax().values
-    # get annual maximum with actual dates that maximum occured
-    data_am = data[var].loc[it_selected_max]
     periods = np.array(periods, dtype=float)
-    if dist == 'GEV':
-        # fit data
-        shape, loc, scale = st.genextreme.fit(data_am) 
-        # Compute the return levels for several return periods
-        return_levels = st.genextreme.isf(1/periods, shape, loc, scale)
-        prob_non_exc = st.genextreme.cdf(return_levels, shape, loc, scale)
-    elif dist == 'GUM': 
-        loc, scale = st.gumbel_r.fit(data_am) # fit data
-        # Compute the return levels for several return periods.
-        return_levels = st.gumbel_r.isf(1/periods, loc, scale)
-        prob_non_exc = st.gumbel_r.cdf(return_levels, loc, scale)
-
-    else:
+    if dist not in ['GEV', 'GUM']:
         print ('please check method/distribution, must be either GEV or GUM')
 
+    # The fit is shared with previous calls on the same data and options
+    model = fit_extreme_model(data, var, method='AM', dist=dist, fit_method=fit_method)
+    # get annual maximum with actual dates that maximum occured
+    data_am = model.extremes
+    # Compute the return levels for several return periods
+    return_levels = model.return_levels(periods)
+    prob_non_exc = model.cdf(return_levels)
+
     df = pd.DataFrame({'return_levels':return_levels,
                        'periods': periods})
     df = df.set_index('periods')
@@ -1088,25 +2171,16 @@ def return_levels_annual_max_uncertainty(data, var='hs', dist='GEV',
     df.attrs['dist'] = dist
     df.attrs['var'] = var
 
-    if uncertainty is not None:
-        rl=np.zeros((len(periods),1000))
-        for i in range(1000):
-            extremes1=np.random.choice(data_am.to_numpy(), size=len(data_am), replace=True)
-            extremes1=pd.Series(extremes1,index=data_am.index,name=var)
-            if dist == 'GEV':
-                # fit data
-                shape, loc, scale = st.genextreme.fit(extremes1) 
-                # Compute the return levels for several return periods       
-                return_levels = st.genextreme.isf(1/periods, shape, loc, scale)
-            elif dist == 'GUM':
-                loc, scale = st.gumbel_r.fit(extremes1) # fit data
-                # Compute the return levels for several return periods.
-                return_levels = st.gumbel_r.isf(1/periods, loc, scale)
-            else:
-                print ('please check method/distribution, must be either GEV or GUM')
-            rl[:,i]=return_levels
-            del return_levels
-        ci_low_rl,ci_high_rl=np.quantile(rl,q=[(1-uncertainty)/2,(1+uncertainty)/2],axis=1)
+    if uncertainty is not None and ci_method == 'profile':
+        ci_low_rl, ci_high_rl = profile_likelihood_return_levels(
+            data_am, dist, 1/periods, (model.shape, model.loc, model.scale),
+            uncertainty=uncertainty)
+        df['ci_lower_rl'] = ci_low_rl.tolist()
+        df['ci_upper_rl'] = ci_high_rl.tolist()
+    elif uncertainty is not None:
+        rl = bootstrap_return_levels(data_am, dist, 1/periods, n_boot=n_boot, 
+                                     seed=seed, n_jobs=n_jobs, fit_method=fit_method)
+        ci_low_rl,ci_high_rl=np.nanquantile(rl,q=[(1-uncertainty)/2,(1+uncertainty)/2],axis=0)
         del rl
         df['ci_lower_rl'] = ci_low_rl.tolist()
         df['ci_upper_rl'] = ci_high_rl.tolist()
@@ -1117,7 +2191,9 @@ def return_levels_annual_max_uncertainty(data, var='hs', dist='GEV',
 def return_levels_pot_uncertainty(data, var, dist='Weibull_2P', 
                       periods=[50, 100, 1000], 
                       threshold=None, r="48h",
-                      uncertainty=None):
+                      uncertainty=None, n_boot=1000,
+                      seed=None, n_jobs=1, fit_method='mle',
+                      ci_method='bootstrap'):
     """
     This function calulates return value estimates for different periods, fitting
     a given distribution to threshold excess values of the data.  
@@ -1140,6 +2216,20 @@ def return_levels_pot_uncertainty(data, var, dist='Weibull_2P',
         Minimum period of time between two peaks. Default is '48h'.
     uncertainty: float
         Confidence interval between 0 and 1 (recommended 0.95)
+    n_boot: int
+        Number of bootstrap replicates used for the confidence interval, default is 1000
+    seed: int or None
+        Seed of the bootstrap random generator, set it for reproducible intervals
+    n_jobs: int
+        Number of processes used to fit the bootstrap replicates, 
+        default is 1, -1 uses all CPUs
+    fit_method: string
+        'mle' (default) for maximum likelihood or 'lmom' for L-moments, 
+        used for the fit and the bootstrap replicates
+    ci_method: string
+        'bootstrap' (default) for bootstrap percentile intervals or 'profile' 
+        for profile likelihood intervals (no resampling, n_boot, seed and 
+        n_jobs are then ignored)
 
     Returns
     -------    
@@ -1154,44 +2244,23 @@ def return_levels_pot_uncertainty(data, var, dist='Weibull_2P',
     Modified by clio-met
     """
 
+    if dist not in ['Weibull_2P', 'EXP', 'GP']:
+        print ('please check method/distribution, must be one of: EXP, \
+                GP or Weibull_2P')
+
     if threshold is None:
         threshold = get_threshold_os(data=data, var=var)
-    else:
-        pass
-    
-    extremes = get_extremes(data[var], method="POT", threshold=threshold, r=r)
     
-    years = data.index.year
-
+    # The fit is shared with previous calls on the same data and options
+    model = fit_extreme_model(data, var, method='POT', dist=dist, threshold=threshold,
+                              r=r, fit_method=fit_method)
+    extremes = model.extremes
     return_periods = np.array(periods)
-    # Calculate the mean number of events per year (ns_yr)
-    yrs_ev=extremes.index.year.to_numpy()
-    nbev=[]
-    for i in range(years[0],years[-1]+1,1):
-        nbev.append(len(np.where(yrs_ev==i)[0]))
-
-    ns_yr=np.mean(np.array(nbev))
-    del nbev
-    if dist == 'Weibull_2P':
-        shape, loc, scale = st.weibull_min.fit(extremes-threshold, floc=0)
-        return_levels = st.weibull_min.isf(1/(ns_yr*return_periods), 
-                                              shape, loc, scale)\
-                                              + threshold
-        prob_non_exc = st.weibull_min.cdf(return_levels-threshold, shape, loc, scale)
-    elif dist == 'EXP':
-        loc, scale = st.expon.fit(extremes-threshold)
-        return_levels = st.expon.isf(1/(ns_yr*return_periods), loc, scale)\
-                                        + threshold
-        prob_non_exc = st.expon.cdf(return_levels-threshold, loc, scale)
-    elif dist == 'GP':
-        shape, loc, scale = st.genpareto.fit(extremes-threshold)
-        return_levels = st.genpareto.isf(1/(ns_yr*return_periods), 
-                                            shape, loc, scale)\
-                                            + threshold
-        prob_non_exc = st.genpareto.cdf(return_levels-threshold, shape, loc, scale)
-    else:
-        print ('please check method/distribution, must be one of: EXP, \
-                GP or Weibull_2P')
+    # Mean number of events per year (ns_yr), 
+    # it does not change between bootstrap replicates
+    ns_yr = model.rate
+    return_levels = model.return_levels(return_periods)
+    prob_non_exc = model.cdf(return_levels)
     df = pd.DataFrame({'return_levels':return_levels,
                        'periods': np.array(return_periods)})
     df = df.set_index('periods')
@@ -1202,38 +2271,18 @@ def return_levels_pot_uncertainty(data, var, dist='Weibull_2P',
     df.attrs['r'] = '48h'
     df.attrs['threshold'] = threshold
     df.attrs['var'] = var
-    if uncertainty is not None:
-        rl=np.zeros((len(return_periods),1000))
-        for i in range(1000):
-            extremes1=np.random.choice(extremes.to_numpy(), size=len(extremes), replace=True)
-            extremes1=pd.Series(extremes1,index=extremes.index,name=var)
-            # Calculate the mean number of events per year (ns_yr)
-            yrs_ev=extremes.index.year.to_numpy()
-            nbev=[]
-            for j in range(years[0],years[-1]+1,1):
-                nbev.append(len(np.where(yrs_ev==j)[0]))
-            ns_yr=np.mean(np.array(nbev))
-            del nbev,yrs_ev
-            if dist == 'Weibull_2P':
-                shape, loc, scale = st.weibull_min.fit(extremes1-threshold, floc=0)
-                return_levels = st.weibull_min.isf(1/(ns_yr*return_periods), 
-                                                    shape, loc, scale)\
-                                                    + threshold
-            elif dist == 'EXP':
-                loc, scale = st.expon.fit(extremes1-threshold)
-                return_levels = st.expon.isf(1/(ns_yr*return_periods), loc, scale)\
-                                                + threshold # Delta_t    # Delta T /return_periods
-            elif dist == 'GP':
-                shape, loc, scale = st.genpareto.fit(extremes1-threshold)
-                return_levels = st.genpareto.isf(1/(ns_yr*return_periods), 
-                                                    shape, loc, scale)\
-                                                    + threshold
-            else:
-                print ('please check method/distribution, must be one of: EXP, \
-                        GP or Weibull_2P')
-            rl[:,i]=return_levels
-            del return_levels
-        ci_low_rl,ci_high_rl=np.nanquantile(rl,q=[(1-uncertainty)/2,(1+uncertainty)/2],axis=1)
+    if uncertainty is not None and ci_method == 'profile':
+        ci_low_rl, ci_high_rl = profile_likelihood_return_levels(
+            extremes-threshold, dist, 1/(ns_yr*return_periods), 
+            (model.shape, model.loc, model.scale), threshold=threshold, 
+            uncertainty=uncertainty)
+        df['ci_lower_rl'] = ci_low_rl.tolist()
+        df['ci_upper_rl'] = ci_high_rl.tolist()
+    elif uncertainty is not None:
+        rl = bootstrap_return_levels(extremes-threshold, dist, 1/(ns_yr*return_periods),
+                                     threshold=threshold, n_boot=n_boot, 
+                                     seed=seed, n_jobs=n_jobs, fit_method=fit_method)
+        ci_low_rl,ci_high_rl=np.nanquantile(rl,q=[(1-uncertainty)/2,(1+uncertainty)/2],axis=0)
         del rl
         df['ci_lower_rl'] = ci_low_rl.tolist()
         df['ci_upper_rl'] = ci_high_rl.tolist()
@@ -1243,7 +2292,7 @@ def return_levels_pot_uncertainty(data, var, dist='Weibull_2P',
 
 def get_empirical_return_levels_new(data, var, method="POT",
                                 block_size="365.2425D",
-                                threshold=None):
+                                threshold=None, plotting_position='weibull'):
     """
     This function returns an estimation of observed return periods and return levels.
     
@@ -1260,6 +2309,8 @@ def get_empirical_return_levels_new(data, var, method="POT",
         Size of the block for block maxima (default is one year)
     threshold: float
         Threshold to be used for peak-over-threshold, default is None
+    plotting_position: string
+        'weibull' (default), 'gringorten' or 'hazen'
     
     Returns
     -------
@@ -1273,31 +2324,16 @@ def get_empirical_return_levels_new(data, var, method="POT",
     """
     
     if method == 'BM':
-        extremes = get_extremes(ts=data[var],
-                                method=method,
-                                block_size=block_size)
-        # The method above gives at least one more date.
-        # Therefore we have to remove the unwanted row(s).
-        years_ex=extremes.index.year.to_numpy()
-        if (len(years_ex)>(np.max(years_ex)-np.min(years_ex)+1)):
-            yr_unique=np.unique(years_ex)
-            for yr in range(yr_unique[0],yr_unique[-1]+1):
-                ix=np.where(years_ex==yr)[0]
-                if len(ix)>1:
-                    imin=ix[np.argmin(extremes[extremes.index.year==yr].to_numpy())]
-                    extremes=extremes.drop(index=extremes.index[imin])
-        rp = get_return_periods(ts=data[var],
-                                extremes=extremes,
-                                extremes_method=method,
-                                extremes_type="high",
-                                return_period_size=block_size)
-        df = pd.DataFrame(rp).rename(columns = {
-                                 'return period':'return_periods',
-                                 var: 'return_levels'
-                                 })\
-                             .loc[:,['return_levels', 'return_periods']]
+        extremes = _block_maxima(data[var], block_size=block_size)
+        # The blocks are not aligned with the calendar years, a year can 
+        # contain two block maxima, only the largest one is kept 
+        # (the last one in case of ties)
+        reverse = extremes.iloc[::-1]
+        extremes = extremes.loc[reverse.groupby(reverse.index.year).idxmax().sort_values().to_numpy()]
+        df = _empirical_frame(extremes, _block_rate(extremes, block_size), plotting_position)
         # Add a column with the probability of non exceedance
-        df['prob_non_exceedance'] = 1-rp['exceedance probability']
+        df['prob_non_exceedance'] = 1-df['exceedance_probability']
+        df = df.loc[:,['return_levels', 'return_periods', 'prob_non_exceedance']]
         df.attrs['method'] = 'BM'
         df.attrs['block_size'] = block_size
         df.attrs['var'] = var
@@ -1307,21 +2343,14 @@ def get_empirical_return_levels_new(data, var, method="POT",
         if threshold is None:
              threshold = get_threshold_os(data=data, var=var)   
              
-        extremes = get_extremes(ts=data[var],
-                                method=method,
-                                threshold=threshold)
-
-        rp = get_return_periods(ts=data[var],
-                                extremes=extremes,
-                                extremes_method=method,
-                                extremes_type="high")
-        df = pd.DataFrame(rp).rename(columns = {
-                                 'return period':'return_periods',
-                                 var: 'return_levels',
-                                 })\
-                             .loc[:,['return_levels', 'return_periods']]
+        extremes = get_pot_extremes(ts=data[var],
+                                    threshold=threshold,
+                                    r="24h")
+        n_years = (data.index.max() - data.index.min())/pd.to_timedelta("365.2425D")
+        df = _empirical_frame(extremes, len(extremes)/n_years, plotting_position)
         # Add a column with the probability of non exceedance
-        df['prob_non_exceedance'] = 1-rp['exceedance probability']
+        df['prob_non_exceedance'] = 1-df['exceedance_probability']
+        df = df.loc[:,['return_levels', 'return_periods', 'prob_non_exceedance']]
         #print(df['prob_non_exceedance'])
         df.attrs['method'] = 'POT'
         df.attrs['threshold'] = threshold
@@ -1329,8 +2358,7 @@ def get_empirical_return_levels_new(data, var, method="POT",
 
     return df
 
-def cca_profiles(data,var='current_speed_',month=None,percentile=None,return_period=None,distribution='GUM',method='default',threshold='default'):
-    import sys
+def cca_profiles(data,var='current_speed_',month=None,percentile=None,return_period=None,distribution='GUM',method='default',threshold='default',n_jobs=1):
     """
     This function calculates the CCA profiles for a specific percentile or a specific return period.
 
@@ -1348,6 +2376,8 @@ def cca_profiles(data,var='current_speed_',month=None,percentile=None,return_per
         Return-period e.g., 10 for a 10-yr return period
     distrbution, method, and threshold: 3 strings
         To be provided only if return_period is specified
+    n_jobs: int, default 1
+        Number of processes used to fit the return values of the levels (-1 or None for all CPUs)
 
     Returns
     -------
@@ -1396,31 +2426,29 @@ def cca_profiles(data,var='current_speed_',month=None,percentile=None,return_per
         # Calculate the percentiles for each depth separately
         wcs=np.percentile(df_sel.to_numpy(),percentile,axis=0)
     if return_period is not None:
-        # Calculate the return values for the specified return period for each level separately
+        # Calculate the return values for the specified return period for each level separately,
+        # the fits are independent and can run in a pool (n_jobs)
         wcs=np.full((len(levels)),np.nan)
-        for i in range(len(levels)):
-            if not(df_sel[list_col[i]].isnull().iloc[0]):
-                _,_,_,a=RVE_ALL(df_sel,var=list_col[i],periods=return_period,distribution=distribution,method=method,threshold=threshold)
-                wcs[i]=a
-                del a
+        fitted=[i for i in range(len(levels)) if not(df_sel[list_col[i]].isnull().iloc[0])]
+        tasks=[(df_sel[[list_col[i]]],list_col[i],return_period,distribution,method,threshold) for i in fitted]
+        for i,(_,_,_,a) in zip(fitted,_run_RVE_ALL(tasks,n_jobs=n_jobs)):
+            wcs[i]=a
     # Number of vertical levels available for the point considered
     if len(np.where(np.isnan(wcs))[0])==0:
         nlevels=len(wcs)
     else:
         nlevels=np.where(np.isnan(wcs))[0][0]
-    # Calculate the current at the other depths when curr_ref = percentile or return-period value  
-    cca_prof=np.zeros((nlevels,nlevels))
-    for d in range(nlevels): # Loop over the worst case level
-        prof_others=df_sel.drop(columns=[list_col[d]]).to_numpy() # extract currents as a matrix for all levels except the worst-case one
-        prof_wcd=df_sel[list_col[d]].to_numpy() # extract currents at the worst-case level
-        list_ind=np.arange(0,nlevels,1).tolist()
-        del list_ind[d] # remove the index of the worst-case level (index d)
-        cca_prof[d,d]=wcs[d]
-        i=0
-        for dd in list_ind: # Loop over the other levels
-            cca_prof[dd,d]=np.mean(prof_others[:,i],axis=0)+np.corrcoef(prof_wcd,prof_others[:,i])[0][1]*np.std(prof_others[:,i],axis=0)*((wcs[d]-np.mean(prof_wcd))/np.std(prof_wcd))
-            if cca_prof[dd,d]>wcs[dd]:
-                cca_prof[dd,d]=wcs[dd]
-            i=i+1
+    # Calculate the current at the other depths when curr_ref = percentile or return-period value
+    # cca_prof[dd,d] = mean[dd] + corr[d,dd]*std[dd]*(wcs[d]-mean[d])/std[d], with the mean, std
+    # and correlation matrix computed once for all levels
+    prof=df_sel.iloc[:,0:nlevels].to_numpy()
+    mean=np.mean(prof,axis=0)
+    std=np.std(prof,axis=0)
+    corr=np.atleast_2d(np.corrcoef(prof,rowvar=False))
+    wcs_n=wcs[0:nlevels]
+    cca_prof=mean[:,None]+corr.T*std[:,None]*((wcs_n-mean)/std)[None,:]
+    # Points of the profile exceeding the worst case are brought back down to the worst case value
+    cca_prof=np.where(cca_prof>wcs_n[:,None],wcs_n[:,None],cca_prof)
+    cca_prof[np.diag_indices(nlevels)]=wcs_n
     return levels[0:nlevels],wcs[0:nlevels],cca_prof
 
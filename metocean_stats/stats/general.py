@@ -11,6 +11,7 @@ from math import floor,ceil
 from scipy.signal import find_peaks
 
 from .aux_funcs import convert_latexTab_to_csv
+from . import spec_funcs
 from ..tables import general as tg
 
 def calculate_scatter(data,var1, step_var1, var2, step_var2, from_origin=False, labels_lower=False):
@@ -117,23 +118,7 @@ def Cmax(Hs,Tm,depth):
     g = 9.80665 # m/s2, gravity 
     Tm01 = Tm # second, period 
     d = depth # m, depth
-    lamda1 = 1 # wave length from 8.5 to 212 
-    lamda2 = 500 # wave length from 8.5 to 212 
-    k1_temp=np.linspace(2*np.pi/lamda2,2*np.pi/lamda1,10000)
-    F = (2*np.pi)**2/(g*Tm01**2*np.tanh(k1_temp*d)) - k1_temp
-    #plt.plot(k1_temp,F)
-    #plt.grid()
-    
-    
-    epsilon = abs(F)
-    try:
-        param = find_peaks(1/epsilon)
-        index = param[0][0]
-    except:
-        param = np.where(epsilon == epsilon.min())
-        index = param[0][0]
-        
-    k1 = k1_temp[index]
+    k1 = spec_funcs.wavenumber(Tm01, d, period=True, g=g)
     #lamda = 2*np.pi/k1
     #print ('wave length (m) =', round(lamda))
     
@@ -258,6 +243,44 @@ def scatter(df,var1,var2,location,regression_line,qqplot=True):
 
 
 
+def _calm_runs(mask):
+    """
+    First index and end index (exclusive) of the runs of consecutive True 
+    values of the boolean array mask, from np.diff of the mask.
+    """
+    mask = np.asarray(mask, dtype=bool).ravel()
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _calm_run_length(mask):
+    """
+    Number of consecutive True values of the boolean array mask starting at
+    each index (0 where mask is False).
+    """
+    mask = np.asarray(mask, dtype=bool).ravel()
+    starts, ends = _calm_runs(mask)
+    run_end = np.zeros(len(mask), dtype=np.int64)
+    run_end[mask] = np.repeat(ends, ends - starts)
+    return np.where(mask, run_end - np.arange(len(mask)), 0)
+
+
+def _waiting_steps(mask, od):
+    """
+    Number of time steps to wait from each index until the next start of a
+    window of od consecutive True values of mask. Stops at the last start 
+    found, returns an empty array if there is none.
+    """
+    valid = _calm_run_length(mask) >= od
+    if not valid.any():
+        return np.zeros(0, dtype=np.int64)
+    last = np.flatnonzero(valid)[-1]
+    idx = np.arange(last+1)
+    # Reverse cumulative minimum gives the next valid start of each index
+    next_start = np.minimum.accumulate(np.where(valid[:last+1], idx, last)[::-1])[::-1]
+    return next_start - idx
+
+
 def weather_window_length(time_series,threshold,op_duration,timestep,month=None):
     """
     This function calculates weather windows statistics for a condition on one variable
@@ -292,65 +315,200 @@ def weather_window_length(time_series,threshold,op_duration,timestep,month=None)
     month_ts = time_series.index.month
     ts_mask=np.where(time_series<threshold,1,0)
     od=int(op_duration/timestep)
-    ts=np.zeros((len(ts_mask)-od+1))
-    for i in range(len(ts_mask)-od+1):
-        ts[i]=np.sum(ts_mask[i:i+od])
-    s0=np.where(ts==od)[0].tolist()
-    mon_s0=month_ts[0:s0[-1]+1]
-    wt=[]
-    for s in range(len(s0)):
-        if s0[s]==0:
-            wt.append(0)
-        elif s==0:
-            diff=s0[s]
-            a=0
-            wt.append(diff)
-            while (diff!=0):
-                diff=s0[s]-a-1
-                wt.append(diff*timestep)
-                a=a+1
-        else:
-            diff=s
-            a=0
-            while (diff!=0):
-                diff=s0[s]-s0[s-1]-a-1
-                wt.append(diff*timestep)
-                a=a+1
-    wt1=(np.array(wt)+op_duration)/24
+    # Waiting time (in steps) from each time step to the next operation window
+    wt=_waiting_steps(ts_mask,od)
+    mon_s0=month_ts[0:len(wt)]
+    wt1=(wt*timestep+op_duration)/24
     # Note that in this subroutine, we stop the calculation of the waiting time
     # at the first timestep of the last operating period found in the timeseries
-    if month is None:
-        mean = np.mean(wt1)
-        p10 = np.percentile(wt1,10)
-        p50 = np.percentile(wt1,50)
-        p90 = np.percentile(wt1,90)
-    else:
-        mean = np.mean(wt1[mon_s0==month])
-        p10 = np.percentile(wt1[mon_s0==month],10)
-        p50 = np.percentile(wt1[mon_s0==month],50)
-        p90 = np.percentile(wt1[mon_s0==month],90)
+    if month is not None:
+        wt1 = wt1[mon_s0==month]
+    if len(wt1)==0:
+        # No operation window found
+        return (np.nan,)*4
+    mean = np.mean(wt1)
+    p10, p50, p90 = np.percentile(wt1,[10,50,90])
     return mean, p10, p50, p90
 
 
-def weather_window_length_MultipleVariables(df,vars,threshold,op_duration,timestep,month=None):
+def _split_by_segments(a,b,seg_start):
+    """
+    Splits the index intervals [a, b] (inclusive) at the starts of the 
+    segments seg_start (sorted, seg_start[0] == 0). Returns the first and
+    last index of the pieces, the segment and the interval of each piece.
+    """
+    bounds = seg_start[1:]
+    if len(bounds) == 0:
+        return a, b, np.zeros(len(a), dtype=int), np.arange(len(a))
+    lo = np.searchsorted(bounds, a, side='right')
+    n_pieces = np.searchsorted(bounds, b, side='right') - lo + 1
+    interval = np.repeat(np.arange(len(a)), n_pieces)
+    k = np.arange(len(interval)) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+    first = np.where(k == 0, a[interval], np.take(bounds, lo[interval] + k - 1, mode='clip'))
+    last = np.where(k == n_pieces[interval] - 1, b[interval], np.take(bounds, lo[interval] + k, mode='clip') - 1)
+    segment = np.searchsorted(seg_start, first, side='right') - 1
+    return first, last, segment, interval
+
+
+def weather_window_length_matrix(time_series,thresholds,op_durations,timestep,months=None):
+    """
+    This function calculates the mean waiting time of weather_window_length
+    for all combinations of thresholds and operation durations, and optionally
+    of months. The calm runs are found once per threshold, and the waiting 
+    times of every duration and month are derived from the same runs.
+
+    Parameters
+    ----------
+    time_series: pd.Series
+        Contains timeseries of the variable of interest
+    thresholds: list of floats
+        Thresholds below which operation is possible (same unit as timeseries)
+    op_durations: list of floats
+        Durations of operation in hours
+    timestep: float
+        Time resolution of time_series in hours
+    months: list of integers
+        Months (1 for January to 12 for December) of the start time steps,
+        as month in weather_window_length. Default is None (all year)
+
+    Returns
+    -------
+    Returns an array of shape (len(op_durations), len(thresholds)), or 
+    (len(months), len(op_durations), len(thresholds)) if months are given,
+    with the mean waiting time in days (NaN where no operation window is found)
+    """
+    values = np.asarray(time_series, dtype=float).ravel()
+    thresholds = np.asarray(thresholds, dtype=float)
+    op_durations = np.asarray(op_durations, dtype=float)
+    if months is None:
+        # One group for the whole series
+        seg_start, seg_group, n_groups = np.array([0]), np.array([0]), 1
+    else:
+        # Segments of consecutive time steps in the same month, 
+        # months which are not requested go to an extra group
+        month_ts = np.asarray(time_series.index.month)
+        group_of_month = np.full(13, len(months))
+        group_of_month[np.asarray(months)] = np.arange(len(months))
+        seg_start = np.flatnonzero(np.concatenate(([True], month_ts[1:] != month_ts[:-1])))
+        seg_group, n_groups = group_of_month[month_ts[seg_start]], len(months) + 1
+    seg_end = np.append(seg_start[1:], len(values))
+    # Number of time steps of each group before each segment
+    seg_count = np.zeros((len(seg_start) + 1, n_groups))
+    seg_count[np.arange(1, len(seg_start) + 1), seg_group] = seg_end - seg_start
+    seg_count = np.cumsum(seg_count, axis=0)
+
+    order = np.argsort(thresholds)
+    # values < thresholds[order[k]] <=> fewer than k+1 sorted thresholds are <= value,
+    # the masks of increasing thresholds are nested
+    rank = np.searchsorted(thresholds[order], values, side='right')
+    rank[np.isnan(values)] = len(thresholds)
+    mean = np.full((n_groups, len(op_durations), len(thresholds)), np.nan)
+    for k, j in enumerate(order):
+        starts, ends = _calm_runs(rank <= k)
+        for i, op in enumerate(op_durations):
+            od = int(op/timestep)
+            # Valid starts form one block [start, end-od] per run of at least od steps
+            long = (ends - starts) >= od
+            if not long.any():
+                continue
+            first, last = starts[long], ends[long] - od
+            # Steps waiting before the first block, and between the blocks:
+            # from index a to b, the waiting time is next - index
+            a = np.concatenate(([0], last[:-1] + 1))
+            b, next_start = first - 1, first
+            waiting = b >= a
+            a, b, next_start = a[waiting], b[waiting], next_start[waiting]
+            p_first, p_last, segment, interval = _split_by_segments(a, b, seg_start)
+            n = p_last - p_first + 1
+            steps = np.bincount(seg_group[segment], weights=n*next_start[interval] - (p_first + p_last)*n/2,
+                                minlength=n_groups)
+            # All time steps up to the last valid start are counted
+            s = np.searchsorted(seg_start, last[-1], side='right') - 1
+            count = seg_count[s].copy()
+            count[seg_group[s]] += last[-1] - seg_start[s] + 1
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean[:, i, j] = (steps/count*timestep + op)/24
+            mean[count == 0, i, j] = np.nan
+    if months is None:
+        return mean[0]
+    return mean[:-1]
+
+
+def weather_window_criteria(df,vars,threshold):
+    """
+    This function evaluates any number of weather window criteria (up to 64)
+    in one vectorized pass, packed as the bits of an unsigned integer per 
+    time step. The packed mask can be computed once and reused for several
+    operation durations and months.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Contains timeseries for different variables
+    vars: list of strings
+        Variables' names, one per criterion (a variable can be repeated)
+    threshold: list
+        One limit per variable: a float for an upper limit (value < threshold), 
+        or a (lower, upper) pair for lower <= value < upper, where None 
+        means no limit on that side
+
+    Returns
+    -------
+    Returns a np.uint64 array, bit i is set where criterion i is fulfilled
+    """
+    if (len(vars)!=len(threshold)):
+        raise ValueError('vars must be the same length as threshold')
+    if len(vars)>64:
+        raise ValueError('at most 64 criteria can be given')
+    criteria=np.zeros(len(df),dtype=np.uint64)
+    for i,(var,thr) in enumerate(zip(vars,threshold)):
+        values=df[var].to_numpy(dtype=float)
+        if np.ndim(thr)==0:
+            lower,upper=None,thr
+        else:
+            lower,upper=thr
+        ok=np.ones(len(values),dtype=bool)
+        if lower is not None:
+            ok&=values>=lower
+        if upper is not None:
+            ok&=values<upper
+        criteria|=ok.astype(np.uint64)<<np.uint64(i)
+    return criteria
+
+
+def _weather_window_mask(df,vars,threshold,criteria=None):
     """
-    This function calculates weather windows statistics for up to 3 simultaneous conditions
+    Mask of the time steps where all criteria are fulfilled.
+    """
+    if criteria is None:
+        criteria=weather_window_criteria(df,vars,threshold)
+    all_bits=np.uint64(2**len(vars)-1)
+    return criteria==all_bits
+
+
+def weather_window_length_MultipleVariables(df,vars,threshold,op_duration,timestep,month=None,criteria=None):
+    """
+    This function calculates weather windows statistics for simultaneous conditions
 
     Parameters
     ----------
     df: pd.DataFrame
         Contains timeseries for different variables
     vars: list of strings
-        Variables' names to consider (up to 3)
-    threshold: list of floats
+        Variables' names to consider
+    threshold: list
         Thresholds below which operation is possible
-        for each variable (same unit as timeseries)
+        for each variable (same unit as timeseries), or (lower, upper) 
+        pairs, see weather_window_criteria
     op_duration: float
         Duration of operation in hours
     timestep: float
         Time resolution of time_series in hours
     month: integer
         From 1 for January to 12 for Decemer. Default is all year
+    criteria: np.ndarray
+        Output of weather_window_criteria for vars and threshold, 
+        to reuse it between calls. Default is None (computed here)
 
     Returns
     -------
@@ -361,63 +519,68 @@ def weather_window_length_MultipleVariables(df,vars,threshold,op_duration,timest
     Generalization of weather_window_length to multiple conditions by clio-met
     """
     month_ts = df.index.month
-    if (len(vars)!=len(threshold)):
-        print('Error: vars must be the same length as threshold')
-        print(sys.exit())
-    if len(vars)==1:
-        ts_mask=np.where(df[vars[0]]<threshold[0],1,0)
-    elif len(vars)==2:
-        ts_mask=np.where(((df[vars[0]]<threshold[0]) & (df[vars[1]]<threshold[1])),1,0)
-    elif len(vars)==3:
-        ts_mask=np.where(((df[vars[0]]<threshold[0]) & (df[vars[1]]<threshold[1]) & (df[vars[2]]<threshold[2])),1,0)
-    else:
-        print('Error: only 3 variables can be given')
-        sys.exit()
+    ts_mask=_weather_window_mask(df,vars,threshold,criteria)
     od=int(op_duration/timestep)
-    ts=np.zeros((len(ts_mask)-od+1))
-    for i in range(len(ts_mask)-od+1):
-        ts[i]=np.sum(ts_mask[i:i+od])
-    s0=np.where(ts==od)[0].tolist()
-    mon_s0=month_ts[0:s0[-1]+1]
-    wt=[]
-    for s in range(len(s0)):
-        if s0[s]==0:
-            wt.append(0)
-        elif s==0:
-            diff=s0[s]
-            a=0
-            wt.append(diff)
-            while (diff!=0):
-                diff=s0[s]-a-1
-                wt.append(diff*timestep)
-                a=a+1
-        else:
-            diff=s
-            a=0
-            while (diff!=0):
-                diff=s0[s]-s0[s-1]-a-1
-                wt.append(diff*timestep)
-                a=a+1
-    wt1=(np.array(wt)+op_duration)/24
+    # Waiting time (in steps) from each time step to the next operation window
+    wt=_waiting_steps(ts_mask,od)
+    mon_s0=month_ts[0:len(wt)]
+    wt1=(wt*timestep+op_duration)/24
     # Note that in this subroutine, we stop the calculation of the waiting time
     # at the first timestep of the last operating period found in the timeseries
-    if month is None:
-        mean = np.mean(wt1)
-        p10 = np.percentile(wt1,10)
-        p50 = np.percentile(wt1,50)
-        p90 = np.percentile(wt1,90)
-        p95 = np.percentile(wt1,95)
-        max = np.max(wt1)
-    else:
-        mean = np.mean(wt1[mon_s0==month])
-        p10 = np.percentile(wt1[mon_s0==month],10)
-        p50 = np.percentile(wt1[mon_s0==month],50)
-        p90 = np.percentile(wt1[mon_s0==month],90)
-        p95 = np.percentile(wt1[mon_s0==month],95)
-        max = np.max(wt1[mon_s0==month])
+    if month is not None:
+        wt1 = wt1[mon_s0==month]
+    if len(wt1)==0:
+        # No operation window found
+        return (np.nan,)*6
+    mean = np.mean(wt1)
+    p10, p50, p90, p95 = np.percentile(wt1,[10,50,90,95])
+    max = np.max(wt1)
     return mean, p10, p50, p90, p95, max
 
 
+def weather_window_length_monthly(df,vars,threshold,op_duration,timestep,criteria=None):
+    """
+    This function calculates the weather windows statistics of 
+    weather_window_length_MultipleVariables for all months at once. The waiting
+    times are computed once on the whole time series (operations may cross
+    the end of the month) and grouped by the month of the start time step.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Contains timeseries for different variables
+    vars: list of strings
+        Variables' names to consider
+    threshold: list
+        Thresholds below which operation is possible
+        for each variable (same unit as timeseries), or (lower, upper) 
+        pairs, see weather_window_criteria
+    op_duration: float
+        Duration of operation in hours
+    timestep: float
+        Time resolution of time_series in hours
+    criteria: np.ndarray
+        Output of weather_window_criteria for vars and threshold, 
+        to reuse it between calls. Default is None (computed here)
+
+    Returns
+    -------
+    Returns a pd.DataFrame indexed by month (1 to 12) with the columns 
+    Mean, P10, P50, P90, P95 and Max of the weather windows duration in days
+    """
+    ts_mask=_weather_window_mask(df,vars,threshold,criteria)
+    od=int(op_duration/timestep)
+    wt=_waiting_steps(ts_mask,od)
+    wt1=pd.Series((wt*timestep+op_duration)/24)
+    grouped=wt1.groupby(df.index.month[0:len(wt)])
+    q=[0.1,0.5,0.9,0.95]
+    out=grouped.quantile(q).unstack().reindex(columns=q)
+    out.columns=['P10','P50','P90','P95']
+    out.insert(0,'Mean',grouped.mean())
+    out['Max']=grouped.max()
+    return out.reindex(range(1,13))
+
+
 def pressure_surge(df,var='MSLP'):
     surge_max = (min(df.MSLP)-np.mean(df.MSLP))*(-0.01)
     surge_min = (max(df.MSLP)-np.mean(df.MSLP))*(-0.01)
@@ -2,6 +2,7 @@ import numpy as np
 import xarray as xr
 import scipy
 import pandas as pd
+from functools import lru_cache
 
 def jonswap(f,hs,tp,gamma='fit', sigma_low=.07, sigma_high=.09):
     """
@@ -9,26 +10,32 @@ def jonswap(f,hs,tp,gamma='fit', sigma_low=.07, sigma_high=.09):
         To determine spectral density based on the JONSWAP spectrum 
 
     Input:
-        hs  - Significant wave height
-        tp  - Spectral peak period
-        f   - array of Wave frequency
+        hs  - Significant wave height, scalar or array of N sea states
+        tp  - Spectral peak period, scalar or array of N sea states
+        f   - array of Wave frequency (F frequencies)
+        gamma - Peak enhancement factor, 'fit', scalar or array of N sea states
 
     Output:
-        sf  - Spectral density
+        sf  - Spectral density, shape (F) for scalar sea state parameters, 
+              (N, F) for arrays of sea states
     """
     g = 9.82
+    f = np.asarray(f, dtype=float)
+    # Sea state parameters as column vectors broadcast against the frequencies
+    hs = np.asarray(hs, dtype=float)[..., None]
+    tp = np.asarray(tp, dtype=float)[..., None]
     fp = 1/tp
-    if gamma == 'fit':
-       gamma = min(np.exp(3.484*(1-0.1975*(0.036-0.0056*tp/np.sqrt(hs))*(tp**4)/hs**2)),5) # see MET-report_03-2021.pdf, max value should not exceed 5
-    else:
-       pass
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if isinstance(gamma, str) and gamma == 'fit':
+            gamma = np.minimum(np.exp(3.484*(1-0.1975*(0.036-0.0056*tp/np.sqrt(hs))*(tp**4)/hs**2)),5) # see MET-report_03-2021.pdf, max value should not exceed 5
+        else:
+            gamma = np.asarray(gamma, dtype=float)[..., None]
     
-    #print('gamma-JONSWAP is',gamma)
-    alpha  = 5.061*(hs**2/tp**4)*(1-0.287*np.log(gamma)) # see MET-report_03-2021.pdf
-    E_pm = alpha*(g**2)*((2*np.pi)**-4)*f**-5*np.exp((-5/4)*((fp/f)**4))
-    sigma = np.ones(f.shape)*sigma_low
-    sigma[f > 1./tp] = sigma_high
-    E_js = E_pm*gamma**np.exp(-0.5*(((f/fp)-1)/sigma)**2)   # see MET-report_03-2021.pdf
+        #print('gamma-JONSWAP is',gamma)
+        alpha  = 5.061*(hs**2/tp**4)*(1-0.287*np.log(gamma)) # see MET-report_03-2021.pdf
+        E_pm = alpha*(g**2)*((2*np.pi)**-4)*f**-5*np.exp((-5/4)*((fp/f)**4))
+        sigma = np.where(f > fp, sigma_high, sigma_low)
+        E_js = E_pm*gamma**np.exp(-0.5*(((f/fp)-1)/sigma)**2)   # see MET-report_03-2021.pdf
     sf = np.nan_to_num(E_js)
     return sf
 
@@ -37,7 +44,7 @@ def velocity_spectrum(f, S_w, depth, ref_depth):
     h = depth 
     z = ref_depth
     #k = (1/g)*(2*np.pi/f)**2
-    k, ik = waveno(t=1/f,h =depth) 
+    k = wavenumber(f, depth, cache=True)
     k = np.nan_to_num(k)
     G = 2*np.pi *f* np.cosh(k*(depth-ref_depth))/np.sinh(k*ref_depth)
     G = 2*np.pi*f*np.exp(-k*z)*(1+np.exp(-2*(k*h-k*z)))/(1.-np.exp(-2*k*h))
@@ -53,12 +60,13 @@ def torsethaugen(f, hs, tp):
         To determine spectral density based on the Torsethaugen double peaked spectrum 
 
     Input:
-        hs  - Significant wave height
-        tp  - Spectral peak period
-        f   - array of Wave frequency
+        hs  - Significant wave height, scalar or array of N sea states
+        tp  - Spectral peak period, scalar or array of N sea states
+        f   - array of Wave frequency (F frequencies)
 
     Output:
-        sf  - Spectral density
+        sf  - Spectral density, shape (F) for scalar sea state parameters, 
+              (N, F) for arrays of sea states
     """
     # Constants
     pi = np.pi
@@ -68,33 +76,39 @@ def torsethaugen(f, hs, tp):
     b1, a20, a2, a3 = 2.0, 0.6, 0.3, 6.0
     g0 = 3.26
 
+    f = np.asarray(f, dtype=float)
+    hs = np.asarray(hs, dtype=float)[..., None]
+    tp = np.asarray(tp, dtype=float)[..., None]
+
     tpf = af * hs ** (1.0 / 3.0)
     tl = ae * hs ** (1.0 / 2.0)
     el = (tpf - tp) / (tpf - tl)
 
-    if tp <= tpf:
-        rw = (1.0 - a10) * np.exp(-(el / a1) ** 2) + a10
-        hw1 = rw * hs
-        tpw1 = tp
-        sp = (2.0 * pi / g) * hw1 / tpw1 ** 2
-        gam1 = max(1.0, rkg * sp ** (6.0 / 7.0))
-
-        hw2 = np.sqrt(1.0 - rw ** 2) * hs
-        tpw2 = tpf + b1
-        h1, tp1 = hw1, tpw1
-        h2, tp2 = hw2, tpw2
-    else:
-        tu = au
-        eu = (tp - tpf) / (tu - tpf)
-        rs = (1.0 - a20) * np.exp(-(eu / a2) ** 2) + a20
-        hs1 = rs * hs
-        tps1 = tp
-        sf = (2.0 * pi / g) * hs / tpf ** 2
-        gam1 = max(1.0, rkg * sf ** (6.0 / 7.0) * (1.0 + a3 * eu))
-        hs2 = np.sqrt(1.0 - rs ** 2) * hs
-        tps2 = af * hs2 ** (1.0 / 3.0)
-        h1, tp1 = hs1, tps1
-        h2, tp2 = hs2, tps2
+    # Wind sea dominated (tp <= tpf) and swell dominated branches, 
+    # evaluated for all sea states and selected with np.where
+    wind = tp <= tpf
+
+    rw = (1.0 - a10) * np.exp(-(el / a1) ** 2) + a10
+    hw1 = rw * hs
+    tpw1 = tp
+    sp = (2.0 * pi / g) * hw1 / tpw1 ** 2
+    gamw = np.maximum(1.0, rkg * sp ** (6.0 / 7.0))
+    hw2 = np.sqrt(1.0 - rw ** 2) * hs
+    tpw2 = tpf + b1
+
+    tu = au
+    eu = (tp - tpf) / (tu - tpf)
+    rs = (1.0 - a20) * np.exp(-(eu / a2) ** 2) + a20
+    hs1 = rs * hs
+    tps1 = tp
+    sf = (2.0 * pi / g) * hs / tpf ** 2
+    gams = np.maximum(1.0, rkg * sf ** (6.0 / 7.0) * (1.0 + a3 * eu))
+    hs2 = np.sqrt(1.0 - rs ** 2) * hs
+    tps2 = af * hs2 ** (1.0 / 3.0)
+
+    h1, tp1 = np.where(wind, hw1, hs1), np.where(wind, tpw1, tps1)
+    h2, tp2 = np.where(wind, hw2, hs2), np.where(wind, tpw2, tps2)
+    gam1 = np.where(wind, gamw, gams)
 
     e1 = (1.0 / 16.0) * (h1 ** 2) * tp1
     e2 = (1.0 / 16.0) * (h2 ** 2) * tp2
@@ -104,14 +118,15 @@ def torsethaugen(f, hs, tp):
     
     sigma1 = np.where(f1n > 1.0, 0.09, 0.07)
     
-    fnc1 = f1n ** (-4) * np.exp(-f1n ** (-4))
-    fnc2 = gam1 ** (np.exp(-1.0 / (2.0 * sigma1 ** 2) * (f1n - 1.0) ** 2))
-    s1 = g0 * ag * fnc1 * fnc2
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        fnc1 = f1n ** (-4) * np.exp(-f1n ** (-4))
+        fnc2 = gam1 ** (np.exp(-1.0 / (2.0 * sigma1 ** 2) * (f1n - 1.0) ** 2))
+        s1 = g0 * ag * fnc1 * fnc2
 
-    fnc3 = f2n ** (-4) * np.exp(-f2n ** (-4))
-    s2 = g0 * fnc3
+        fnc3 = f2n ** (-4) * np.exp(-f2n ** (-4))
+        s2 = g0 * fnc3
 
-    sf = e1 * s1 + e2 * s2
+        sf = e1 * s1 + e2 * s2
     return np.nan_to_num(sf)
 
 
@@ -125,38 +140,73 @@ def waveno(t, h):
         h  - Water depth (can be an array or a single value)
 
     Output:
-        k - Wave number 
+        k - Wave number, with the shape of h followed by the shape of t
         nier - Negative depth values: nier = 1
     """
-    # Set value of constants
-    g = 9.82
-    A = [0.66667, 0.35550, 0.16084, 0.06320, 0.02174, 0.00654, 0.00171, 0.00039, 0.00011]
-
-    # Initialize output
-    nier = 0
-    sigma = 2.0 * np.pi / t
-
-    # Function to compute wave number for a single depth
-    def compute_k(depth):
-        nonlocal nier
-        b = g * depth
-        if b < 0:
-            nier = 1
-            return 0.0
-        y = sigma * sigma * depth / g
-        x = A[4] + y * (A[5] + y * (A[6] + y * (A[7] + y * A[8])))
-        x = 1.0 + y * (A[0] + y * (A[1] + y * (A[2] + y * (A[3] + y * x))))
-        c = np.sqrt(b / (y + 1.0 / x))
-        return sigma / c
-
-    # Check if h is a single value or a list
-    if isinstance(h, (int, float)):
-        k = compute_k(h)
-    else:
-        k = [compute_k(depth) for depth in h]
-
+    h = np.asarray(h, dtype=float)
+    t = np.asarray(t, dtype=float)
+    nier = int(np.any(h < 0))
+    k = wavenumber(t, h.reshape(h.shape + (1,)*t.ndim), period=True)
+    if k.ndim == 0:
+        k = float(k)
     return k, nier
 
+def wavenumber(f_or_T, depth, period=False, g=9.82, newton_steps=2, cache=False):
+    """
+    Purpose:
+        To compute the wave number k from the linear dispersion relation
+        (2*pi*f)**2 = g*k*tanh(k*depth), for arrays of any broadcastable shapes
+
+    Input:
+        f_or_T       - Wave frequency [Hz], or wave period [s] if period=True
+        depth        - Water depth [m]
+        period       - True if f_or_T are periods
+        g            - Gravity
+        newton_steps - Number of Newton iterations applied to the Pade
+                       approximation of Hunt (1979), 2 give machine precision
+        cache        - Keep the result in a LRU cache keyed on (f_or_T, depth),
+                       useful when the same frequency grid and depth are used
+                       for many spectra. Cached arrays are read-only.
+
+    Output:
+        k - Wave number, 0 for zero frequency or negative depth
+    """
+    if cache:
+        x = np.ascontiguousarray(f_or_T, dtype=float)
+        d = np.ascontiguousarray(depth, dtype=float)
+        return _wavenumber_cached(x.tobytes(), x.shape, d.tobytes(), d.shape,
+                                  period, g, newton_steps)
+    return _wavenumber(f_or_T, depth, period, g, newton_steps)
+
+def _wavenumber(f_or_T, depth, period, g, newton_steps):
+    x = np.asarray(f_or_T, dtype=float)
+    h = np.asarray(depth, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = 2.0 * np.pi / x if period else 2.0 * np.pi * x
+        sigma, h = np.broadcast_arrays(sigma, h)
+        # Explicit Pade approximation (Hunt, 1979)
+        A = [0.66667, 0.35550, 0.16084, 0.06320, 0.02174, 0.00654, 0.00171, 0.00039, 0.00011]
+        y = sigma * sigma * h / g
+        p = A[4] + y * (A[5] + y * (A[6] + y * (A[7] + y * A[8])))
+        p = 1.0 + y * (A[0] + y * (A[1] + y * (A[2] + y * (A[3] + y * p))))
+        k = sigma / np.sqrt(g * h / (y + 1.0 / p))
+        # Newton iterations on g*k*tanh(k*h) - sigma**2
+        valid = (sigma > 0) & (h > 0) & np.isfinite(k)
+        for _ in range(newton_steps):
+            th = np.tanh(k * h)
+            dk = (g * k * th - sigma ** 2) / (g * th + g * k * h * (1.0 - th ** 2))
+            k = np.where(valid, k - dk, k)
+    k = np.where(h < 0, 0.0, k)
+    return k[()] if k.ndim == 0 else k
+
+@lru_cache(maxsize=64)
+def _wavenumber_cached(x, x_shape, d, d_shape, period, g, newton_steps):
+    x = np.frombuffer(x, dtype=float).reshape(x_shape)
+    d = np.frombuffer(d, dtype=float).reshape(d_shape)
+    k = np.array(_wavenumber(x, d, period, g, newton_steps))
+    k.flags.writeable = False
+    return k
+
 def _interpolate_linear(fp,n):
     '''
     Linear interpolation.
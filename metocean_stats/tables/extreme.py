@@ -140,9 +140,9 @@ def table_directional_joint_distribution_Hs_Tp_param(
 
     return df  
 
-def table_monthly_return_periods(data, var='hs', periods=[1, 10, 100, 10000],distribution='Weibull3P_MOM',method='default',threshold='default', units='m',output_file='monthly_extremes_weibull.csv'):
+def table_monthly_return_periods(data, var='hs', periods=[1, 10, 100, 10000],distribution='Weibull3P_MOM',method='default',threshold='default', units='m',output_file='monthly_extremes_weibull.csv', n_jobs=1):
     months = ['-','Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sept', 'Oct', 'Nov', 'Dec', 'Year']
-    params, return_periods, threshold_values, num_events_per_year = stats.monthly_extremes(data=data, var=var, periods=periods, distribution=distribution, method=method, threshold=threshold)   
+    params, return_periods, threshold_values, num_events_per_year = stats.monthly_extremes(data=data, var=var, periods=periods, distribution=distribution, method=method, threshold=threshold, n_jobs=n_jobs)   
 
     # Initialize lists to store table data
     annual_prob = ['%'] + [np.round(100/12,2)] * 12 + [100.00]
@@ -173,8 +173,8 @@ def table_monthly_return_periods(data, var='hs', periods=[1, 10, 100, 10000],dis
     
     return df
 
-def table_directional_return_periods(data: pd.DataFrame, var='hs', var_dir='dir', periods=[1, 10, 100, 10000], distribution='Weibull3P_MOM', units='m',adjustment='NORSOK',method='default', threshold='default',output_file='directional_extremes_weibull.csv'):
-    params, return_periods, sector_prob,  threshold_values, num_events_per_year = stats.directional_extremes(data=data, var=var, var_dir=var_dir, periods=periods,distribution=distribution, adjustment=adjustment, method=method, threshold=threshold)    
+def table_directional_return_periods(data: pd.DataFrame, var='hs', var_dir='dir', periods=[1, 10, 100, 10000], distribution='Weibull3P_MOM', units='m',adjustment='NORSOK',method='default', threshold='default',output_file='directional_extremes_weibull.csv', n_jobs=1):
+    params, return_periods, sector_prob,  threshold_values, num_events_per_year = stats.directional_extremes(data=data, var=var, var_dir=var_dir, periods=periods,distribution=distribution, adjustment=adjustment, method=method, threshold=threshold, n_jobs=n_jobs)    
     dir = ['-'] + [str(angle) + '°' for angle in np.arange(0,360,30)] + ['Omni']
     # Initialize lists to store table data
     sector_prob = ['%'] + [round(value, 2) for value in sector_prob] + [100.00]
@@ -565,35 +565,47 @@ def table_wave_induced_current(ds, var_hs,var_tp,max_hs= 20, depth=200,ref_depth
     return df
 
 
-def table_profile_return_values(data,var=['W10','W50','W80','W100','W150'], z=[10, 50, 80, 100, 150], periods=[1, 10, 100, 10000],units='m/s',distribution='Weibull3P',method='default',threshold='default', output_file='RVE_wind_profile.csv'):
+def table_profile_return_values(data,var=['W10','W50','W80','W100','W150'], z=[10, 50, 80, 100, 150], periods=[1, 10, 100, 10000],units='m/s',distribution='Weibull3P',method='default',threshold='default', output_file='RVE_wind_profile.csv', n_jobs=1):
     df = pd.DataFrame()
     df['z']= ['m'] + [str(num) for num in z] 
-    for p in periods:
-        df[f'Return period {p} [years]'] = [units] + [stats.RVE_ALL(data,var=var1,periods=p,distribution=distribution,method=method,threshold=threshold)[3].round(2).item() for var1 in var]
+    # One fit per level for all periods
+    rv = stats.RVE_many(data,vars=var,periods=periods,distribution=distribution,method=method,threshold=threshold,n_jobs=n_jobs)
+    rv = rv['return_value'].to_numpy().reshape(len(var),len(periods)).round(2)
+    for j, p in enumerate(periods):
+        df[f'Return period {p} [years]'] = [units] + rv[:,j].tolist()
     
     if output_file:
         df.to_csv(output_file, index=False)  
     
     return df
 
-def table_Hmax_crest_return_periods(ds,var_hs='HS', var_tp = 'TP',depth=200, periods=[1, 10, 100,10000], sea_state = 'short-crested', output_file='table_Hmax_crest_return_values.csv'):
+def table_Hmax_crest_return_periods(ds,var_hs='HS', var_tp = 'TP',depth=200, periods=[1, 10, 100,10000], sea_state = 'short-crested', method='short-term', output_file='table_Hmax_crest_return_values.csv'):
+    """
+    Crest height and Hmax return values. method='short-term' applies the short-term 
+    maxima to the return period Hs with the mean Tp, method='long-term' reads them 
+    from the long-term distribution over all sea states (stats.long_term_crest_Hmax).
+    """
     df = table_tp_for_rv_hs(ds, var_hs, var_tp,periods=periods,output_file=None)
     time_step = ((ds.index[-1]-ds.index[0]).days + 1)*24/ds.shape[0]
     df['T_Hmax(P5-model) [s]'] =  0.9 * df['Tp(P5-model) [s]'] # according to Goda (1988)
     df['T_Hmax(Mean-model) [s]'] =  0.9 * df['Tp(Mean-model) [s]'] # according to Goda (1988)
     df['T_Hmax(P95-model) [s]'] =  0.9 * df['Tp(P95-model) [s]'] # according to Goda (1988)
-    df['Crest height[m]'] = np.nan
-    df['H_max[m]'] = np.nan
-    df['H_max/Hs'] = np.nan
-    for i in range(df.shape[0]):
-        df.loc[i,'Crest height[m]'] = stats.estimate_forristal_maxCrest(df.loc[i,'Hs[m]'],df.loc[i,'T_Hmax(Mean-model) [s]'],depth=depth, twindow=time_step, sea_state=sea_state)
-        #df.loc[i,'Crest height[m]'] = estimate_forristal_maxCrest(df.loc[i,'Hs[m]'],df.loc[i,'Tp(Mean-model) [s]'],depth=depth, twindow=time_step, sea_state=sea_state)
-        df.loc[i,'H_max[m]'] = stats.estimate_Hmax(df.loc[i,'Hs[m]'], df.loc[i,'T_Hmax(Mean-model) [s]'], twindow=3, k=1.0)
-        #df.loc[i,'H_max[m]'] = estimate_Hmax(df.loc[i,'Hs[m]'], df.loc[i,'Tp(Mean-model) [s]'], twindow=3, k=1.0)
-        df.loc[i,'H_max/Hs'] = df.loc[i,'H_max[m]']/ df.loc[i,'Hs[m]']
+    df['Crest height[m]'] = stats.estimate_forristal_maxCrest(df['Hs[m]'].to_numpy(),df['T_Hmax(Mean-model) [s]'].to_numpy(),depth=depth, twindow=time_step, sea_state=sea_state)
+    #df['Crest height[m]'] = stats.estimate_forristal_maxCrest(df['Hs[m]'].to_numpy(),df['Tp(Mean-model) [s]'].to_numpy(),depth=depth, twindow=time_step, sea_state=sea_state)
+    df['H_max[m]'] = stats.estimate_Hmax(df['Hs[m]'].to_numpy(), df['T_Hmax(Mean-model) [s]'].to_numpy(), twindow=3, k=1.0)
+    #df['H_max[m]'] = stats.estimate_Hmax(df['Hs[m]'].to_numpy(), df['Tp(Mean-model) [s]'].to_numpy(), twindow=3, k=1.0)
+    df['H_max/Hs'] = df['H_max[m]']/ df['Hs[m]']
+    columns = ['Return period [years]','Hs[m]', 'H_max/Hs','H_max[m]','Crest height[m]','T_Hmax(P5-model) [s]','T_Hmax(Mean-model) [s]','T_Hmax(P95-model) [s]']
+    if method == 'long-term':
+        df['Crest height[m]'], df['H_max[m]'] = stats.long_term_crest_Hmax(ds, var_hs=var_hs, var_tp=var_tp, depth=depth, periods=periods, sea_state=sea_state)
+        # The long-term Hmax and crest do not belong to the return period Hs of the same row,
+        # the columns derived from that Hs are left empty and not written
+        df[['H_max/Hs','T_Hmax(P5-model) [s]','T_Hmax(Mean-model) [s]','T_Hmax(P95-model) [s]']] = np.nan
+        columns = ['Return period [years]','Hs[m]','H_max[m]','Crest height[m]']
+    df.attrs['method'] = method
 
     if output_file:
-        df[['Return period [years]','Hs[m]', 'H_max/Hs','H_max[m]','Crest height[m]','T_Hmax(P5-model) [s]','T_Hmax(Mean-model) [s]','T_Hmax(P95-model) [s]']].round(2).to_csv(output_file,index=False)
+        df[columns].round(2).to_csv(output_file,index=False)
     
     return df
 
@@ -623,10 +635,8 @@ def table_directional_Hmax_return_periods(ds, var_hs='HS', var_tp='TP', var_dir=
      
     tHmax_columns = [col for col in df.columns if col.startswith('T_Hmax')]
     
-    # Estimate Hmax
-    for i in range(len(hmax_columns)):
-        for j in range(df.shape[0]):
-            df.loc[j, hmax_columns[i]] = stats.estimate_Hmax(df.loc[j, hs_columns[i]], df.loc[j, tp_columns[i]], twindow=3, k=1.0)
+    # Estimate Hmax for all directions and return periods at once
+    df[hmax_columns] = stats.estimate_Hmax(df[hs_columns[:len(hmax_columns)]].to_numpy(), df[tp_columns[:len(hmax_columns)]].to_numpy(), twindow=3, k=1.0)
 
     # Replace values in each column that exceed the thresholds
     for i in range(len(hmax_columns)):
@@ -761,9 +771,11 @@ def table_current_for_given_hs(data: pd.DataFrame, var_curr: str,var_hs: str, bi
         result_df[['Hs[m]', 'Uc(P5-model) [m/s]','Uc(Mean-model) [m/s]','Uc(P95-model) [m/s]']].round(2).to_csv(output_file,index=False)
     return result_df
 
-def table_extreme_current_profile_rv(data: pd.DataFrame, var: str, z=[10, 20, 30], periods=[1,10,100], percentile=95, fitting_method='polynomial', fmt=".2f", output_file='table_extreme_current_profile_rv.csv'):
+def table_extreme_current_profile_rv(data: pd.DataFrame, var: str, z=[10, 20, 30], periods=[1,10,100], percentile=95, fitting_method='polynomial', fmt=".2f", output_file='table_extreme_current_profile_rv.csv', n_jobs=1):
+    # The return values of all levels and periods are computed once
+    df_rv = table_profile_return_values(data=data, var=var, z=z, periods=periods, output_file=None, n_jobs=n_jobs)
     for period in periods:
-        df = table_profile_return_values(data=data, var=var, z=z, periods=periods, output_file=None)
+        df = df_rv.copy()
         df[[f'{i}' for i in z]] = None #np.nan
         df.loc[0, [f'{i}' for i in z]] = df[f'Return period {period} [years]'][0] # add units
         
@@ -640,15 +640,14 @@ def table_monthly_weather_window(data: pd.DataFrame, var: str, threshold: float,
     # var should be a list of variables, and threshold should be a list of thresholds
     # more outputs than table_monthly_weather_window
     # Written by clio-met
-    results = []
     months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    for month in range(1, 13):
-        avg_duration, p10, p50, p90, p95, max = stats.weather_window_length_MultipleVariables(data,vars=var,threshold=threshold,op_duration=window_size,timestep=timestep,month=month)
-        results.append((avg_duration, p10, p50, p90, p95, max))
-    results_df = pd.DataFrame(results, columns=['Mean', 'P10', 'P50', 'P90', 'P95', 'Max'], index=months).T.round(1)
+    # All months from one computation of the waiting times
+    results = stats.weather_window_length_monthly(data,vars=var,threshold=threshold,op_duration=window_size,timestep=timestep)
+    results.index = months
+    results_df = results.T.round(1)
     if output_file:
         # Save results to CSV
-        results_df.to_csv('monthly_weather_window_results_mv.csv')
+        results_df.to_csv(output_file)
     return results_df
 
 def table_profile_stats(data: pd.DataFrame, var: str, z=[10, 20, 30], var_dir=None, output_file='table_profile_stats.csv'):
@@ -854,15 +853,8 @@ def table_weather_window_thresholds(ds,var,threshold,op_duration=[6,12,24,48],ou
     # output_file: string with file name
     ds = ds[var]
     timestep = (ds.index.to_series().diff().dropna().dt.total_seconds()/3600).mean()
-    arr_o=np.zeros((len(op_duration),len(threshold)))
-    t1=0
-    for t in threshold:
-        op1=0
-        for op in op_duration:
-            arr_o[op1,t1],p1,p2,p3 = stats.weather_window_length(ds,threshold=t,op_duration=op,timestep=timestep,month=None)
-            op1=op1+1
-            del p1,p2,p3
-        t1=t1+1
+    # Mean waiting times for all thresholds and durations, one scan per threshold
+    arr_o = stats.weather_window_length_matrix(ds,thresholds=threshold,op_durations=op_duration,timestep=timestep)
     # Convert numpy array to dataframe
     cols=[var+'<'+str(th)+'m' for th in threshold]
     df_tmp1 = pd.DataFrame(data=op_duration, columns=['Operation duration [h]'])
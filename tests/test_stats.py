@@ -0,0 +1,454 @@
+import numpy as np
+import pandas as pd
+import scipy.stats as st
+import pyextremes
+
+from metocean_stats import stats
+from metocean_stats.stats.aux_funcs import readNora10File
+
+# Define TimeSeries-object for NORA3
+ds = readNora10File('tests/data/NORA_test.txt')
+
+
+def test_fit_extreme_model(ds=ds):
+    stats.clear_fit_cache()
+    model = stats.fit_extreme_model(ds, var='HS', method='POT', dist='GP', threshold=5)
+    # Same data and options share one fit
+    assert stats.fit_extreme_model(ds, var='HS', method='POT', dist='GP', threshold=5) is model
+    df = stats.return_levels_pot(ds, var='HS', dist='GP', threshold=5, periods=[10, 100])
+    assert np.allclose(model.return_levels([10, 100]), df['return_levels'].values)
+    assert np.allclose(model.cdf(model.isf(0.01)), 0.99)
+
+
+def test_rolling_return_levels(ds=ds):
+    df = stats.rolling_return_levels(ds, var='HS', dist='GUM', periods=[10, 100], window=5, warm_start=False)
+    # The last window gives the same fit as the annual maxima of its years
+    last = ds[ds.index.year > df.index[-1] - 5]
+    ref = stats.return_levels_annual_max(last, var='HS', dist='GUM', periods=[10, 100])
+    assert np.allclose(df.iloc[-1].values, ref['return_levels'].values)
+
+
+def test_stream_extremes(ds=ds):
+    chunks = lambda: (ds.iloc[i:i+5000] for i in range(0, ds.shape[0], 5000))
+    am = stats.stream_extremes(chunks(), var='HS', method='AM')
+    ref = ds['HS'].loc[ds.groupby(ds.index.year)['HS'].idxmax().values]
+    assert np.array_equal(am.values, ref.values)
+    pot = stats.stream_extremes(chunks, var='HS', method='POT')
+    ref = stats.get_pot_extremes(ds['HS'], stats.get_threshold_os(ds, 'HS'))
+    assert pot.equals(ref)
+
+
+def test_RVE_many(ds=ds):
+    df = stats.RVE_many(ds, vars=['HS', 'W10'], periods=[10, 100], distribution='GUM', method='AM')
+    assert df.shape == (4, 6)
+    _, _, _, value = stats.RVE_ALL(ds, var='W10', periods=[10, 100], distribution='GUM', method='AM')
+    assert np.allclose(df.loc[df['var'] == 'W10', 'return_value'].values, value)
+
+
+def test_profile_likelihood_return_levels(ds=ds):
+    df = stats.return_levels_pot_uncertainty(ds, var='HS', dist='GP', threshold=5, 
+                                             periods=[10, 100], uncertainty=0.95, 
+                                             ci_method='profile')
+    assert (df['ci_lower_rl'] < df['return_levels']).all()
+    assert (df['ci_upper_rl'] > df['return_levels']).all()
+    # Reference: return levels z where the profile nll, minimized over the shape 
+    # with the scale given by z, crosses the chi2 level (agreement within 0.01 %)
+    from scipy.optimize import brentq, minimize_scalar
+    model = stats.fit_extreme_model(ds, 'HS', method='POT', dist='GP', threshold=5, r='48h')
+    x = model.extremes.values - 5
+    nll = lambda c, scale: -st.genpareto.logpdf(x, c, model.loc, scale).sum() if scale > 0 else np.inf
+    c0, _, scale0 = st.genpareto.fit(x, floc=model.loc)
+    nll0 = nll(c0, scale0)
+    for period, rl, lower, upper in df[['return_levels', 'ci_lower_rl', 'ci_upper_rl']].itertuples():
+        p = 1/(model.rate*period)
+        profile = lambda z: minimize_scalar(lambda c: nll(c, (z-5-model.loc)/st.genpareto.isf(p, c)), bounds=(c0-1, c0+1), 
+                                            method='bounded', options={'xatol': 1e-10}).fun - nll0 - st.chi2.ppf(0.95, 1)/2
+        assert np.isclose(lower, brentq(profile, 5 + 1e-3*(rl-5), rl), rtol=1e-4)
+        assert np.isclose(upper, brentq(profile, rl, 5 + 10*(rl-5)), rtol=1e-4)
+    # Default periods of plot_multi_diagnostic_return_levels_uncertainty, 
+    # the return levels are evaluated in blocks
+    import tracemalloc
+    periods = np.arange(0.1, 10000.1, 0.1)
+    tracemalloc.start()
+    lower, upper = stats.profile_likelihood_return_levels(x, 'GP', 1/(model.rate*periods), (model.shape, model.loc, model.scale), threshold=5)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 50*2**20
+    assert np.allclose([lower[999], upper[999]], df.loc[100, ['ci_lower_rl', 'ci_upper_rl']].values.astype(float))
+
+
+def test_weather_window_length():
+    ts = pd.Series([3, 1, 1, 3, 1, 1, 1, 3], index=pd.date_range('2000-01-01', periods=8, freq='h'))
+    # Windows of 2 h start at steps 1, 4 and 5: waiting times 1, 0, 2, 1, 0, 0 h
+    mean, p10, p50, p90 = stats.weather_window_length(ts, threshold=2, op_duration=2, timestep=1)
+    assert np.isclose(mean, (4/6 + 2)/24)
+    assert np.isnan(stats.weather_window_length(ts, threshold=2, op_duration=4, timestep=1)[0])
+
+
+def test_weather_window_length_matrix(ds=ds):
+    mean = stats.weather_window_length_matrix(ds['HS'], thresholds=[3, 2], op_durations=[6, 24], timestep=3)
+    assert mean.shape == (2, 2)
+    assert np.isclose(mean[1, 0], stats.weather_window_length(ds['HS'], threshold=3, op_duration=24, timestep=3)[0])
+    monthly = stats.weather_window_length_matrix(ds['HS'], thresholds=[3, 2], op_durations=[6, 24], timestep=3, months=range(1, 13))
+    assert monthly.shape == (12, 2, 2)
+    for month in [1, 7]:
+        assert np.isclose(monthly[month-1, 1, 1], 
+                          stats.weather_window_length(ds['HS'], threshold=2, op_duration=24, timestep=3, month=month)[0])
+
+
+def test_weather_window_length_monthly(ds=ds):
+    df = stats.weather_window_length_monthly(ds, vars=['HS', 'TP'], threshold=[2, 8], op_duration=24, timestep=3)
+    assert df.shape == (12, 6)
+    ref = stats.weather_window_length_MultipleVariables(ds, vars=['HS', 'TP'], threshold=[2, 8], op_duration=24, timestep=3, month=3)
+    assert np.allclose(df.loc[3].values, ref, equal_nan=True)
+
+
+def test_weather_window_criteria(ds=ds):
+    criteria = stats.weather_window_criteria(ds, vars=['HS', 'TP', 'W10', 'HS'], threshold=[2.5, (6, 14), 15, (0.5, None)])
+    ok = (ds['HS'] < 2.5) & (ds['TP'] >= 6) & (ds['TP'] < 14) & (ds['W10'] < 15) & (ds['HS'] >= 0.5)
+    assert np.array_equal(criteria == 15, ok.values)
+    # Bit 0 is the first criterion
+    assert np.array_equal((criteria & 1).astype(bool), (ds['HS'] < 2.5).values)
+
+
+def test_Weibull_method_of_moment():
+    samples = [st.weibull_min.rvs(c, loc=0.5, scale=2, size=2000, random_state=1) for c in (1.2, 1.8, 2.5)]
+    # Shorter columns are padded with NaNs
+    X = np.full((2000, 3), np.nan)
+    for i, x in enumerate(samples):
+        X[:2000-300*i, i] = x[:2000-300*i]
+    shape, loc, scale = stats.aux_funcs.Weibull_method_of_moment(X)
+    for i, x in enumerate(samples):
+        assert np.allclose((shape[i], loc[i], scale[i]), 
+                           stats.aux_funcs.Weibull_method_of_moment(x[:2000-300*i]), rtol=1e-10)
+    # Values of the former fminbound solver
+    fminbound = [(1.332132706, 0.355284116, 2.252728588),
+                 (1.964104897, 0.376305180, 2.179802764),
+                 (2.721837037, 0.368762367, 2.167116983)]
+    for x, ref in zip(samples, fminbound):
+        assert np.allclose(stats.aux_funcs.Weibull_method_of_moment(x), ref, rtol=1e-4)
+
+
+def test_get_pot_extremes_pyextremes(ds=ds):
+    values = np.zeros(40)
+    # Tie inside the first cluster, next exceedances exactly 6 h apart
+    values[[2, 3, 4, 10, 16, 23, 24]] = [5, 4.5, 5, 4.2, 6, 7, 7]
+    ts = pd.Series(values, index=pd.date_range('2000-01-01', periods=40, freq='h'), name='HS')
+    for threshold in [1, 4.4, 5]:
+        for r in ['1h', '5h', '6h', '7h']:
+            assert stats.get_pot_extremes(ts, threshold, r).equals(
+                pyextremes.get_extremes(ts, 'POT', threshold=threshold, r=r))
+    for threshold in [3, 4.5]:
+        for r in ['24h', '48h']:
+            assert stats.get_pot_extremes(ds['HS'], threshold, r).equals(
+                pyextremes.get_extremes(ds['HS'], 'POT', threshold=threshold, r=r))
+
+
+def test_get_empirical_return_levels_pyextremes(ds=ds):
+    extremes = pyextremes.get_extremes(ds['HS'], 'POT', threshold=4, r='24h')
+    for plotting_position in ['weibull', 'gringorten', 'hazen']:
+        df = stats.get_empirical_return_levels(ds, var='HS', method='POT', threshold=4, 
+                                               plotting_position=plotting_position)
+        rp = pyextremes.get_return_periods(ts=ds['HS'], extremes=extremes, extremes_method='POT',
+                                           extremes_type='high', plotting_position=plotting_position)
+        assert np.allclose(df['return_periods'].values, rp['return period'].values, rtol=1e-12)
+        df = stats.get_empirical_return_levels(ds, var='HS', method='BM', plotting_position=plotting_position)
+        maxima = pyextremes.get_extremes(ds['HS'], 'BM', block_size='365.2425D')
+        rp = pyextremes.get_return_periods(ts=ds['HS'], extremes=maxima, extremes_method='BM',
+                                           extremes_type='high', return_period_size='365.2425D',
+                                           plotting_position=plotting_position)
+        assert np.allclose(df['return_periods'].values, rp['return period'].values, rtol=1e-12)
+
+
+def test_get_empirical_return_levels_new_duplicate_block_maxima():
+    ts = pd.Series(1.0, index=pd.date_range('2000-07-01', '2003-06-30 23:00', freq='h'), name='HS')
+    # The maxima of the first two blocks (starting in July) are both in 2001
+    ts['2001-03-01 00:00'] = 5
+    ts['2001-09-01 00:00'] = 6
+    ts['2003-02-01 00:00'] = 4
+    df = stats.get_empirical_return_levels_new(ts.to_frame(), var='HS', method='BM')
+    assert list(df['return_levels']) == [6, 4]
+    maxima = pyextremes.get_extremes(ts, 'BM', block_size='365.2425D')
+    maxima = maxima[maxima.index.year != 2001].combine_first(maxima[maxima == 6])
+    rp = pyextremes.get_return_periods(ts=ts, extremes=maxima, extremes_method='BM',
+                                       extremes_type='high', return_period_size='365.2425D')
+    assert np.allclose(df['return_periods'].values, rp['return period'].values)
+
+
+def test_estimate_forristal_maxCrest():
+    # The former wavelength solver stopped at its initial guess here (13.07 m)
+    assert np.isclose(stats.estimate_forristal_maxCrest(12, 19, depth=70), 13.6599, rtol=1e-4)
+    Hs, Tp = np.array([2, 5, 12, 15]), np.array([8, 11, 19, 17])
+    for sea_state in ['short-crested', 'long-crested']:
+        crest = stats.estimate_forristal_maxCrest(Hs, Tp, depth=70, sea_state=sea_state)
+        assert np.allclose(crest, [stats.estimate_forristal_maxCrest(h, t, depth=70, sea_state=sea_state) 
+                                   for h, t in zip(Hs, Tp)], rtol=1e-12)
+
+
+def test_wavenumber():
+    g = 9.82
+    T = np.array([2, 5, 10, 20])
+    # Shallow, intermediate and deep water
+    depth = np.array([1, 10, 50, 500, 5000])[:, None]
+    k = stats.spec_funcs.wavenumber(T, depth, period=True, g=g)
+    omega = 2*np.pi/T
+    assert np.allclose(omega**2 - g*k*np.tanh(k*depth), 0, atol=1e-12)
+    k_waveno, nier = stats.spec_funcs.waveno(T, depth[:, 0])
+    assert nier == 0 and np.allclose(k_waveno, k, rtol=1e-12)
+    # Cached results do not depend on later changes of the input arrays, and are read-only
+    f = np.array([0.05, 0.1, 0.2])
+    k1 = stats.spec_funcs.wavenumber(f, 30, cache=True)
+    f[:] = [0.3, 0.4, 0.5]
+    k2 = stats.spec_funcs.wavenumber(np.array([0.05, 0.1, 0.2]), 30, cache=True)
+    assert np.array_equal(k1, k2) and not k2.flags.writeable
+    assert np.allclose(stats.spec_funcs.wavenumber(f, 30, cache=True), stats.spec_funcs.wavenumber(f, 30))
+    assert np.allclose((2*np.pi*np.array([0.05, 0.1, 0.2]))**2, g*k2*np.tanh(k2*30), rtol=1e-12)
+
+
+def test_Cmax():
+    # Values of the former iterative wave number solver
+    Hs, Tm, depth = np.array([3., 8., 12.]), np.array([7., 10., 13.]), np.array([30., 70., 200.])
+    assert np.allclose(stats.Cmax(Hs, Tm, depth), [3.96397, 10.61156, 15.43815], rtol=2e-4)
+
+
+def test_bootstrap_return_levels(ds=ds):
+    extremes = stats.get_pot_extremes(ds['HS'], threshold=4, r='48h') - 4
+    prob = 1/(len(extremes)/12*np.array([10, 100]))
+    rl = stats.bootstrap_return_levels(extremes, 'GP', prob, threshold=4, n_boot=50, seed=1, n_jobs=1)
+    assert rl.shape == (50, 2)
+    # The replicates only depend on the seed, not on the number of processes
+    assert np.array_equal(rl, stats.bootstrap_return_levels(extremes, 'GP', prob, threshold=4, n_boot=50, seed=1, n_jobs=2))
+    assert not np.array_equal(rl, stats.bootstrap_return_levels(extremes, 'GP', prob, threshold=4, n_boot=50, seed=2, n_jobs=1))
+    # Each replicate is the fit of one resample
+    samples = extremes.values[np.random.default_rng(1).integers(0, len(extremes), size=(50, len(extremes)))]
+    shape, loc, scale = st.genpareto.fit(samples[0])
+    assert np.allclose(rl[0], st.genpareto.isf(prob, shape, loc, scale) + 4, rtol=1e-3)
+    # Default periods of plot_multi_diagnostic_return_levels_uncertainty: the return 
+    # levels are evaluated in blocks, the memory used stays close to the output
+    import tracemalloc
+    periods = np.arange(0.1, 10000.1, 0.1)
+    prob = 1/(len(extremes)/12*periods)
+    tracemalloc.start()
+    rl = stats.bootstrap_return_levels(extremes, 'GP', prob, threshold=4, n_boot=50, seed=1, fit_method='lmom')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert rl.shape == (50, len(periods)) and peak < 1.5*rl.nbytes
+    assert np.array_equal(rl[:, [0, 99, 99999]], stats.bootstrap_return_levels(extremes, 'GP', prob[[0, 99, 99999]], threshold=4, n_boot=50, seed=1, fit_method='lmom'))
+
+
+def test_threshold_sensitivity(ds=ds):
+    thresholds = [4, 3, 3.5]
+    df = stats.threshold_sensitivity(ds, var='HS', thresholds=thresholds, dist_list=['GP', 'EXP', 'Weibull_2P', 'GUM'], period=100)
+    # The incremental sweep gives the same return levels as independent fits per threshold
+    for dist in ['GP', 'EXP', 'Weibull_2P']:
+        for i, threshold in enumerate(thresholds):
+            ref = stats.return_levels_pot(ds, var='HS', dist=dist, periods=[100], threshold=threshold, r='48h')
+            assert np.isclose(df.loc[threshold, dist], ref['return_levels'].iloc[0], rtol=1e-6)
+    ref = stats.return_levels_annual_max(ds, var='HS', dist='GUM', periods=[100])
+    assert np.allclose(df['GUM'], ref['return_levels'].iloc[0])
+
+
+def test_monthly_directional_extremes(ds=ds):
+    periods = [1, 10, 100]
+    params, return_values, _, _ = stats.monthly_extremes(ds, var='HS', periods=periods, distribution='Weibull3P_MOM')
+    # Same as one fit per month on the filtered data, capped by the annual values
+    annual = stats.RVE_ALL(ds, var='HS', periods=periods, distribution='Weibull3P_MOM', method='default')[3]
+    for month in [1, 6]:
+        value = stats.RVE_ALL(ds[ds.index.month == month], var='HS', periods=periods, distribution='Weibull3P_MOM', method='default')[3]
+        assert np.allclose(return_values[month-1], np.minimum(value, annual))
+    assert np.allclose(return_values, stats.monthly_extremes(ds, var='HS', periods=periods, distribution='Weibull3P_MOM', n_jobs=2)[1])
+    data = ds.copy()
+    params, return_values, sector_prob, _, _ = stats.directional_extremes(data, var='HS', var_dir='DIRM', periods=periods, distribution='Weibull3P_MOM')
+    sector = data[data['direction_sector'] == 90]
+    value = stats.RVE_ALL(sector, var='HS', periods=[6*p for p in periods], distribution='Weibull3P_MOM', method='default')[3]
+    assert np.allclose(return_values[3], np.minimum(value, annual))
+    assert np.isclose(sector_prob[3], 100*len(sector)/len(data))
+
+
+def test_joint_distribution_Hs_Tp(ds=ds):
+    from scipy.optimize import curve_fit
+    a1, a2, a3, b1, b2, b3, pdf_Hs, h, t3, h3, X, hs_tpl_tph = stats.joint_distribution_Hs_Tp(ds.copy(), var_hs='HS', var_tp='TP', periods=[1, 100])
+    # Parameters from the Tp statistics of each Hs bin computed with a loop over the bins
+    Hs, Tp = ds['HS'].values, stats.aux_funcs.Tp_correction(ds['TP'].values.copy())
+    intx = [0.05, 0.1, 0.2, 0.5, 1.0][np.searchsorted([2, 3, 4, 10], Hs.max(), side='right')]
+    hs_bin = np.arange(0, Hs.max()+2*intx, intx)
+    mean_hs, mean_lnTp, variance_lnTp = [], [], []
+    for i in range(len(hs_bin)-1):
+        inbin = (hs_bin[i] <= Hs) & (Hs < hs_bin[i+1])
+        if inbin.sum() > 15:
+            mean_hs.append(Hs[inbin].mean())
+            mean_lnTp.append(np.log(Tp[inbin]).mean())
+            variance_lnTp.append(np.log(Tp[inbin]).var())
+    (ref_a1, ref_a2), _ = curve_fit(stats.aux_funcs.Gauss3, mean_hs, mean_lnTp)
+    (ref_b2, ref_b3), _ = curve_fit(stats.aux_funcs.Gauss4, mean_hs[1:], variance_lnTp[1:], maxfev=10000)
+    assert np.allclose([a1, a2, b2, b3], [ref_a1, ref_a2, ref_b2, ref_b3], rtol=1e-6)
+    # float32 density grids give the same contours, up to one Hs grid step at the top
+    hs_tpl_tph32 = stats.joint_distribution_Hs_Tp(ds.copy(), var_hs='HS', var_tp='TP', periods=[1, 100], dtype=np.float32)[-1]
+    contour, contour32 = hs_tpl_tph.iloc[:, :3].dropna(), hs_tpl_tph32.iloc[:, :3].dropna()
+    common = contour.merge(contour32, on='hs_1', suffixes=('', '_32'))
+    assert abs(len(contour) - len(contour32)) <= 1 and len(common) >= min(len(contour), len(contour32)) - 1
+    assert np.allclose(common[['t1_1', 't2_1']].values, common[['t1_1_32', 't2_1_32']].values, atol=1e-4)
+    assert abs(contour32['hs_1'].max() - contour['hs_1'].max()) <= h[1] - h[0] + 1e-9
+    assert abs(hs_tpl_tph32['hs_100'].max() - hs_tpl_tph['hs_100'].max()) <= h[1] - h[0] + 1e-9
+
+def test_Hs_Tp_curves(ds=ds):
+    from scipy.signal import find_peaks
+    a1, a2, a3, b1, b2, b3, pdf_Hs, h = stats.joint_distribution_Hs_Tp(ds.copy(), var_hs='HS', var_tp='TP', periods=[100])[:8]
+    t = np.linspace(start=0.01, stop=40, num=2000)
+    f_Hs_Tp = st.lognorm.pdf(t, np.sqrt(b1 + b2*np.exp(-b3*h))[:, np.newaxis], scale=np.exp(a1 + a2*h**a3)[:, np.newaxis])
+    pdf_Hs_Tp = pdf_Hs[:, np.newaxis]*f_Hs_Tp
+    curves = stats.aux_funcs.Hs_Tp_curves(ds['HS'].values, pdf_Hs, pdf_Hs_Tp, f_Hs_Tp, h, t, 3, periods=[1, 10, 100])
+    # One call for several periods gives the same contours as one call per period
+    for t3, h3, X, df in curves:
+        t3_, h3_, X_, df_ = stats.aux_funcs.Hs_Tp_curve(ds['HS'].values, pdf_Hs, pdf_Hs_Tp, f_Hs_Tp, h, t, 3, X=X)
+        assert np.array_equal(t3, t3_) and np.array_equal(h3, h3_) and df.equals(df_)
+    # The interpolated crossings lie on the iso-density level ...
+    df = curves[-1][3]
+    rows = np.searchsorted(h, df['hs'])
+    iso = [pdf_Hs[rows]*st.lognorm.pdf(df[tc], np.sqrt(b1 + b2*np.exp(-b3*df['hs'])), scale=np.exp(a1 + a2*df['hs']**a3)) for tc in ['t1', 't2']]
+    iso = np.concatenate(iso)
+    assert np.allclose(iso, np.median(iso), rtol=1e-2, atol=0)
+    iso = np.median(iso)
+    # ... and within one Tp grid step of the grid points found by the find_peaks loop
+    hs_loop, t_loop = [], []
+    for i in range(len(h)):
+        index = find_peaks(1/abs(f_Hs_Tp[i, :] - iso/pdf_Hs[i]))[0]
+        if len(index) == 2:
+            hs_loop.append(h[i])
+            t_loop.append(t[index])
+    common, i_new, i_loop = np.intersect1d(df['hs'], hs_loop, return_indices=True)
+    assert len(common) > 0.95*len(hs_loop)
+    assert np.all(abs(df[['t1', 't2']].values[i_new] - np.array(t_loop)[i_loop]) <= t[1] - t[0])
+    # Gaussian iso-density curves of height 2 - hs/rve, the level is 1: rows with a 
+    # single Tp grid point inside the contour (width below one step) are dropped
+    shape, loc, scale = stats.aux_funcs.Weibull_method_of_moment(ds['HS'].values)
+    rve = st.weibull_min.isf(3/(100*365.2422*24), shape, loc, scale)
+    h, t = np.linspace(0, 2*rve, 201), np.linspace(0, 20, 201)
+    height = 2 - h/rve
+    f = height[:, np.newaxis]*np.exp(-(t-10)**2/(2*0.3**2))
+    df = stats.aux_funcs.Hs_Tp_curve(ds['HS'].values, np.ones_like(h), f, f, h, t, 3, X=100)[3]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        width = 2*0.3*np.sqrt(2*np.log(height))
+    assert np.all(np.isin(h[width > 0.2], df['hs'])) and not np.any(np.isin(h[width < 0.1], df['hs']))
+    assert np.all(df['t2'] - df['t1'] >= 0.1)
+    assert np.allclose(df[['t1', 't2']].values, 10 + np.outer(width[np.searchsorted(h, df['hs'])]/2, [-1, 1]), atol=0.01)
+
+def test_cca_profiles():
+    # Correlated current profiles, the deepest level is missing
+    rng = np.random.default_rng(1)
+    time = pd.date_range('2000-01-01', '2004-12-31 23:00', freq='h')
+    common = rng.weibull(2, len(time))
+    data = pd.DataFrame({f'current_speed_{d}m': 0.5*(1-d/200)*common + 0.1*rng.weibull(2, len(time)) for d in [0, 10, 50, 100]}, index=time)
+    data['current_speed_150m'] = np.nan
+    levels, wcs, cca_prof = stats.cca_profiles(data, var='current_speed_', percentile=99)
+    assert levels == [0, 10, 50, 100] and cca_prof.shape == (4, 4)
+    # Reference with a loop over the worst case level and the other levels
+    prof = data.iloc[:, :4].to_numpy()
+    ref = np.zeros((4, 4))
+    for d in range(4):
+        ref[d, d] = wcs[d]
+        for dd in [i for i in range(4) if i != d]:
+            ref[dd, d] = np.mean(prof[:, dd]) + np.corrcoef(prof[:, d], prof[:, dd])[0][1]*np.std(prof[:, dd])*(wcs[d]-np.mean(prof[:, d]))/np.std(prof[:, d])
+            ref[dd, d] = min(ref[dd, d], wcs[dd])
+    assert np.allclose(wcs, np.percentile(prof, 99, axis=0))
+    assert np.allclose(cca_prof, ref, rtol=1e-10)
+    # The return values of the levels do not depend on the number of processes
+    rv1 = stats.cca_profiles(data, var='current_speed_', return_period=10, n_jobs=1)
+    rv2 = stats.cca_profiles(data, var='current_speed_', return_period=10, n_jobs=2)
+    assert np.array_equal(rv1[1], rv2[1]) and np.array_equal(rv1[2], rv2[2])
+    assert np.isclose(rv1[1][1], stats.RVE_ALL(data, var='current_speed_10m', periods=10, distribution='GUM')[3])
+
+def test_batched_spectra():
+    f = np.linspace(0.03, 0.5, 48)
+    hs, tp = np.array([2, 6, 12, 1]), np.array([6, 11, 16, 15])
+    # One call for N sea states gives the same (N, F) spectra as one call per sea state
+    for spectrum in [stats.spec_funcs.jonswap, stats.spec_funcs.torsethaugen]:
+        sf = spectrum(f, hs, tp)
+        assert sf.shape == (4, 48)
+        assert np.allclose(sf, [spectrum(f, hs[i], tp[i]) for i in range(4)], rtol=1e-12, atol=0)
+    gamma = np.array([1, 2, 3.3, 5])
+    assert np.allclose(stats.spec_funcs.jonswap(f, hs, tp, gamma=gamma), [stats.spec_funcs.jonswap(f, hs[i], tp[i], gamma=gamma[i]) for i in range(4)], rtol=1e-12, atol=0)
+    # Values of the scalar implementation
+    assert np.allclose(stats.spec_funcs.jonswap(np.array([0.08, 0.1, 0.2]), 6, 11), [28.23640891, 36.37383087, 1.98835855])
+    assert np.allclose(stats.spec_funcs.torsethaugen(np.array([0.08, 0.1, 0.2]), 6, 11), [25.99315814, 32.98003893, 2.85505352])
+
+def test_depth_of_wave_influence():
+    hs, tp = np.array([2, 6, 12, 1]), np.array([6, 11, 16, 15])
+    for spectrum, ref in [('JONSWAP', [274, 344.5, 500, 335.5]), ('TORSEHAUGEN', [299.5, 353.5, 500, 321])]:
+        # Arrays of sea states give the same depths as one call per sea state
+        depth = stats.aux_funcs.depth_of_wave_influence(hs, tp, 500, spectrum=spectrum)
+        assert np.array_equal(depth, [stats.aux_funcs.depth_of_wave_influence(hs[i], tp[i], 500, spectrum=spectrum) for i in range(4)])
+        # Depths of the implementation with a loop over the depths
+        assert np.array_equal(depth, ref)
+
+def test_weather_window_simulator():
+    from metocean_stats.plots.general import _weather_window_simulator
+    rng = np.random.default_rng(1)
+    data = pd.DataFrame({'hs': rng.uniform(0, 4, 500), 'wind': rng.uniform(0, 20, 500)},
+                        index=pd.date_range('2000-01-01', periods=500, freq='h'))
+    data.iloc[[10, 11, 250, 498], 0] = np.nan
+    # Constant and varying limits, upper and lower, inclusive and exclusive
+    limits = pd.DataFrame({'hs': [3]*12, ('wind', 'upper', 'exclusive'): np.linspace(15, 10, 12),
+                           ('hs', 'lower', 'inclusive'): [0.5]*6 + [0.2]*6})
+    table = _weather_window_simulator(data, limits.copy())
+    # Naive reference: loop over the starts and the steps of the operation,
+    # operations ending after the last timestamp are not within limits
+    compare = {('upper', 'inclusive'): np.less_equal, ('upper', 'exclusive'): np.less,
+               ('lower', 'inclusive'): np.greater_equal, ('lower', 'exclusive'): np.greater}
+    for (var, edge, inex), lim in zip(table.columns, limits.T.values):
+        values = data[var].values
+        ref = [i+len(lim) <= len(values) and all(compare[(edge, inex)](values[i+k], lim[k]) for k in range(len(lim))) for i in range(len(values))]
+        assert table[(var, edge, inex)].tolist() == ref
+    assert table.iloc[-11:].values.sum() == 0 and not table.iloc[:12, 0].any()
+
+def test_lmoments_fit():
+    # Known parameters are recovered from large samples (scipy conventions)
+    cases = [('GEV', st.genextreme, (0.2, 5, 1.5)), ('GEV', st.genextreme, (-0.2, 5, 1.5)),
+             ('GUM', st.gumbel_r, (5, 1.5)), ('GP', st.genpareto, (0.2, 0, 1.5)), 
+             ('GP', st.genpareto, (-0.2, 0, 1.5)), ('EXP', st.expon, (1, 1.5)), 
+             ('Weibull_2P', st.weibull_min, (1.8, 0, 2)), ('Weibull_3P', st.weibull_min, (1.8, 1, 2))]
+    for dist, scipy_dist, params in cases:
+        x = scipy_dist.rvs(*params, size=100000, random_state=1)
+        fitted = stats.aux_funcs.lmoments_fit(x, dist)
+        if len(params) == 2:
+            assert np.isnan(fitted[0])
+            fitted = fitted[1:]
+        assert np.allclose(fitted, params, rtol=0.03, atol=0.02), (dist, fitted, params)
+    # Sample L-moments of a small sample, from the definition with all pairs and triples
+    x = np.array([3.1, 0.5, 2.2, 7.4, 1.1, 4.0])
+    l1, l2, t3 = stats.aux_funcs.sample_lmoments(x)
+    xs = np.sort(x)
+    i, j, k = np.meshgrid(*[range(6)]*3, indexing='ij')
+    pairs, triples = (i < j)[:, :, 0], (i < j) & (j < k)
+    assert np.isclose(l1, x.mean())
+    assert np.isclose(l2, (xs[j[:, :, 0]] - xs[i[:, :, 0]])[pairs].mean()/2)
+    assert np.isclose(t3*l2, (xs[k] - 2*xs[j] + xs[i])[triples].mean()/3)
+    # 2D input along axis=1 gives the same fits as one call per row
+    X = st.genpareto.rvs(0.1, size=(5, 200), random_state=2)
+    for dist in ['GEV', 'GUM', 'GP', 'EXP', 'Weibull_2P', 'Weibull_3P']:
+        fitted = np.column_stack(stats.aux_funcs.lmoments_fit(X, dist, axis=1))
+        assert np.allclose(fitted, [stats.aux_funcs.lmoments_fit(row, dist) for row in X], equal_nan=True)
+        assert np.allclose(fitted, np.column_stack(stats.aux_funcs.lmoments_fit(X.T, dist)), equal_nan=True)
+
+
+def test_lmom_return_levels(ds=ds):
+    # The L-moments fit of RVE_ALL is the fit of the annual maxima
+    shape, loc, scale, value = stats.RVE_ALL(ds, var='HS', periods=[10, 100], distribution='GEV', method='AM', fit_method='lmom')
+    assert np.allclose([shape, loc, scale], stats.aux_funcs.lmoments_fit(ds['HS'].resample('YE').max(), 'GEV'))
+    # (the return periods are counted in time steps of the series)
+    interval = ((ds.index[-1]-ds.index[0]).days + 1)*24/ds.shape[0]
+    assert np.allclose(value, st.genextreme.isf(interval/(365.2422*24*np.array([10, 100])), shape, loc, scale))
+    # LoNo falls back to maximum likelihood
+    lono = stats.RVE_ALL(ds, var='HS', periods=[10, 100], distribution='LoNo', method='AM', fit_method='lmom')
+    assert np.allclose(lono[3], stats.RVE_ALL(ds, var='HS', periods=[10, 100], distribution='LoNo', method='AM')[3])
+    # POT return levels, threshold sensitivity and bootstrap replicates use the L-moments fit of the excesses
+    excesses = stats.get_pot_extremes(ds['HS'], threshold=4, r='48h') - 4
+    shape, loc, scale = stats.aux_funcs.lmoments_fit(excesses, 'GP')
+    rate = len(excesses)/(ds.index[-1].year - ds.index[0].year + 1)
+    df = stats.return_levels_pot(ds, var='HS', dist='GP', periods=[10, 100], threshold=4, fit_method='lmom')
+    assert np.allclose(df['return_levels'], st.genpareto.isf(1/(rate*np.array([10, 100])), shape, loc, scale) + 4, rtol=1e-3)
+    sensitivity = stats.threshold_sensitivity(ds, var='HS', thresholds=[4], dist_list=['GP'], period=100, fit_method='lmom')
+    assert np.isclose(sensitivity.loc[4, 'GP'], df.loc[100, 'return_levels'])
+    rl = stats.bootstrap_return_levels(excesses, 'GP', [1/(rate*100)], threshold=4, n_boot=20, seed=1, fit_method='lmom')
+    samples = excesses.values[np.random.default_rng(1).integers(0, len(excesses), size=(20, len(excesses)))]
+    assert np.allclose(rl[:, 0], [st.genpareto.isf(1/(rate*100), *stats.aux_funcs.lmoments_fit(sample, 'GP')) + 4 for sample in samples])
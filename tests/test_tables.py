@@ -213,6 +213,20 @@ def test_table_Hmax_crest_return_periods(ds=ds):
     else:
         raise ValueError("Shape is not correct")
 
+def test_table_Hmax_crest_return_periods_long_term(ds=ds):
+    output_file = 'test_table_Hmax_crest_return_periods_long_term.csv'
+    df = tables.table_Hmax_crest_return_periods(ds, var_hs='HS', var_tp='TP', depth=200, periods=[1, 10, 100, 10000], sea_state='long-crested', method='long-term', output_file=output_file)
+    written = pd.read_csv(output_file)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    # The ratio and periods derived from the return period Hs are not mixed with the long-term Hmax
+    assert df['H_max/Hs'].isna().all() and df['T_Hmax(Mean-model) [s]'].isna().all()
+    assert list(written.columns) == ['Return period [years]', 'Hs[m]', 'H_max[m]', 'Crest height[m]']
+    if df.shape == (4, 11) and df['Crest height[m]'].is_monotonic_increasing and df['H_max[m]'].is_monotonic_increasing:
+        pass
+    else:
+        raise ValueError("Shape is not correct")
+
 def test_table_directional_Hmax_return_periods(ds=ds):
     output_file = 'test_table_directional_Hmax_return_periods.csv'
     df = tables.table_directional_Hmax_return_periods(ds, var_hs='HS', var_tp='TP', var_dir='DIRM', periods=[10, 100], adjustment='NORSOK', output_file=output_file)